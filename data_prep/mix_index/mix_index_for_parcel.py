@@ -12,56 +12,33 @@
 # Python Version: 3.x
 #--------------------------------
 
+import os
+import sys
+
 import pandas as pd
 #import arcpy
 #from arcgis.features import GeoAccessor, GeoSeriesAccessor
 
 
-#=============FUNCTIONS=============================================
+# mix index formula is shared with the PPA tool
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'ppa'))
+from mix_index_for_project import mix_index_array
 
-def get_wtd_idx(x, facs, params_df):
-    output = 0
-    
-    for fac in facs:
-        fac_ratio = '{}_ratio'.format(fac)
-        fac_out = x[fac_ratio] * params_df.loc[fac]['weight']
-        output += fac_out
-    
-    return output
-        
-    
-    
+
+#=============FUNCTIONS=============================================
 
 def calc_mix_index(in_df, params_csv, hh_col, lu_factor_cols):
     
     params_df = pd.read_csv(params_csv, index_col = 'lu_fac')
+    lu_facs = list(params_df.index)
     
-    lu_facs = params_df.index
-    
-    for fac in lu_facs:
-        
-        #add column for the "ideal", or "balanced" ratio of that land use to HHs
-        bal_col = "{}_bal".format(fac) 
-        in_df.loc[in_df[hh_col] != 0, bal_col] = in_df[hh_col] * params_df.loc[fac]['bal_ratio_per_hh']
-        
-        #if no HH, set bal_col = -1
-        in_df.fillna(-1)
-        
-        ratio_col = "{}_ratio".format(fac)
-        
-        #if balance value > actual value, return actual value / balance value
-        in_df.loc[(in_df[hh_col] != 0) & (in_df[bal_col] > in_df[fac]), ratio_col] = in_df[fac] / in_df[bal_col]
-    
-        #if balance value < actual value, return balance value / actual value
-        in_df.loc[(in_df[hh_col] != 0) & (in_df[bal_col] < in_df[fac]), ratio_col] = in_df[bal_col] / in_df[fac]
-        
-        #if no HH, set ratio col = -1
-        in_df.fillna(-1)
-        
-    in_df['mix_index_1mi'] = in_df.apply(lambda x: get_wtd_idx(x, lu_facs, params_df), axis = 1)
+    in_df['mix_index_1mi'] = mix_index_array(in_df[hh_col].values, in_df[lu_facs].values,
+                                             params_df.loc[lu_facs, 'bal_ratio_per_hh'].values,
+                                             params_df.loc[lu_facs, 'weight'].values)
     
     return in_df
 
+
 def do_work(in_csv, out_csv, params_csv, input_cols, landuse_cols, col_k12_enr, 
             col_stugrd, col_stuhgh, col_hh):
     parcel_df = pd.read_csv(in_csv, usecols = input_cols)
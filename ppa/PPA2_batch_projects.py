@@ -0,0 +1,243 @@
+# Esri start of added imports
+import sys, os
+try:
+    import arcpy
+except ImportError: # several metrics (intersection density, transit, infill status, etc.) only run with arcpy
+    raise ImportError("PPA2_batch_projects needs arcpy. Run it with the ArcGIS Pro python environment.")
+# Esri end of added imports
+
+"""
+Name: PPA2_batch_projects.py
+Purpose: Run the project performance assessment (PPA) for every project line in a feature class or GeoPackage
+    layer (e.g., all candidate projects for an MTP/SCS cycle), instead of one tool run per project.
+    Each project's type, ADT, speed limit, PCI, etc. come from fields in the input layer (see batch_fld_*
+    in ppa_input_params). Projects are split among a pool of worker processes. Each worker keeps its parcel,
+    model link, and collision data loaded between projects, so that data only get loaded once per worker.
+    Output is one long-format table with a row for each project, metric, and year.
+    Needs arcpy; GeoPackage input is read without arcpy, but projects are still run with arcpy geoprocessing.
+
+Author: Darren Conly
+Last Updated: 10/2026
+Updated by: <name>
+Copyright:   (c) SACOG
+Python Version: 3.x
+"""
+
+import datetime as dt
+import sqlite3
+import tempfile
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import ppa_input_params as params
+import layer_store
+import accessibility_calcs as acc
+import metric_dag
+from project_context import ProjectContext
+import PPA2_master_project as ppa
+import project_metrics
+import ppa_utils as utils
+
+col_projid = 'project_id'
+col_metric = 'metric'
+col_year = 'year'
+col_value = 'value'
+
+batch_fields = [params.batch_fld_projname, params.batch_fld_juris, params.batch_fld_ptype, params.batch_fld_adt,
+                params.batch_fld_speedlim, params.batch_fld_pci]
+
+
+def gpkg_blob_to_wkb(gpkg_blob):
+    '''GeoPackage geometry blob is a header (magic, version, flags, SRS ID, optional envelope), then WKB'''
+    envelope_lens = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+    envelope_code = (gpkg_blob[3] >> 1) & 0x07
+
+    return bytes(gpkg_blob[8 + envelope_lens[envelope_code]:])
+
+
+def read_projects_gpkg(gpkg_path, layer=None):
+    '''project geometries (as WKB) and batch_fields from a GeoPackage layer. Layer must be in the SACOG
+    projection (params.projexn_wkid_sacog)'''
+    conn = sqlite3.connect(gpkg_path)
+    try:
+        geom_cols = conn.execute("SELECT table_name, column_name, srs_id FROM gpkg_geometry_columns").fetchall()
+        if layer is not None:
+            geom_cols = [gc for gc in geom_cols if gc[0] == layer]
+        if not geom_cols:
+            raise ValueError("No layer {} in GeoPackage {}".format(layer, gpkg_path))
+        table_name, geom_col, srs_id = geom_cols[0]
+
+        if srs_id not in (0, -1, params.projexn_wkid_sacog):
+            raise ValueError("Project layer {} has SRS ID {}. Reproject it to {} before running." \
+                             .format(table_name, srs_id, params.projexn_wkid_sacog))
+
+        sql_fields = ', '.join('"{}"'.format(f) for f in [geom_col] + batch_fields)
+        rows = conn.execute('SELECT rowid, {} FROM "{}"'.format(sql_fields, table_name)).fetchall()
+    finally:
+        conn.close()
+
+    df_projects = pd.DataFrame([[r[0], gpkg_blob_to_wkb(r[1])] + list(r[2:]) for r in rows],
+                               columns=[col_projid, 'wkb'] + batch_fields)
+
+    return df_projects
+
+
+def read_projects_fc(fc_projects):
+    '''project geometries (as WKB) and batch_fields from a feature class, projected to SACOG projection'''
+    sref = arcpy.SpatialReference(params.projexn_wkid_sacog)
+    rows = []
+    with arcpy.da.SearchCursor(fc_projects, ['OID@', 'SHAPE@WKB'] + batch_fields, spatial_reference=sref) as cur:
+        for row in cur:
+            rows.append([row[0], bytes(row[1])] + list(row[2:]))
+
+    return pd.DataFrame(rows, columns=[col_projid, 'wkb'] + batch_fields)
+
+
+def read_projects(in_projects, layer=None):
+    if in_projects.lower().endswith('.gpkg'):
+        return read_projects_gpkg(in_projects, layer)
+    else:
+        return read_projects_fc(in_projects)
+
+
+def init_worker(scratch_root):
+    '''Runs once in each worker process, before its first project'''
+    # projects are already run in parallel, so each project's metrics are run one at a time within its worker
+    params.metric_run_mode = metric_dag.run_serial
+
+    arcpy.env.scratchWorkspace = tempfile.mkdtemp(dir=scratch_root)
+    arcpy.env.workspace = params.fgdb
+    arcpy.env.overwriteOutput = True
+
+    # open layer stores once; every project this worker runs then uses the same memory-mapped data
+    store_layers = [params.collisions_fc, params.accdata_fc, params.fc_speed_data]
+    for year in params.analysis_years:
+        store_layers += [params.parcel_poly_fc_yr(year), params.model_links_fc(year)]
+    store_dirs = [params.layer_store_path(fc) for fc in store_layers] \
+        + [params.parcel_pt_store_yr(year) for year in params.analysis_years] \
+        + [params.line_midpt_store(params.model_links_fc(year)) for year in params.analysis_years]
+
+    for store_dir in store_dirs:
+        if layer_store.store_exists(store_dir):
+            layer_store.open_store(store_dir)
+
+    # block group accessibility table and spatial index, shared by every project
+    acc.get_acc_table(params.accdata_fc)
+
+
+def project_to_fc(project_wkb, project_id):
+    '''single-project feature class in the worker's scratch GDB, for metrics that use arcpy geoprocessing'''
+    fc_project = os.path.join(arcpy.env.scratchGDB, 'batch_proj{}'.format(project_id))
+    if arcpy.Exists(fc_project): arcpy.Delete_management(fc_project)
+    proj_geom = arcpy.FromWKB(project_wkb, arcpy.SpatialReference(params.projexn_wkid_sacog))
+    arcpy.CopyFeatures_management([proj_geom], fc_project)
+
+    return fc_project
+
+
+def wide_to_long(df_wide, project_id):
+    '''metrics-as-rows, projval_<year>-as-columns table from PPA2_master_project into project_id/metric/year/value
+    rows. Single-year metrics only have a value for the first analysis year.'''
+    df_long = df_wide.rename_axis(col_metric).reset_index() \
+        .melt(id_vars=col_metric, var_name='col', value_name=col_value)
+    df_long = df_long.dropna(subset=[col_value])
+    df_long[col_year] = df_long['col'].str.split('_').str[-1].astype('int')
+    df_long.insert(0, col_projid, project_id)
+
+    return df_long[[col_projid, col_metric, col_year, col_value]]
+
+
+def run_project(project_row):
+    '''Runs in worker process. Returns (project ID, long-format results df, error message)'''
+    project_id = project_row[col_projid]
+    fc_project = None
+    proj_ctx = None
+    try:
+        project_type = project_row[params.batch_fld_ptype]
+        if project_type == params.ptype_commdesign:
+            adt = speedlim = pci = 0 # not used for community design projects
+        else:
+            adt = int(project_row[params.batch_fld_adt])
+            speedlim = int(project_row[params.batch_fld_speedlim])
+            pci = int(project_row[params.batch_fld_pci])
+
+        fc_project = project_to_fc(project_row['wkb'], project_id)
+        proj_ctx = ProjectContext(fc_project, project_type)
+        project_ctype = ppa.get_proj_ctype(proj_ctx.fc_project, params.comm_types_fc)
+
+        proj_name = utils.remove_forbidden_chars(str(project_row[params.batch_fld_projname]))
+        out_dict_base = {"project_name": proj_name, "jurisdiction": project_row[params.batch_fld_juris],
+                         "project_type": project_type, 'project_aadt': adt, 'project_pci': pci,
+                         'project_speedlim': speedlim, "project_cline_len": proj_ctx.len_mi,
+                         "project_communtype": project_ctype}
+
+        df_wide = project_metrics.get_project_data(proj_ctx.fc_project, project_type, adt, speedlim, out_dict_base,
+                                                   proj_ctx=proj_ctx)
+
+        return project_id, wide_to_long(df_wide, project_id), None
+    except Exception as e:
+        return project_id, None, "{}: {}".format(type(e).__name__, e)
+    finally:
+        # delete scratch layers even if the project failed, so they don't pile up in the worker's scratch GDB
+        try:
+            if proj_ctx is not None: proj_ctx.cleanup()
+            if fc_project is not None and arcpy.Exists(fc_project): arcpy.Delete_management(fc_project)
+        except Exception as e:
+            utils.add_message("WARNING: could not delete scratch data for project {}. {}".format(project_id, e))
+
+
+def run_batch(in_projects, out_csv, layer=None, max_workers=None):
+    '''Run PPA for all projects in in_projects (feature class, or GeoPackage path ending in .gpkg) and write
+    long-format results to out_csv. Returns results df and dict of {project ID: error message} for failed projects.'''
+    max_workers = max_workers if max_workers else params.batch_max_workers
+    df_projects = read_projects(in_projects, layer)
+    utils.add_message("Running PPA for {} projects...".format(df_projects.shape[0]))
+
+    scratch_root = tempfile.mkdtemp(prefix='ppa_batch_', dir=arcpy.env.scratchFolder)
+
+    result_dfs = []
+    errors = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=metric_dag.get_mp_context(),
+                                 initializer=init_worker, initargs=(scratch_root,)) as pool:
+            futures = [pool.submit(run_project, row) for row in df_projects.to_dict('records')]
+            for i, future in enumerate(as_completed(futures)):
+                project_id, df_proj, err_msg = future.result()
+                if err_msg is not None:
+                    errors[project_id] = err_msg
+                    utils.add_message("WARNING: project {} failed. {}".format(project_id, err_msg))
+                else:
+                    result_dfs.append(df_proj)
+                utils.add_message("{} of {} projects done.".format(i + 1, len(futures)))
+    finally:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+    df_out = pd.concat(result_dfs, ignore_index=True) if result_dfs else \
+        pd.DataFrame(columns=[col_projid, col_metric, col_year, col_value])
+    df_out = df_out.sort_values([col_projid, col_year], kind='stable')
+    df_out.to_csv(out_csv, index=False)
+
+    return df_out, errors
+
+
+if __name__ == '__main__':
+    # =====================================USER INPUTS===============================================
+    # feature class, or GeoPackage (.gpkg) path, of project lines with batch_fld_* fields
+    in_projects = sys.argv[1] if len(sys.argv) > 1 else r'I:\Projects\Darren\PPA_V2_GIS\PPA_V2.gdb\MTP_candidate_projects'
+    gpkg_layer = sys.argv[2] if len(sys.argv) > 2 else None # if GeoPackage has 2+ layers, name of project layer
+
+    # =======================BEGIN SCRIPT==============================================================
+    start_time = dt.datetime.now()
+    time_sufx = str(start_time.strftime('%m%d%Y_%H%M'))
+    output_csv = r'C:\TEMP_OUTPUT\PPA_batch_{}.csv'.format(time_sufx)
+
+    arcpy.env.workspace = params.fgdb
+    arcpy.env.overwriteOutput = True
+
+    df_results, failed_projects = run_batch(in_projects, output_csv, layer=gpkg_layer)
+
+    elapsed = dt.datetime.now() - start_time
+    print("Wrote {} ({} projects failed) in {} minutes".format(output_csv, len(failed_projects),
+                                                               round(elapsed.seconds / 60, 1)))
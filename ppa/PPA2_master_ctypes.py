@@ -17,10 +17,13 @@ import pandas as pd
 import ppa_input_params as params
 import accessibility_calcs as acc
 import collisions as coll
+import geom_backend
 import get_buff_netmiles as bufnet
 import intersection_density as intsxn
 from landuse_buff_calcs import LandUseBuffCalcs
+import link_occup_data as link_occ
 import mix_index_for_project as mixidx
+from project_context import ProjectContext
 
 import transit_svc_measure as trn_svc
 
@@ -28,32 +31,33 @@ import transit_svc_measure as trn_svc
 def get_poly_avg(input_poly_fc):
     # as of 11/26/2019, each of these outputs are dictionaries
     pcl_pt_data = params.parcel_pt_fc_yr()
+    poly_ctx = ProjectContext(input_poly_fc, params.ptype_area_agg)
     
-    accdata = acc.get_acc_data(input_poly_fc, params.accdata_fc, params.ptype_area_agg, get_ej=False)
-    collision_data = coll.get_collision_data(input_poly_fc, params.ptype_area_agg, params.collisions_fc, 0)
-    mix_data = mixidx.get_mix_idx(pcl_pt_data, input_poly_fc, params.ptype_area_agg)
-    intsecn_dens = intsxn.intersection_density(input_poly_fc, params.intersections_base_fc, params.ptype_area_agg)
-    bikeway_covg = bufnet.get_bikeway_mileage_share(input_poly_fc, params.ptype_area_agg)
-    tran_stop_density = trn_svc.transit_svc_density(input_poly_fc, params.trn_svc_fc, params.ptype_area_agg)
+    mix_data = mixidx.get_mix_idx(pcl_pt_data, input_poly_fc, params.ptype_area_agg, proj_ctx=poly_ctx)
+    intsecn_dens = intsxn.intersection_density(input_poly_fc, params.intersections_base_fc, params.ptype_area_agg,
+                                               proj_ctx=poly_ctx)
+    bikeway_covg = bufnet.get_bikeway_mileage_share(input_poly_fc, params.ptype_area_agg, proj_ctx=poly_ctx)
+    tran_stop_density = trn_svc.transit_svc_density(input_poly_fc, params.trn_svc_fc, params.ptype_area_agg,
+                                                    proj_ctx=poly_ctx)
 
     emp_ind_wtot = LandUseBuffCalcs(pcl_pt_data, input_poly_fc, params.ptype_area_agg,
-                                    [params.col_empind, params.col_emptot], 0).point_sum()
+                                    [params.col_empind, params.col_emptot], 0, proj_ctx=poly_ctx).point_sum()
     emp_ind_pct = {'EMPIND_jobshare': emp_ind_wtot[params.col_empind] / emp_ind_wtot[params.col_emptot] \
                    if emp_ind_wtot[params.col_emptot] > 0 else 0}
 
     pop_x_ej = LandUseBuffCalcs(pcl_pt_data, input_poly_fc, params.ptype_area_agg, [params.col_pop_ilut],
-                                0, params.col_ej_ind).point_sum()
+                                0, params.col_ej_ind, proj_ctx=poly_ctx).point_sum()
     pop_tot = sum(pop_x_ej.values())
     key_yes_ej = max(list(pop_x_ej.keys()))
     pct_pop_ej = {'Pct_PopEJArea': pop_x_ej[key_yes_ej] / pop_tot if pop_tot > 0 else 0}
 
     job_pop_dens = LandUseBuffCalcs(pcl_pt_data, input_poly_fc, params.ptype_area_agg, \
-                                            [params.col_du, params.col_emptot], 0).point_sum_density()
+                                            [params.col_du, params.col_emptot], 0, proj_ctx=poly_ctx).point_sum_density()
         
     # total_dens = {"job_du_perNetAcre": sum(job_pop_dens.values())}
 
     out_dict = {}
-    for d in [accdata, collision_data, mix_data, intsecn_dens, bikeway_covg, tran_stop_density, pct_pop_ej,\
+    for d in [mix_data, intsecn_dens, bikeway_covg, tran_stop_density, pct_pop_ej,\
               emp_ind_pct, job_pop_dens]:
         out_dict.update(d)
 
@@ -87,15 +91,33 @@ def get_ppa_agg_data(fc_poly_in, poly_id_field, year_base, year_analysis, test_r
     
     output_dict = {}
 
-    # create list of ctypes to loop through
+    # create list of ctypes to loop through. An ID can have more than one feature; they are all selected together below
     with arcpy.da.SearchCursor(fc_poly_in, [poly_id_field]) as cur:
         for row in cur:
-            poly_types_list.append(row[0])
+            if row[0] not in poly_types_list:
+                poly_types_list.append(row[0])
             
     # only do single ctype for test to save time
     if test_run:
         poly_types_list = [poly_types_list[0]]
 
+    # vehicle occupancy for all polygons at once, from one load of the model links. Features are dissolved by ID
+    # first, so each ID gets values for its whole area, the same as the per-ID selection below.
+    backend = geom_backend.get_backend()
+    fs_polys = backend.dissolve(backend.read_features(fc_poly_in, [poly_id_field]), poly_id_field)
+    vehocc_data = link_occ.get_linkoccup_data_multi(fs_polys.geoms, [params.ptype_area_agg] * len(fs_polys),
+                                                    params.model_links_fc(year_analysis))
+    vehocc_by_poly = dict(zip(fs_polys.df[poly_id_field], vehocc_data))
+
+    # base year collision data for all polygons at once, with one point-in-polygon join
+    if year_analysis == year_base:
+        collision_data = coll.get_collision_data_multi(fs_polys.geoms, params.collisions_fc)
+        collision_by_poly = dict(zip(fs_polys.df[poly_id_field], collision_data))
+
+        # base year accessibility for all polygons at once, from one load of the block group data
+        acc_data = acc.get_acc_data_multi(fs_polys.geoms, params.accdata_fc)[0]
+        acc_by_poly = dict(zip(fs_polys.df[poly_id_field], acc_data))
+
     # for each ctype, select polygon feature from cytpes fc and export to temporary single feature fc
     for polytype in poly_types_list:
         
@@ -119,9 +141,12 @@ def get_ppa_agg_data(fc_poly_in, poly_id_field, year_base, year_analysis, test_r
         if year_analysis == year_base:
             print("\ngetting base year values for {} areas...".format(polytype))
             poly_dict = get_poly_avg(temp_poly_fc_fp)
+            poly_dict.update(collision_by_poly[polytype])
+            poly_dict.update(acc_by_poly[polytype])
         else:
             print("\ngetting {} values for {} areas...".format(year_analysis, polytype))
             poly_dict = poly_avg_futyears(temp_poly_fc_fp, year_analysis)
+        poly_dict.update(vehocc_by_poly[polytype])
         
         output_dict[polytype] = poly_dict
         # for all keys in the output dict, add a tag to the key value to indicate community type
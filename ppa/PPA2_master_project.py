@@ -24,29 +24,11 @@ import datetime as dt
 import pandas as pd
 
 import ppa_input_params as params
-import accessibility_calcs as acc
-import collisions as coll
-import complete_street_score as cs
-import get_buff_netmiles as bnmi
-import get_line_overlap as linex
-from get_lutype_acres import GetLandUseArea
-import get_truck_data_fwy as truck_fwy
-import intersection_density as intsxn
-from landuse_buff_calcs import LandUseBuffCalcs
-import link_occup_data as link_occ
-import mix_index_for_project as mixidx
-import npmrds_data_conflation as npmrds
-import transit_svc_measure as trnsvc
-import urbanization_metrics as urbn
+from project_context import ProjectContext
+from project_metrics import get_project_data
 import ppa_utils as utils
 
 
-# Pandas orient values need to be up here so that publishing process does not assign wrong variable.
-# must be global variable
-start_string = '999INDEX'
-df_orient_val = start_string.replace('999','').lower()
-
-
 def get_proj_ctype(in_project_fc, commtypes_fc):
     '''Get project community type, based on which community type has most spatial overlap with project'''
     temp_intersect_fc = os.path.join(arcpy.env.scratchGDB, 'temp_intersect_fc') # don't use "memory", use scratch GDB
@@ -81,149 +63,7 @@ def get_proj_ctype(in_project_fc, commtypes_fc):
         raise ValueError("ERROR: No Community Type identified for project. \n{} project line features." \
                          " {} features in intersect layer.".format(in_project_cnt, in_project_cnt))
 
-    
-
-
-def dissolve_multline_proj(in_project_fc):
-    # if project is multiple non-contiguous lines, combine them to be analyzed as one
-    proj_fcnt = int(arcpy.GetCount_management(in_project_fc)[0])
-    if proj_fcnt > 1:
-        proj_fc_out = os.path.join(arcpy.env.scratchGDB, "project_dissolved")
-        arcpy.Dissolve_management(in_project_fc, proj_fc_out)
-    else:
-        proj_fc_out = in_project_fc
-        
-    return proj_fc_out
-
-
-def get_proj_len(in_project_fc):
-    tot_len = 0
-    
-    with arcpy.da.SearchCursor(in_project_fc, "SHAPE@LENGTH") as cur:
-        for row in cur:
-            tot_len += row[0]
-            
-    len_mi = tot_len / params.ft2mile
-    return len_mi
-
-def get_singleyr_data(fc_project, projtyp, adt, posted_speedlim, out_dict={}):
-    
-    pcl_pt_fc = params.parcel_pt_fc_yr(2016)
-    pcl_poly_fc = params.parcel_poly_fc_yr(2016)
-    
-    accdata = acc.get_acc_data(fc_project, params.accdata_fc, projtyp, get_ej=False)
-    
-    collision_data = coll.get_collision_data(fc_project, projtyp, params.collisions_fc, adt)
-
-    complete_street_score = cs.complete_streets_idx(pcl_pt_fc, fc_project, projtyp, posted_speedlim, params.trn_svc_fc)
-    # complete_street_score = {'complete_street_score': -1} if projtyp == params.ptype_fwy else \
-    #     cs.complete_streets_idx(pcl_pt_fc, fc_project, projtyp, posted_speedlim, params.trn_svc_fc)
-        
-    truck_route_pct = {'pct_proj_STAATruckRoutes': 1} if projtyp == params.ptype_fwy else \
-        linex.get_line_overlap(fc_project, params.freight_route_fc, params.freight_route_fc) # all freeways are STAA truck routes
-        
-    ag_acres = GetLandUseArea(fc_project, projtyp, pcl_poly_fc).get_lu_acres(params.lutype_ag)
-    
-    pct_adt_truck = {"pct_truck_aadt": -1} if projtyp != params.ptype_fwy else truck_fwy.get_tmc_truck_data(fc_project, projtyp)
-    
-    intersxn_data = intsxn.intersection_density(fc_project, params.intersections_base_fc, projtyp)
-    
-    npmrds_data = npmrds.get_npmrds_data(fc_project, projtyp)
-    
-    transit_data = trnsvc.transit_svc_density(fc_project, params.trn_svc_fc, projtyp)
-    
-    bikeway_data = bnmi.get_bikeway_mileage_share(fc_project, params.ptype_sgr)
-    
-    infill_status = urbn.projarea_infill_status(fc_project, params.comm_types_fc)
-    
-    
-    # total job + du density (base year only, for state-of-good-repair proj eval only)
-    job_du_dens = LandUseBuffCalcs(pcl_pt_fc, fc_project, projtyp, [params.col_emptot, params.col_du], 
-                                   params.ilut_sum_buffdist).point_sum_density()
-    comb_du_dens = sum(list(job_du_dens.values()))
-    job_du_dens['job_du_perNetAcre'] = comb_du_dens
-
-    # get EJ data
-    ej_data = LandUseBuffCalcs(pcl_pt_fc, fc_project, projtyp, [ params.col_pop_ilut], params.ilut_sum_buffdist, 
-                               params.col_ej_ind, case_excs_list=[]).point_sum()
-    
-    ej_flag_dict = {0: "Pop_NonEJArea", 1: "Pop_EJArea"}  # rename keys from 0/1 to more human-readable names
-    ej_data = utils.rename_dict_keys(ej_data, ej_flag_dict)
-    total_pop = sum(list(ej_data.values()))
-    ej_data["Pct_PopEJArea"] = ej_data["Pop_EJArea"] / total_pop if total_pop > 0 else 0
-    
-    accdata_ej = acc.get_acc_data(fc_project, params.accdata_fc, projtyp, get_ej=True)  # EJ accessibility data
-    ej_data.update(accdata_ej)
-    
-
-    # for base dict, add items that only have a base year value (no future year values)
-    for d in [accdata, collision_data, complete_street_score, truck_route_pct, pct_adt_truck, ag_acres, intersxn_data,
-              npmrds_data, transit_data, bikeway_data, infill_status, job_du_dens, ej_data]:
-        if d is None:
-            continue
-        else:
-            out_dict_base.update(d)
-            
-
-    outdf = pd.DataFrame.from_dict(out_dict_base, orient=df_orient_val)
-    
-    return outdf
-
-def get_multiyear_data(project_fc, project_type, base_df, analysis_year):
-    
-    ilut_val_fields = [ params.col_pop_ilut, params.col_du, params.col_emptot, params.col_k12_enr, params.col_empind, params.col_persntrip_res] \
-                  + params.ilut_ptrip_mode_fields    
-
-    fc_pcl_pt = params.parcel_pt_fc_yr(year)
-    fc_pcl_poly = params.parcel_poly_fc_yr(year)
-    fc_modelhwylinks = params.model_links_fc(year)
-
-    year_dict = {}
-    # get data on pop, job, k12 totals
-    # point_sum(fc_pclpt, fc_project, project_type, val_fields, buffdist, case_field=None, case_excs_list=[])
-    ilut_buff_vals = LandUseBuffCalcs(fc_pcl_pt, project_fc, project_type, ilut_val_fields,
-                                          params.ilut_sum_buffdist, case_field=None, case_excs_list=[]).point_sum()
-
-    ilut_indjob_share = ilut_buff_vals[params.col_empind] / ilut_buff_vals[params.col_emptot] if ilut_buff_vals[params.col_emptot] > 0 else 0
-    ilut_indjob_dval = {"{}_jobshare".format( params.col_empind): ilut_indjob_share}
-    ilut_buff_vals.update(ilut_indjob_dval)
-
-    # get mode share if total person trips > 0 else return -1 as "no data" value
-    ilut_mode_split = {"{}_share".format(modetrp): ilut_buff_vals[modetrp] / ilut_buff_vals[params.col_persntrip_res]
-                       if ilut_buff_vals[params.col_persntrip_res] != 0 else -1
-                       for modetrp in params.ilut_ptrip_mode_fields}
-    ilut_buff_vals.update(ilut_mode_split)
-
-    # cleanup to remove non-percentage mode split values, if we want to keep output CSV from getting too long.
-    # for trip_numcol in params.ilut_ptrip_mode_fields: del ilut_buff_vals[trip_numcol]
-
-    # job + du total
-    job_du_tot = {"SUM_JOB_DU": ilut_buff_vals[ params.col_du] + ilut_buff_vals[ params.col_emptot]}
 
-    # model-based vehicle occupancy
-    veh_occ_data = link_occ.get_linkoccup_data(project_fc, project_type, fc_modelhwylinks)
-
-    # land use diversity index
-    mix_index_data = mixidx.get_mix_idx(fc_pcl_pt, project_fc, project_type)
-
-    # housing type mix
-    housing_mix_data = LandUseBuffCalcs(fc_pcl_pt, project_fc, project_type, [params.col_du], params.du_mix_buffdist,
-                                            params.col_housing_type, case_excs_list=['Other']).point_sum()
-
-    # acres of "natural resources" (land use type = forest or agriculture)
-    nat_resources_data = urbn.nat_resources(project_fc, project_type, fc_pcl_poly, year)
-
-    # combine into dict
-    for d in [ilut_buff_vals, job_du_tot, veh_occ_data, mix_index_data, housing_mix_data, nat_resources_data]:
-        year_dict.update(d) 
-
-    # make dict into dataframe
-    df_year_out = pd.DataFrame.from_dict(year_dict, orient=df_orient_val)
-    
-    return df_year_out
-
-
-    
 if __name__ == '__main__':    
     # =====================================USER/TOOLBOX INPUTS===============================================
 
@@ -255,7 +95,7 @@ if __name__ == '__main__':
     arcpy.OverwriteOutput = True
     arcpy.env.workspace = params.fgdb
     
-    analysis_years = [2016, 2040]  # which years will be used.
+    analysis_years = params.analysis_years  # which years will be used.
     start_time = dt.datetime.now()
     time_sufx = str(start_time.strftime('%m%d%Y%H%M'))
     
@@ -266,128 +106,116 @@ if __name__ == '__main__':
     
     output_xl = '{}_{}{}.xlsx'.format(ptyp_pfix, os.path.basename(proj_name), time_sufx)  # 'PPA_{}{}.xlsm'.format(os.path.basename(proj_name), time_sufx)  # 
     
-    project_fc = dissolve_multline_proj(project_fc_param) #dissolve if project is multiple non-contiguous lines (like an intersection)
+    # project geometry, length, and buffers are made once here and shared by all metrics
+    proj_ctx = ProjectContext(project_fc_param, project_type) #dissolves if project is multiple non-contiguous lines (like an intersection)
+    try:
+        project_fc = proj_ctx.fc_project
     
-    proj_len_mi = get_proj_len(project_fc)
+        proj_len_mi = proj_ctx.len_mi
     
-    project_ctype = get_proj_ctype(project_fc, params.comm_types_fc)
+        project_ctype = get_proj_ctype(project_fc, params.comm_types_fc)
     
-    out_dict_base = {"project_name": proj_name, "jurisdiction": proj_juris, "project_type": project_type, 'project_aadt': adt, 'project_pci': pci,
-                'project_speedlim': project_speedlim, "project_cline_len": proj_len_mi, "project_communtype": project_ctype}
+        out_dict_base = {"project_name": proj_name, "jurisdiction": proj_juris, "project_type": project_type, 'project_aadt': adt, 'project_pci': pci,
+                    'project_speedlim': project_speedlim, "project_cline_len": proj_len_mi, "project_communtype": project_ctype}
     
 
-    # metrics that only have base year value ------------------------------------
-    outdf_base = get_singleyr_data(project_fc, project_type, adt, project_speedlim, out_dict_base)
-
-    # ---------------------------------------------------------------------------------------------------------
-    # outputs that use both base year and future year values
-    for year in analysis_years:
-        df_year = get_multiyear_data(project_fc, project_type, outdf_base, year)
-        # if it's base year, then append values to bottom of outdf_base,
-        # if it's future year, then left-join the values to the outdf.
-        # table has metrics as rows; years as columns (and will also append     
-        if year == min(analysis_years):
-            out_df = outdf_base.rename(columns={0: 'projval_{}'.format(year)})
-            df_year = df_year.rename(columns={0: 'projval_{}'.format(year)})
-            out_df = out_df.append(df_year)
-        else:
-            df_year = df_year.rename(columns={0: 'projval_{}'.format(year)})
-            out_df = out_df.join(df_year)
+        # single-year metrics and each analysis year run at the same time (see get_project_data())
+        out_df = get_project_data(project_fc, project_type, adt, project_speedlim, out_dict_base,
+                                  analysis_years=analysis_years, proj_ctx=proj_ctx)
     
-    out_df = utils.join_xl_import_template(template_xl, params.xlsx_import_sheet, out_df)
+        out_df = utils.join_xl_import_template(template_xl, params.xlsx_import_sheet, out_df)
 
-    # get community type and regional level data
-    df_aggvals = pd.read_csv( params.aggvals_csv, index_col = 'Unnamed: 0')
-    col_aggvals_year = 'year'
-    region_headname = 'REGION'
-    cols_ctype_reg = [project_ctype, region_headname]
-    aggval_headers = {col: 'CommunityType' for col in df_aggvals.columns if col != region_headname}
+        # get community type and regional level data
+        df_aggvals = pd.read_csv( params.aggvals_csv, index_col = 'Unnamed: 0')
+        col_aggvals_year = 'year'
+        region_headname = 'REGION'
+        cols_ctype_reg = [project_ctype, region_headname]
+        aggval_headers = {col: 'CommunityType' for col in df_aggvals.columns if col != region_headname}
     
-    for year in analysis_years:
-        df_agg_yr = df_aggvals[df_aggvals[col_aggvals_year] == year]  # filter to specific year
-        df_agg_yr = df_agg_yr[cols_ctype_reg]  # only include community types for community types that project is in
-        df_agg_yr = df_agg_yr.rename(columns={project_ctype: 'CommunityType'})
-        df_agg_yr = df_agg_yr.rename(columns={col:'{}_{}'.format(col, year) for col in list(df_agg_yr.columns)})
+        for year in analysis_years:
+            df_agg_yr = df_aggvals[df_aggvals[col_aggvals_year] == year]  # filter to specific year
+            df_agg_yr = df_agg_yr[cols_ctype_reg]  # only include community types for community types that project is in
+            df_agg_yr = df_agg_yr.rename(columns={project_ctype: 'CommunityType'})
+            df_agg_yr = df_agg_yr.rename(columns={col:'{}_{}'.format(col, year) for col in list(df_agg_yr.columns)})
         
-        out_df = out_df.join(df_agg_yr)
+            out_df = out_df.join(df_agg_yr)
     
-    # format user-selected performance outcomes into readable list for rest of script--if input was through argis toolbox
-    performance_outcomes = [outcome.strip("'") for outcome in performance_outcomes.split(';')]
+        # format user-selected performance outcomes into readable list for rest of script--if input was through argis toolbox
+        performance_outcomes = [outcome.strip("'") for outcome in performance_outcomes.split(';')]
     
     
-    if project_type == params.ptype_commdesign:
-        # for community design report, user does not choose which performance outcomes to include. all are included.
-        performance_outcome_sheets = params.perf_outcomes_commdesign
-    else:
-        #convert user-entered perf outcomes to the corresponding excel sheet names
-        performance_outcome_sheets = [params.perf_outcomes_dict[outcome] for outcome in performance_outcomes]
+        if project_type == params.ptype_commdesign:
+            # for community design report, user does not choose which performance outcomes to include. all are included.
+            performance_outcome_sheets = params.perf_outcomes_commdesign
+        else:
+            #convert user-entered perf outcomes to the corresponding excel sheet names
+            performance_outcome_sheets = [params.perf_outcomes_dict[outcome] for outcome in performance_outcomes]
     
     
     
-    out_report = utils.Publish(out_df, template_xl, params.xlsx_import_sheet, output_xl, project_fc, project_type,
-                               performance_outcome_sheets, proj_name)
+        out_report = utils.Publish(out_df, template_xl, params.xlsx_import_sheet, output_xl, project_fc, project_type,
+                                   performance_outcome_sheets, proj_name)
     
-    if include_pdf:
-        try:
-            outputs = out_report.make_pdf() # successful run returns tuple ("ok", output PDF file, output excel file)
+        if include_pdf:
+            try:
+                outputs = out_report.make_pdf() # successful run returns tuple ("ok", output PDF file, output excel file)
+                # if fail, returns tuple ("fail", <error message>)
+                out_status = outputs[0]
+                
+                if out_status == params.msg_ok:
+                    out_excel = outputs[1]
+                    out_pdf = outputs[2]
+        
+                    arcpy.SetParameterAsText(9, out_excel)
+                    arcpy.SetParameterAsText(10, out_pdf) 
+                
+                    end_time = dt.datetime.now()
+                    delta = end_time - start_time
+                    mins_and_secs = divmod(delta.seconds, 60)
+                    arcpy.AddMessage("Success! Tool completed in {} minutes, {} seconds.".format(mins_and_secs[0], mins_and_secs[1]))
+                
+                else: # if making PDF fails, still return the Excel file.
+                    out_excel = outputs[2]
+                
+                    arcpy.AddMessage(outputs[1]) # print error message if error.
+                    arcpy.SetParameterAsText(8, out_excel)
+                    # don't assign anything to output for PDF if error
+            except:
+                pass
+        else:
+            outputs = out_report.make_new_excel() # successful run returns tuple ("ok", output excel file)
             # if fail, returns tuple ("fail", <error message>)
             out_status = outputs[0]
-                
+            
             if out_status == params.msg_ok:
                 out_excel = outputs[1]
-                out_pdf = outputs[2]
-        
+    
                 arcpy.SetParameterAsText(9, out_excel)
-                arcpy.SetParameterAsText(10, out_pdf) 
-                
+            
                 end_time = dt.datetime.now()
                 delta = end_time - start_time
                 mins_and_secs = divmod(delta.seconds, 60)
                 arcpy.AddMessage("Success! Tool completed in {} minutes, {} seconds.".format(mins_and_secs[0], mins_and_secs[1]))
-                
-            else: # if making PDF fails, still return the Excel file.
-                out_excel = outputs[2]
-                
-                arcpy.AddMessage(outputs[1]) # print error message if error.
-                arcpy.SetParameterAsText(8, out_excel)
-                # don't assign anything to output for PDF if error
-        except:
-            pass
-    else:
-        outputs = out_report.make_new_excel() # successful run returns tuple ("ok", output excel file)
-        # if fail, returns tuple ("fail", <error message>)
-        out_status = outputs[0]
             
-        if out_status == params.msg_ok:
-            out_excel = outputs[1]
-    
-            arcpy.SetParameterAsText(9, out_excel)
-            
-            end_time = dt.datetime.now()
-            delta = end_time - start_time
-            mins_and_secs = divmod(delta.seconds, 60)
-            arcpy.AddMessage("Success! Tool completed in {} minutes, {} seconds.".format(mins_and_secs[0], mins_and_secs[1]))
-            
-        else: # if making excel fails, just return error message.
-            out_excel = outputs[1]
-            arcpy.AddMessage(outputs[1]) # print error message if error.
+            else: # if making excel fails, just return error message.
+                out_excel = outputs[1]
+                arcpy.AddMessage(outputs[1]) # print error message if error.
         
-    #--------------------------write to master line FC to save/archive project line------------------
+        #--------------------------write to master line FC to save/archive project line------------------
 
-    str_perf_outcomes = ';'.join(performance_outcomes)
-    str_timestamp = str(start_time.strftime('%Y-%m-%d %H:%M:%S'))
+        str_perf_outcomes = ';'.join(performance_outcomes)
+        str_timestamp = str(start_time.strftime('%Y-%m-%d %H:%M:%S'))
     
-    proj_field_attribs = {"ProjName": proj_name, "Sponsor": proj_juris, "ProjType": project_type, 
-                          "PerfOutcomes": str_perf_outcomes, "ADT": adt, "SpeedLmt": project_speedlim, "PCI": pci, 
-                          "TimeCreated": str_timestamp, "RunSuccess": out_status}
+        proj_field_attribs = {"ProjName": proj_name, "Sponsor": proj_juris, "ProjType": project_type, 
+                              "PerfOutcomes": str_perf_outcomes, "ADT": adt, "SpeedLmt": project_speedlim, "PCI": pci, 
+                              "TimeCreated": str_timestamp, "RunSuccess": out_status}
     
-    append_result = utils.append_proj_to_master_fc(project_fc, proj_field_attribs, params.all_projects_fc)
-
-    # show error if project line isn't archived correctly
-    if append_result[0] == params.msg_ok:
-        pass
-    else:
-        arcpy.AddMessage(append_result[0])
-
-
+        append_result = utils.append_proj_to_master_fc(project_fc, proj_field_attribs, params.all_projects_fc)
 
+        # show error if project line isn't archived correctly
+        if append_result[0] == params.msg_ok:
+            pass
+        else:
+            arcpy.AddMessage(append_result[0])
+    finally:
+        proj_ctx.cleanup() # scratch buffers, layers, and dissolved project line
@@ -1,7 +1,15 @@
 """
 Name: ReplicaDataSummary_latestODComb.py
 
-REQUEST 11/10/2020:
+UPDATE 10/2026 - trip data CSVs are only parsed once per download, then loaded from a memory-mapped
+    columnar store (see trip_table_store.py), instead of re-read each time the trip table is needed.
+    Trips by block group, trip end, mode, and purpose come from one grouped count (see trip_od_pivot.py).
+    Very large downloads (see stream_tripdata) are counted a chunk at a time, with files read in parallel.
+    Trip sheds (and reports) for several cutoffs (pct_cutoffs) can be made in one run, from one cumulative curve.
+    Trip sheds can be based on trip origins, destinations, or both (shed_bases; see REQUEST 11/10/2020), with
+    all bases made in one run from the same trip aggregation.
+
+REQUEST 11/10/2020 (done 10/2026, see shed_bases):
     - be able to choose if you want output trip shed based on # of trip origins,
     # of trip destinations, or combined origins + destinations
 
@@ -37,11 +45,12 @@ import datetime as dt
 
 import pandas as pd
 import arcpy
-import openpyxl
 
 import ppa_utils as utils
 import ppa_input_params as params
 import bigdata_tripshed as tripshed
+import trip_table_store
+import trip_od_pivot
 
     
 
@@ -51,7 +60,8 @@ class TripShedAnalysis(object):
     
     def __init__(self, project_name, in_data_files, data_fields, tripdata_val_field, tripdata_agg_fxn, geom_id_field_orig,
                    geom_id_field_dest, in_poly_fc, poly_id_field, filler_poly_fc, tripdata_case_fields, out_tripshed_gdb,
-                   run_full_report=False, rpt_analysis_years=None, xlsx_template_path=None):
+                   run_full_report=False, rpt_analysis_years=None, xlsx_template_path=None, stream_tripdata=None,
+                   pct_cutoffs=None, shed_bases=None):
         '''
 
         Parameters
@@ -63,7 +73,8 @@ class TripShedAnalysis(object):
         tripdata_val_field : TYPE = pandas dataframe field name
             DESCRIPTION. = field whose values we want (e.g. count of trip IDs, sum of trip distances, average of trip travel times, etc.)
         tripdata_agg_fxn : TYPE = string
-            DESCRIPTION. = type of pandas aggregation function to apply to tripdata_val_field
+            DESCRIPTION. = aggregation to apply to tripdata_val_field: 'count', 'sum', or 'mean' (trip_od_pivot.agg_fxns). Trip data
+            are aggregated from trip counts and value sums, so other pandas aggregations (e.g. median) are not supported
         tripdata_groupby_field : TYPE = pandas dataframe field name
             DESCRIPTION. Group by this field to get the rows of the aggregated trip data (e.g. trips by block group ID, TAZ, etc.)
         in_poly_fc : TYPE = ESRI feature class
@@ -78,6 +89,14 @@ class TripShedAnalysis(object):
             DESCRIPTION. fields in raw trip data for which you want columns made in pivot table (e.g. for trip counts by purpose, mode)
         run_full_report : TYPE, optional boolean flag
             DESCRIPTION. The default is False. Set to true if you want full ILUT demographic analyses run. False means just the trip shed polygon is made
+        stream_tripdata : TYPE, optional boolean flag
+            DESCRIPTION. True to aggregate the trip data CSVs in chunks instead of loading them whole, for downloads too big to fit in memory.
+            The default (None) streams if the CSVs total more than params.replica_stream_min_mb
+        pct_cutoffs : TYPE, optional list of shares of trip end points (e.g. [0.7, 0.8, 0.9])
+            DESCRIPTION. A trip shed polygon (and report, if run_full_report) is made for each. The default (None) makes one shed, with cutoff of 0.8
+        shed_bases : TYPE, optional list of 'orig', 'dest', and/or 'comb'
+            DESCRIPTION. Make trip sheds based on share of trip origins, trip destinations, or combined origins + destinations. Sheds are made
+            for each basis and cutoff. The default (None) is ['comb']
 
         Returns
         -------
@@ -94,6 +113,8 @@ class TripShedAnalysis(object):
         self.data_fields = data_fields
         self.tripdata_val_field = tripdata_val_field
         self.tripdata_agg_fxn = tripdata_agg_fxn
+        if tripdata_agg_fxn not in trip_od_pivot.agg_fxns:
+            raise ValueError("Trip data aggregation '{}' not supported. Use one of {}".format(tripdata_agg_fxn, trip_od_pivot.agg_fxns))
         self.geom_id_field_orig = geom_id_field_orig
         self.geom_id_field_dest = geom_id_field_dest
         self.in_poly_fc = in_poly_fc
@@ -101,6 +122,13 @@ class TripShedAnalysis(object):
         self.filler_poly_fc = filler_poly_fc
         self.analysis_years = rpt_analysis_years
         self.tripdata_case_fields = tripdata_case_fields
+        self.endpt_id_fields = {'orig':self.geom_id_field_orig, 'dest':self.geom_id_field_dest}
+        
+        if stream_tripdata is None:
+            data_mb = sum(os.path.getsize(fpath) for fpath in self.in_data_files) / 1e6
+            stream_tripdata = data_mb > params.replica_stream_min_mb
+        self.stream_tripdata = stream_tripdata
+        self.trip_group_sums = None # made by get_trip_group_sums()
         
         # output options and params
         tripshed_filled_out_name = f"TripShed_{project_name}_{timesufx}"
@@ -116,6 +144,17 @@ class TripShedAnalysis(object):
         self.df_col_endpt_pct = 'pct_of_endpts' # pct of total combined origin + destination pointes
         self.col_endptpctlrank = 'endpts_pctlrank' # how the area/geometry ranks among all others in terms of how many trips start or end in it.
         self.pct_cutoff = 0.8 # sort by descending percent of trips, then sum until this percent of total trips is added.
+        self.pct_cutoffs = sorted(pct_cutoffs) if pct_cutoffs else [self.pct_cutoff] # one trip shed for each
+        self.col_cumsumpct = 'cumul_sum'
+        self.col_shedrank = 'tripshed_rank' # position on cumulative curve; each shed is the polys up to some rank
+        self.cumul_curve = None # made by get_cumul_curve()
+        self.curve_cols = {} # {shed basis: columns get_cumul_curve() added for it}
+        self.shed_basis_comb = 'comb' # shed based on combined origins + destinations; other bases are the endpt_id_fields keys
+        self.shed_basis_names = {'orig': 'trip origins', 'dest': 'trip destinations', self.shed_basis_comb: 'trip end points'}
+        self.shed_bases = shed_bases if shed_bases else [self.shed_basis_comb]
+        bad_bases = [b for b in self.shed_bases if b not in self.shed_basis_names]
+        if bad_bases:
+            raise ValueError("Trip shed bases {} not valid. Use one or more of {}".format(bad_bases, list(self.shed_basis_names.keys())))
         
         #excel workbook tabs that have output fields you want to preserve. You'll left join these to output data dfs
         self.ws_tshed_data = 'df_tshed_data'
@@ -131,25 +170,47 @@ class TripShedAnalysis(object):
         
         
     def make_tripdata_df(self):
-        '''Read in one or more CSVs containing raw trip data and make a pandas dataframe from them'''
-    
-        if len(self.in_data_files) == 1:
-            out_df = pd.read_csv(self.in_data_files[0])
-        else:
-            out_df = pd.read_csv(self.in_data_files[0])
-            for file in self.in_data_files[1:]:
-                out_df2 = pd.read_csv(file, usecols=self.data_fields)
-                out_df = out_df.append(out_df2)
+        '''Trip data from one or more CSVs containing raw trip data, as a pandas dataframe. The CSVs are only parsed
+        the first time they're used; after that the table comes from their trip_table_store store.'''
+        return trip_table_store.load_trip_table(self.in_data_files, self.data_fields,
+                                                id_fields=[self.geom_id_field_orig, self.geom_id_field_dest],
+                                                category_fields=self.tripdata_case_fields)
+    
+    
+    def get_trip_group_sums(self):
+        '''trip counts (and value sums) by trip end, block group, and case value, and by case value for all trips (see
+        trip_od_pivot.group_sums()). Only made once; in streaming mode, the CSVs are read in chunks instead of loaded whole.'''
+        if self.trip_group_sums is None:
+            with_sums = self.tripdata_agg_fxn != trip_od_pivot.agg_count
+            if self.stream_tripdata:
+                self.trip_group_sums = trip_od_pivot.stream_group_sums(self.in_data_files, self.data_fields, self.endpt_id_fields,
+                                                                       self.tripdata_case_fields, self.tripdata_val_field, with_sums,
+                                                                       params.replica_chunk_rows, params.replica_stream_max_workers)
+            else:
+                self.trip_group_sums = trip_od_pivot.group_sums(self.make_tripdata_df(), self.endpt_id_fields,
+                                                                self.tripdata_case_fields, self.tripdata_val_field, with_sums)
         
-        return out_df
+        return self.trip_group_sums
     
     
     def summarize_tripdf(self, groupby_field, val_field, agg_fxn):
         '''taking dataframe in_df, summarize by user-specified agg_fxn (e.g. average, count, sum, etc.)
-        by the user-specified groupby_field (e.g. for trip data, could be mode, origin block group ID, etc.)'''
-        in_df = self.make_tripdata_df()
+        by the user-specified groupby_field (e.g. for trip data, could be mode, origin block group ID, etc.)
+        In streaming mode, only summaries that come from the trip group sums can be made, since the trip table is never loaded whole.'''
+        has_val_sums = self.tripdata_agg_fxn != trip_od_pivot.agg_count # group sums only have value sums if they were needed
+        if groupby_field in self.tripdata_case_fields and val_field == self.tripdata_val_field \
+                and (agg_fxn == trip_od_pivot.agg_count or agg_fxn in trip_od_pivot.agg_fxns and has_val_sums):
+            # from the same aggregation as the block group data, without re-reading the trip data
+            df_gb = trip_od_pivot.case_table(self.get_trip_group_sums()[1], self.tripdata_case_fields.index(groupby_field), agg_fxn)
+            df_gb = df_gb.rename_axis(groupby_field).rename(val_field)
+        elif self.stream_tripdata:
+            raise ValueError("Can't summarize {} of {} by {} from streamed trip data. Only {} of {} by one of {} can be made " \
+                             "without loading the whole trip table.".format(agg_fxn, val_field, groupby_field, self.tripdata_agg_fxn,
+                                                                            self.tripdata_val_field, self.tripdata_case_fields))
+        else:
+            in_df = self.make_tripdata_df()
+            df_gb = in_df.groupby(groupby_field, observed=True)[val_field].agg(agg_fxn)
         
-        df_gb = in_df.groupby(groupby_field)[val_field].agg(agg_fxn)
         df_gb = pd.DataFrame(df_gb).rename(columns={'{}'.format(val_field): '{}'.format(self.col_total_tripends)})
         df_gb['category'] = groupby_field
         
@@ -165,68 +226,20 @@ class TripShedAnalysis(object):
         The categ_cols argument specifies what you want the columns to be (e.g., trips by mode, by purpose, etc.)
         '''
         
-        val_field = self.tripdata_val_field
-        # groupby_field = self.tripdata_groupby_field
-        agg_fxn = self.tripdata_agg_fxn
-        
-        in_df = self.make_tripdata_df()
-        
-        
-        #make a master df to merge to based on shared id
-        endpt_dict = {'orig':self.geom_id_field_orig, 'dest':self.geom_id_field_dest}
-        
-        try:
-            df_masterid = pd.DataFrame(in_df[self.geom_id_field_orig].append(in_df[self.geom_id_field_orig]).unique()) \
-                .rename(columns={0:self.col_master_geom_id})
-            
-            # for each trip end, make a table of block groups with data. E.g.
-                # table 1 = total trips, mode split, purpose split, etc. for all trips starting in block group
-                # table 2 = total trips, etc. for all trips ending in block group.
-            for i, endpt_name in enumerate(endpt_dict.keys()):
-                if i == 0:
-                    piv_final = df_masterid
-                # totals, not cased by anything
-                col_endpt_id = endpt_dict[endpt_name]
-                piv_tot = in_df.pivot_table(values=val_field, index=col_endpt_id, aggfunc=agg_fxn).reset_index()
-                piv_tot = piv_tot.rename(columns={val_field: self.col_tottrips})
-                
-                #return table grouped by poly id with columns for each category (e.g. modes, trip purposes)
-                if len(self.tripdata_case_fields) > 0:
-                    for f in enumerate(self.tripdata_case_fields):
-                        case_type = f[1] # field name
-                        idx = f[0] #enumeration index value
-                        if idx == 0:
-                            piv_out = in_df.pivot_table(values=val_field, index=col_endpt_id, 
-                                                    columns=[case_type], aggfunc=agg_fxn).reset_index()
-                        else:
-                            piv2 = in_df.pivot_table(values=val_field, index=col_endpt_id, 
-                                                    columns=[case_type], aggfunc=agg_fxn).reset_index()
-                            
-                            # if a column exists in two different case types (e.g. "commercial" is both a veh mode and trip purpose)
-                            # then add a tag to differentiate it
-                            for col in piv2.columns:
-                                if col in piv_out.columns and col != col_endpt_id:
-                                    piv2 = piv2.rename(columns={col:'{}_{}'.format(col, idx)})
-                            
-                            piv_out = piv_out.merge(piv2, on=col_endpt_id)
-                    
-                    # merge together each end point version (e.g. merge table with "total trip origins per geom" with 
-                    # "total trip destinations per geom")
-                    piv_i_final = piv_out.merge(piv_tot, on=col_endpt_id)
-                    col_renaming = {f"{col}":f"{col}_{endpt_name}" for col in piv_i_final.columns \
-                                    if col != col_endpt_id}
-                    piv_i_final = piv_i_final.rename(columns=col_renaming)
-                    
-                    piv_final = piv_final.merge(piv_i_final, left_on=self.col_master_geom_id, 
-                                                right_on=col_endpt_id, how='left')
-        except:
-            import pdb;pdb.set_trace()
+        # for each trip end, a table of block groups with data, joined side by side on a master list of all block
+        # groups that are trip origins or destinations. E.g.
+            # table 1 = total trips, mode split, purpose split, etc. for all trips starting in block group
+            # table 2 = total trips, etc. for all trips ending in block group.
+        endpt_dict = self.endpt_id_fields
+        piv_final = trip_od_pivot.od_table(self.get_trip_group_sums()[0], endpt_dict, len(self.tripdata_case_fields),
+                                           self.tripdata_agg_fxn, self.col_tottrips, self.col_master_geom_id)
             
         # add col giving total number of trip end points (either origin or destination) in each geometry
         endpt_keys = [i for i in endpt_dict.keys()]
         col_startpts_cnt = f"{self.col_tottrips}_{endpt_keys[0]}"
         col_endpts_cnt = f"{self.col_tottrips}_{endpt_keys[1]}"
-        piv_final[self.col_total_tripends] = piv_final[col_startpts_cnt] + piv_final[col_endpts_cnt]
+        # geometries that are only origins (or only destinations) have no trips for the other end, so fill those with zero first
+        piv_final[self.col_total_tripends] = piv_final[col_startpts_cnt].fillna(0) + piv_final[col_endpts_cnt].fillna(0)
         
         # add col showing percent of total trips starting in each poly        
         piv_final[self.df_col_endpt_pct] = piv_final[self.col_total_tripends] / piv_final[self.col_total_tripends].sum()  # pct of total trips from each poly
@@ -241,21 +254,90 @@ class TripShedAnalysis(object):
         return piv_final
     
     
-    def filter_cumulpct(self):
-        '''filter input polygon set to only retrieve polygons that capture some majority share (cutoff share, e.g., 90%)of the total trips
-        but selected in descending order of how many trips were created.'''
-        in_df = self.get_poly_data()
+    def basis_cols(self, shed_basis):
+        '''(trip count, share, cumulative share, and shed rank) columns for shed_basis. Combined sheds use the
+        end point columns; origin and destination sheds use their own, tagged with the basis.'''
+        if shed_basis == self.shed_basis_comb:
+            return self.col_total_tripends, self.df_col_endpt_pct, self.col_cumsumpct, self.col_shedrank
         
-        df_sorted = in_df.sort_values(self.df_col_endpt_pct, ascending=False)
+        return tuple(f"{col}_{shed_basis}" for col in [self.col_tottrips, self.df_col_endpt_pct, self.col_cumsumpct, self.col_shedrank])
+    
+    
+    def get_cumul_curve(self):
+        '''polygon data with, for each shed basis, the cumulative share of trips (col_cumsumpct) and position on the curve
+        (col_shedrank) when polygons are sorted in descending order of share of trips. Made once, from one get_poly_data()
+        table, then used for every basis and cutoff.'''
+        if self.cumul_curve is None:
+            df_curve = self.get_poly_data()
+            
+            for shed_basis in self.shed_bases:
+                col_cnt, col_pct, col_cumsum, col_rank = self.basis_cols(shed_basis)
+                self.curve_cols[shed_basis] = [col_cumsum, col_rank]
+                if col_pct not in df_curve.columns:
+                    df_curve[col_pct] = df_curve[col_cnt] / df_curve[col_cnt].sum()
+                    self.curve_cols[shed_basis].append(col_pct)
+                
+                s_sorted = df_curve[col_pct].sort_values(ascending=False)
+                df_curve[col_cumsum] = s_sorted.cumsum()
+                df_curve[col_rank] = pd.Series(range(1, s_sorted.shape[0] + 1), index=s_sorted.index)
+            
+            self.cumul_curve = df_curve
         
-        col_cumsumpct = 'cumul_sum'
-        df_sorted[col_cumsumpct] = df_sorted[self.df_col_endpt_pct].cumsum()
+        return self.cumul_curve
+    
+    
+    def filter_cumulpct(self, pct_cutoff=None, shed_basis=None):
+        '''filter input polygon set to only retrieve polygons that capture some majority share (cutoff share, e.g., 90%)of the total trips
+        but selected in descending order of how many trips were created. Default cutoff is self.pct_cutoff, default basis is
+        the first of self.shed_bases.'''
+        pct_cutoff = pct_cutoff if pct_cutoff is not None else self.pct_cutoff
+        shed_basis = shed_basis if shed_basis is not None else self.shed_bases[0]
+        col_cnt, col_pct, col_cumsum, col_rank = self.basis_cols(shed_basis)
+        df_curve = self.get_cumul_curve()
         
-        df_out = df_sorted[df_sorted[col_cumsumpct] <= self.pct_cutoff]
+        df_out = df_curve[df_curve[col_cumsum] <= pct_cutoff].sort_values(col_rank)
         
         return df_out
     
     
+    def get_raw_shed_data(self):
+        '''polygon data for the raw trip shed polygons: every polygon that is in the largest shed of any basis'''
+        df_curve = self.get_cumul_curve()
+        max_cutoff = max(self.pct_cutoffs)
+        in_any_shed = pd.Series(False, index=df_curve.index)
+        for shed_basis in self.shed_bases:
+            in_any_shed = in_any_shed | (df_curve[self.basis_cols(shed_basis)[2]] <= max_cutoff)
+        
+        return df_curve[in_any_shed]
+    
+    
+    def shed_sufx(self, pct_cutoff, shed_basis):
+        '''tag added to output names if more than one basis or cutoff is run, e.g. "_orig_80pct"'''
+        basis_sufx = '' if len(self.shed_bases) == 1 else '_{}'.format(shed_basis)
+        cutoff_sufx = '' if len(self.pct_cutoffs) == 1 else '_{}pct'.format(int(round(pct_cutoff * 100)))
+        
+        return basis_sufx + cutoff_sufx
+    
+    
+    def make_cutoff_raw_poly(self, pct_cutoff, shed_basis):
+        '''raw trip shed polygons for pct_cutoff and shed_basis, from the raw polygons made for all sheds (which already have
+        all data fields), so that each larger shed of a basis only adds polygons to the one before it. Shed rank fields, and
+        other bases' curve fields, are only used to pick the polygons, so they are deleted; the output has the same fields
+        as a single shed made on its own: the trip data plus the basis's cumulative share (cumul_sum, or e.g. cumul_sum_orig).'''
+        col_cumsum, col_rank = self.basis_cols(shed_basis)[2:]
+        max_rank = self.filter_cumulpct(pct_cutoff, shed_basis).shape[0]
+        
+        fc_cutoff_raw = "{}_shed{}".format(self.out_poly_fc_raw, self.shed_sufx(pct_cutoff, shed_basis))
+        if arcpy.Exists(fc_cutoff_raw): arcpy.Delete_management(fc_cutoff_raw)
+        arcpy.FeatureClassToFeatureClass_conversion(self.out_poly_fc_raw, os.path.dirname(fc_cutoff_raw), os.path.basename(fc_cutoff_raw),
+                                                    "{} <= {}".format(col_rank, max_rank))
+        
+        drop_cols = [col for cols in self.curve_cols.values() for col in cols if col != col_cumsum]
+        arcpy.DeleteField_management(fc_cutoff_raw, drop_cols)
+        
+        return fc_cutoff_raw
+    
+    
     # poly creation process should probably be made into a CLASS and complete these basic steps:
 
 
@@ -325,12 +407,12 @@ class TripShedAnalysis(object):
                 else: row[1] = 0
                 cur.updateRow(row)
     
-    def make_filled_tripshed_poly(self, in_df):
+    def make_filled_tripshed_poly(self, raw_tripshed_fc, fc_tripshed_out_filled):
         '''Fills in gaps in trip shed polygon to ensure area includes empty areas that, if developed,
         would fall in the link trip shed. 
         
         Key steps:
-            1 - create raw trip shed polygon based on whatever poly IDs are within the raw downloaded trip table
+            1 - raw trip shed polygon (raw_tripshed_fc) based on whatever poly IDs are within the raw downloaded trip table
             2 - join this raw polygon set to a "full" poly file (e.g. all block groups in region)
             3 - tag polys in the trip shed
             4 - spatial select non-trip-shed polys that share a line segment with trip shed polys
@@ -345,14 +427,10 @@ class TripShedAnalysis(object):
         
         
         full_poly_fc = self.in_poly_fc
-        raw_tripshed_fc = self.out_poly_fc_raw
         filler_fc = self.filler_poly_fc
         
         scratch_gdb = arcpy.env.scratchGDB
         
-        self.create_raw_tripshed_poly(in_df)  # Make trip shed polygon
-
-        
         fl_full_poly = 'fl_full_poly'
         fl_tripshed = 'fl_tripshed'
         
@@ -458,8 +536,8 @@ class TripShedAnalysis(object):
 
         # Merge the "hole fillers" with the expanded trip shed (i.e., raw trip shed + "share a line segment" polys added to it).
         # Result will be block group trip shed, with the holes filled in with non-block-group “hole filler” polygons       
-        if arcpy.Exists(self.fc_tripshed_out_filled): arcpy.Delete_management(self.fc_tripshed_out_filled)
-        arcpy.Merge_management([temp_fc_step2_path, temp_singleprt_polys_fl], self.fc_tripshed_out_filled)
+        if arcpy.Exists(fc_tripshed_out_filled): arcpy.Delete_management(fc_tripshed_out_filled)
+        arcpy.Merge_management([temp_fc_step2_path, temp_singleprt_polys_fl], fc_tripshed_out_filled)
         
         for fc in [temp_joined_fc_path, temp_fc_step2_path, temp_union_fc_path, temp_singleprt_polys_fc_path]:
             try:
@@ -504,54 +582,64 @@ class TripShedAnalysis(object):
         
         # summarize by polygon and whatever case value
         "aggregating Replica trip data for each polygon within trip shed..."
-        df_linktripsummary = pd.DataFrame()
-        
-        for f in tripdata_case_fields:
-            df = self.summarize_tripdf(f, self.tripdata_val_field, self.tripdata_agg_fxn)
-            df_linktripsummary = df_linktripsummary.append(df)
+        df_linktripsummary = pd.concat([self.summarize_tripdf(f, self.tripdata_val_field, self.tripdata_agg_fxn)
+                                        for f in self.tripdata_case_fields])
     
         # filter out block groups that don't meet inclusion criteria (remove polys that have few trips, but keep enough polys to capture X percent of all trips)
         #e.g., setting cutoff=0.9 means that, in descending order of trip production, block groups will be included until 90% of trips are accounted for.
-        df_outdata = self.filter_cumulpct()
-    
-        # make new polygon feature class with trip data
-        self.make_filled_tripshed_poly(df_outdata)
-        
-        # get PPA buffer data for trip shed (including all ILUT data, etc.)
-        if self.run_full_report and self.xlsx_template:
-            arcpy.AddMessage("\nsummarizing PPA metrics for trip shed polygon...")
-            df_tsheddata = tripshed.get_tripshed_data(self.fc_tripshed_out_filled, params.ptype_area_agg, 
-                                                      self.analysis_years, params.aggvals_csv, base_dict={})
-            df_tsheddata = df_tsheddata.reset_index()
-            df_tshed_data_out = self.join2xl_import_template(self.xlsx_template, self.ws_tshed_data, df_tsheddata, df_tsheddata.columns[0])
-            del df_tshed_data_out['index']
-
+        # polygons and their data fields are made once, for the largest cutoff of every basis; the shed for each basis and
+        # cutoff is the part of them that's within that cutoff on the basis's cumulative curve.
+        self.create_raw_tripshed_poly(self.get_raw_shed_data())
+        
+        run_report = self.run_full_report and self.xlsx_template
+        if run_report:
+            # trip mode and purpose splits are the same for every cutoff
             df_trip_modes = df_linktripsummary.loc[df_linktripsummary['category'] == csvcol_mode]
             df_trip_modes_out = self.join2xl_import_template(self.xlsx_template, self.ws_trip_modes, df_trip_modes, csvcol_mode)
             
             df_trip_purposes = df_linktripsummary.loc[df_linktripsummary['category'] == csvcol_purpose]
             df_trip_purposes_out = self.join2xl_import_template(self.xlsx_template, self.ws_trip_purposes, df_trip_purposes, csvcol_purpose)
-            
-            
-            # dict_out = {df_tshed_data_out: self.ws_tshed_data, df_trip_modes_out: self.ws_trip_modes, df_trip_purposes_out: self.ws_trip_purposes}
-            dict_out = {self.ws_tshed_data: df_tshed_data_out, self.ws_trip_modes: df_trip_modes_out, self.ws_trip_purposes: df_trip_purposes_out}
-
-            # overwrite the import tab sheets
-            wb = openpyxl.load_workbook(self.xlsx_template)
-            for ws, df in dict_out.items():
-                self.overwrite_df_to_xlsx(wb, ws, df)
-            
-            #then save as output excel file
-            wb.save(self.xlsx_out)
-            wb.close()
-            
-            arcpy.AddMessage("Success! output Excel Summary - {}".format(self.xlsx_out))
-            
-            t_returns = ("Yes report", self.xlsx_out)
-
+        
+        out_fcs = []
+        out_xlsxs = []
+        sheds = [(shed_basis, pct_cutoff) for shed_basis in self.shed_bases for pct_cutoff in self.pct_cutoffs]
+        for shed_basis, pct_cutoff in sheds:
+            # make new polygon feature class with trip data
+            arcpy.AddMessage("\nmaking trip shed with {}% of {}...".format(int(round(pct_cutoff * 100)), self.shed_basis_names[shed_basis]))
+            fc_tripshed_out_filled = "{}{}".format(self.fc_tripshed_out_filled, self.shed_sufx(pct_cutoff, shed_basis))
+            self.make_filled_tripshed_poly(self.make_cutoff_raw_poly(pct_cutoff, shed_basis), fc_tripshed_out_filled)
+            out_fcs.append(fc_tripshed_out_filled)
+        
+            # get PPA buffer data for trip shed (including all ILUT data, etc.)
+            if run_report:
+                arcpy.AddMessage("\nsummarizing PPA metrics for trip shed polygon...")
+                df_tsheddata = tripshed.get_tripshed_data(fc_tripshed_out_filled, params.ptype_area_agg, 
+                                                          self.analysis_years, params.aggvals_csv, base_dict={})
+                df_tsheddata = df_tsheddata.reset_index()
+                df_tshed_data_out = self.join2xl_import_template(self.xlsx_template, self.ws_tshed_data, df_tsheddata, df_tsheddata.columns[0])
+                del df_tshed_data_out['index']
+                
+                # dict_out = {df_tshed_data_out: self.ws_tshed_data, df_trip_modes_out: self.ws_trip_modes, df_trip_purposes_out: self.ws_trip_purposes}
+                dict_out = {self.ws_tshed_data: df_tshed_data_out, self.ws_trip_modes: df_trip_modes_out, self.ws_trip_purposes: df_trip_purposes_out}
+    
+                # overwrite the import tab sheets
+                wb = utils.get_template_workbook(self.xlsx_template)
+                for ws, df in dict_out.items():
+                    self.overwrite_df_to_xlsx(wb, ws, df)
+                
+                #then save as output excel file
+                xlsx_out = "{}{}.xlsx".format(os.path.splitext(self.xlsx_out)[0], self.shed_sufx(pct_cutoff, shed_basis))
+                wb.save(xlsx_out)
+                wb.close()
+                
+                arcpy.AddMessage("Success! output Excel Summary - {}".format(xlsx_out))
+                out_xlsxs.append(xlsx_out)
+        
+        if run_report:
+            t_returns = ("Yes report", ";".join(out_xlsxs))
         else:
             arcpy.AddMessage('trip shed report not run')
-            t_returns = ("No report", self.fc_tripshed_out_filled)
+            t_returns = ("No report", ";".join(out_fcs))
             
         return t_returns
 
@@ -586,6 +674,9 @@ if __name__ == '__main__':
     
     years = [2016, 2040] # analysis years for ILUT data
     
+    tripshed_pct_cutoffs = [0.8] # a trip shed is made for each share of trip end points, e.g. [0.7, 0.8, 0.9]
+    tripshed_bases = ['comb'] # base trip sheds on trip origins ('orig'), destinations ('dest'), and/or both ('comb')
+    
     xlsx_template = os.path.join(params.template_dir, "Replica_Summary_Template.xlsx")
     
 
@@ -600,7 +691,7 @@ if __name__ == '__main__':
     
     trip_shed = TripShedAnalysis(proj_name, tripdata_files, trip_data_fields, csvcol_valfield, val_aggn_type, csvcol_obgid,
                    csvcol_dbgid, fc_bg_in, fc_poly_id_field, fc_filler, tripdata_case_fields, tripshed_out_gdb, 
-                   run_full_shed_report, years, xlsx_template)
+                   run_full_shed_report, years, xlsx_template, pct_cutoffs=tripshed_pct_cutoffs, shed_bases=tripshed_bases)
     
     outputs = trip_shed.make_trip_shed_report()
     trip_shed.get_poly_data(categ_cols=[tripdata_case_fields])
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -10,74 +14,161 @@ g_ESRI_variable_2 = 'fl_project'
 # --------------------------------
 # Name: accessibility_calcs.py
 # Purpose: PPA accessibility metrics using Sugar-access polygons (default is census block groups)
-#
+#           The block group table and its spatial index are loaded once per process (get_acc_table()), and both
+#           the population-weighted and EJ-weighted averages come from one selection of block groups.
 #
 # Author: Darren Conly
-# Last Updated: <date>
+# Last Updated: 10/2026
 # Updated by: <name>
 # Copyright:   (c) SACOG
 # Python Version: 3.x
 # --------------------------------
 import time
-import arcpy
+
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    shapely = None
 
 import ppa_input_params as params
 import ppa_utils as utils
+import geom_backend
+from project_context import ProjectContext
 
+# params.acc_cols is a subset of params.acc_cols_ej, so acc_cols_ej has all accessibility columns
+accdata_fields = [params.col_geoid, params.col_acc_ej_ind, params.col_pop] + params.acc_cols_ej
 
-def get_acc_data(fc_project, fc_accdata, project_type, get_ej=False):
-    '''Calculate average accessibility to selected destination types for all
-    polygons that either intersect the project line or are within a community type polygon.
-    Average accessibility is weighted by each polygon's population.'''
-    
-    arcpy.AddMessage("Calculating accessibility metrics...")
-    
-    sufx = int(time.perf_counter()) + 1
-    fl_accdata = os.path.join('memory','fl_accdata{}'.format(sufx))
-    fl_project = g_ESRI_variable_2
+_acc_tables = {}
+
+
+class AccessData(object):
+    '''Block group accessibility values (params.acc_cols_ej), population, and EJ flag as NumPy arrays, plus a
+    spatial index (shapely STRtree) of the block groups if bg_geoms are given. Weighted averages for any number of
+    geometries are then done in one vectorized pass, without re-selecting or re-reading the block groups.'''
+    def __init__(self, df_accdata, bg_geoms=None):
+        self.acc_vals = df_accdata[params.acc_cols_ej].to_numpy(dtype='float64')
+        self.pop = np.nan_to_num(df_accdata[params.col_pop].to_numpy(dtype='float64'))
+        self.ej_ind = np.nan_to_num(df_accdata[params.col_acc_ej_ind].to_numpy(dtype='float64'))
+        self.tree = shapely.STRtree(np.asarray(bg_geoms)) if bg_geoms is not None else None
+
+    def select_pairs(self, geoms, searchdist):
+        '''(index in geoms, block group row) for each block group within searchdist of each of the shapely geoms'''
+        geoms = np.asarray(geoms)
+        if searchdist > 0:
+            pairs = self.tree.query(geoms, predicate='dwithin', distance=searchdist)
+        else:
+            pairs = self.tree.query(geoms, predicate='intersects')
+
+        return pairs[0], pairs[1]
+
+    def acc_averages(self, geom_idx, bg_idx, n_geoms):
+        '''For each geometry, average accessibility of the block groups paired with it (geom_idx[i] paired with
+        block group bg_idx[i]). Returns (list of population-weighted dicts, list of EJ population-weighted dicts).'''
+        pop = self.pop[bg_idx]
+        ej_pop = pop * self.ej_ind[bg_idx]
+        acc_vals = self.acc_vals[bg_idx]
+        has_val = ~np.isnan(acc_vals)
+        acc_vals = np.where(has_val, acc_vals, 0) # null values are left out of sums, as with pandas sum()
+
+        sums_by_geom = lambda vals: np.stack([np.bincount(geom_idx, weights=vals[:, j], minlength=n_geoms)
+                                              for j in range(vals.shape[1])], axis=1)
+        tot_pop = np.bincount(geom_idx, weights=pop, minlength=n_geoms)[:, None]
+        tot_ej_pop = np.bincount(geom_idx, weights=ej_pop, minlength=n_geoms)[:, None]
+        wtd_sums = sums_by_geom(acc_vals * pop[:, None])
+        ej_wtd_sums = sums_by_geom(acc_vals * ej_pop[:, None])
+        val_sums = sums_by_geom(acc_vals)
+        val_cnts = sums_by_geom(has_val.astype('float64'))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # if no one lives near project, get unweighted avg accessibility of block groups near project
+            acc_avgs = np.where(tot_pop > 0, wtd_sums / tot_pop, val_sums / val_cnts)
+            # for enviro justice population, weight by population for EJ polygons only
+            ej_avgs = np.where(tot_ej_pop > 0, ej_wtd_sums / tot_ej_pop, 0)
+
+        col_pos = {col: j for j, col in enumerate(params.acc_cols_ej)}
+        out_dicts = [{col: acc_avgs[i, col_pos[col]] for col in params.acc_cols} for i in range(n_geoms)]
+        out_dicts_ej = [{"{}_EJ".format(col): ej_avgs[i, col_pos[col]] for col in params.acc_cols_ej}
+                        for i in range(n_geoms)]
+
+        return out_dicts, out_dicts_ej
+
+
+def get_acc_table(fc_accdata):
+    '''AccessData of all block groups in fc_accdata, with spatial index. Made once per process.'''
+    if _acc_tables.get(fc_accdata) is None:
+        fs_accdata = geom_backend.get_backend(geom_backend.name_shapely).read_features(fc_accdata, accdata_fields)
+        _acc_tables[fc_accdata] = AccessData(fs_accdata.df, fs_accdata.geoms)
+
+    return _acc_tables[fc_accdata]
 
-    if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-    arcpy.MakeFeatureLayer_management(fc_project, fl_project)
 
-    if arcpy.Exists(fl_accdata): arcpy.Delete_management(fl_accdata)
-    arcpy.MakeFeatureLayer_management(fc_accdata, fl_accdata)
+def acc_searchdist(project_type):
+    '''distance from project within which block groups are tagged; polygons only use block groups they intersect'''
+    return 0 if project_type == params.ptype_area_agg else params.bg_search_dist
+
+
+def get_acc_data_multi(geoms, fc_accdata, project_type=params.ptype_area_agg):
+    '''get_acc_data() for many geometries (e.g. all community type polygons) at once, both population-weighted and
+    EJ population-weighted. Block groups are selected for all geometries with one spatial index query.
+    Returns (list of dicts, list of EJ dicts), one dict per geometry.'''
+    utils.add_message("Calculating accessibility metrics...")
+
+    shapely_backend = geom_backend.get_backend(geom_backend.name_shapely)
+    acc_table = get_acc_table(fc_accdata)
+    geom_idx, bg_idx = acc_table.select_pairs([shapely_backend.to_native(g) for g in geoms],
+                                              acc_searchdist(project_type))
+
+    return acc_table.acc_averages(geom_idx, bg_idx, len(geoms))
+
+
+def get_acc_data_with_ej(fc_project, fc_accdata, project_type, proj_ctx=None):
+    '''Returns (get_acc_data(get_ej=False), get_acc_data(get_ej=True)) from one selection of block groups'''
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, project_type)
+
+    if not proj_ctx.use_gp_tools and proj_ctx.backend.name == geom_backend.name_shapely:
+        # block group table and its spatial index are shared by every project run in this process
+        acc_dicts, acc_dicts_ej = get_acc_data_multi([proj_ctx.shape], fc_accdata, project_type)
+        return acc_dicts[0], acc_dicts_ej[0]
+
+    utils.add_message("Calculating accessibility metrics...")
 
     # select polygons that intersect with the project line
-    searchdist = 0 if project_type == params.ptype_area_agg else params.bg_search_dist
-    arcpy.SelectLayerByLocation_management(fl_accdata, "INTERSECT", fl_project, searchdist, "NEW_SELECTION")
+    searchdist = acc_searchdist(project_type)
 
-    # read accessibility data from selected polygons into a dataframe
-    accdata_fields = [params.col_geoid, params.col_acc_ej_ind, params.col_pop] + params.acc_cols_ej
-    accdata_df = utils.esri_object_to_df(fl_accdata, accdata_fields)
+    if proj_ctx.use_gp_tools:
+        sufx = int(time.perf_counter()) + 1
+        fl_accdata = os.path.join('memory','fl_accdata{}'.format(sufx))
+        fl_project = proj_ctx.fl_project
 
-    # get pop-weighted accessibility values for all accessibility columns
+        if arcpy.Exists(fl_accdata): arcpy.Delete_management(fl_accdata)
+        arcpy.MakeFeatureLayer_management(fc_accdata, fl_accdata)
+
+        arcpy.SelectLayerByLocation_management(fl_accdata, "INTERSECT", fl_project, searchdist, "NEW_SELECTION")
 
-    out_dict = {}
-    if get_ej: # if for enviro justice population, weight by population for EJ polygons only.
-        for col in params.acc_cols_ej:
-            col_wtd = "{}_wtd".format(col)
-            col_ej_pop = "{}_EJ".format(params.col_pop)
-            accdata_df[col_wtd] = accdata_df[col] * accdata_df[params.col_pop] * accdata_df[params.col_acc_ej_ind]
-            accdata_df[col_ej_pop] = accdata_df[params.col_pop] * accdata_df[params.col_acc_ej_ind]
-            
-            tot_ej_pop = accdata_df[col_ej_pop].sum()
-            
-            out_wtd_acc = accdata_df[col_wtd].sum() / tot_ej_pop if tot_ej_pop > 0 else 0
-            col_out_ej = "{}_EJ".format(col)
-            out_dict[col_out_ej] = out_wtd_acc
+        # read accessibility data from selected polygons into a dataframe
+        accdata_df = utils.esri_object_to_df(fl_accdata, accdata_fields)
     else:
-        total_pop = accdata_df[params.col_pop].sum()
-        for col in params.acc_cols:
-            if total_pop <= 0: # if no one lives near project, get unweighted avg accessibility of block groups near project
-                out_wtd_acc = accdata_df[col].mean()
-            else:
-                col_wtd = "{}_wtd".format(col)
-                accdata_df[col_wtd] = accdata_df[col] * accdata_df[params.col_pop]
-                out_wtd_acc = accdata_df[col_wtd].sum() / total_pop
-                
-            out_dict[col] = out_wtd_acc
-
-    return out_dict
+        backend = proj_ctx.backend
+        fs_accdata = backend.read_features(fc_accdata, accdata_fields)
+        acc_idx = backend.select_by_location(fs_accdata, proj_ctx.shape, geom_backend.rel_intersect, searchdist)
+        accdata_df = fs_accdata.df.iloc[acc_idx].reset_index(drop=True)
+
+    # get pop-weighted accessibility values for all accessibility columns
+    n_bgs = accdata_df.shape[0]
+    acc_dicts, acc_dicts_ej = AccessData(accdata_df).acc_averages(np.zeros(n_bgs, dtype='int64'), np.arange(n_bgs), 1)
+
+    return acc_dicts[0], acc_dicts_ej[0]
+
+
+def get_acc_data(fc_project, fc_accdata, project_type, get_ej=False, proj_ctx=None):
+    '''Calculate average accessibility to selected destination types for all
+    polygons that either intersect the project line or are within a community type polygon.
+    Average accessibility is weighted by each polygon's population.'''
+    acc_dict, acc_dict_ej = get_acc_data_with_ej(fc_project, fc_accdata, project_type, proj_ctx=proj_ctx)
+
+    return acc_dict_ej if get_ej else acc_dict
 
 
 if __name__ == '__main__':
@@ -17,43 +17,52 @@ import pandas as pd
 
 import ppa_input_params as params
 import accessibility_calcs as acc
-from get_lutype_acres import GetLandUseArea
+from get_lutype_acres import GetLandUseArea, get_lutype_areas
 from landuse_buff_calcs import LandUseBuffCalcs
+from metric_dag import MetricNode, DepResult, run_dag
 import mix_index_for_project as mixidx
+from project_context import ProjectContext
 import urbanization_metrics as urbn
 import ppa_utils as utils
+
+# buffer distances used through proj_ctx.buffer_fc(); made before the metric nodes are sent to worker processes
+tripshed_buffdists = [params.ilut_sum_buffdist] # land use type overlay
     
 
-def get_singleyr_data(fc_tripshedpoly, projtyp, analysis_year, out_dict_base={}):
+def get_singleyr_data(fc_tripshedpoly, projtyp, analysis_year, out_dict_base={}, proj_ctx=None, lutype_areas=None):
     fc_pcl_pt = params.parcel_pt_fc_yr(analysis_year)
     fc_pcl_poly = params.parcel_poly_fc_yr(analysis_year)
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_tripshedpoly, projtyp)
     
     print("getting accessibility data for base...")
-    accdata = acc.get_acc_data(fc_tripshedpoly, params.accdata_fc, projtyp, get_ej=False)
+    accdata, accdata_ej = acc.get_acc_data_with_ej(fc_tripshedpoly, params.accdata_fc, projtyp, proj_ctx=proj_ctx)
         
     print("getting ag acreage data for base...")
-    ag_acres = GetLandUseArea(fc_tripshedpoly, projtyp, fc_pcl_poly).get_lu_acres(params.lutype_ag)
+    ag_acres = GetLandUseArea(fc_tripshedpoly, projtyp, fc_pcl_poly, proj_ctx=proj_ctx,
+                              lutype_areas=lutype_areas).get_lu_acres(params.lutype_ag)
     
     # total job + du density (base year only, for state-of-good-repair proj eval only)
     print("getting ILUT data for base...")
     job_du_dens = LandUseBuffCalcs(fc_pcl_pt, fc_tripshedpoly, projtyp, [params.col_emptot, params.col_du],
-                                   params.ilut_sum_buffdist).point_sum_density()
+                                   params.ilut_sum_buffdist, proj_ctx=proj_ctx).point_sum_density()
     comb_du_dens = sum(list(job_du_dens.values()))
     job_du_dens['job_du_perNetAcre'] = comb_du_dens
 
     # get EJ data
     print("getting EJ data for base...")
     ej_data = LandUseBuffCalcs(fc_pcl_pt, fc_tripshedpoly, projtyp, [params.col_pop_ilut], params.ilut_sum_buffdist, 
-                               params.col_ej_ind, case_excs_list=[]).point_sum()
+                               params.col_ej_ind, case_excs_list=[], proj_ctx=proj_ctx).point_sum()
     
     ej_flag_dict = {0: "Pop_NonEJArea", 1: "Pop_EJArea"}  # rename keys from 0/1 to more human-readable names
     ej_data = utils.rename_dict_keys(ej_data, ej_flag_dict)
     ej_data["Pct_PopEJArea"] = ej_data["Pop_EJArea"] / sum(list(ej_data.values()))
     
-    accdata_ej = acc.get_acc_data(fc_tripshedpoly, params.accdata_fc, projtyp, get_ej=True)  # EJ accessibility data
-    ej_data.update(accdata_ej)
+    ej_data.update(accdata_ej)  # EJ accessibility data
 
     # for base dict, add items that only have a base year value (no future year values)
+    out_dict_base = dict(out_dict_base)
     for d in [accdata, ag_acres, job_du_dens, ej_data]:
         out_dict_base.update(d)
 
@@ -61,7 +70,7 @@ def get_singleyr_data(fc_tripshedpoly, projtyp, analysis_year, out_dict_base={})
     
     return outdf
 
-def get_multiyear_data(fc_tripshedpoly, projtyp, base_df, analysis_year):
+def get_multiyear_data(fc_tripshedpoly, projtyp, base_df, analysis_year, proj_ctx=None, lutype_areas=None):
     print("getting multi-year data for {}...".format(analysis_year))
     ilut_val_fields = [params.col_pop_ilut, params.col_du, params.col_emptot, params.col_k12_enr, params.col_empind, params.col_persntrip_res] \
                   + params.ilut_ptrip_mode_fields    
@@ -69,11 +78,15 @@ def get_multiyear_data(fc_tripshedpoly, projtyp, base_df, analysis_year):
     fc_pcl_pt = params.parcel_pt_fc_yr(analysis_year)
     fc_pcl_poly = params.parcel_poly_fc_yr(analysis_year)
 
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_tripshedpoly, projtyp)
+
     year_dict = {}
     # get data on pop, job, k12 totals
     # point_sum(fc_pclpt, fc_tripshedpoly, projtyp, val_fields, buffdist, case_field=None, case_excs_list=[])
     ilut_buff_vals = LandUseBuffCalcs(fc_pcl_pt, fc_tripshedpoly, projtyp, ilut_val_fields,
-                                          params.ilut_sum_buffdist, case_field=None, case_excs_list=[]).point_sum()
+                                          params.ilut_sum_buffdist, case_field=None, case_excs_list=[],
+                                          proj_ctx=proj_ctx).point_sum()
 
     ilut_indjob_share = {"{}_jobshare".format(params.col_empind): ilut_buff_vals[params.col_empind] / ilut_buff_vals[params.col_emptot]}
     ilut_buff_vals.update(ilut_indjob_share)
@@ -90,14 +103,15 @@ def get_multiyear_data(fc_tripshedpoly, projtyp, base_df, analysis_year):
 
 
     # land use diversity index
-    mix_index_data = mixidx.get_mix_idx(fc_pcl_pt, fc_tripshedpoly, projtyp)
+    mix_index_data = mixidx.get_mix_idx(fc_pcl_pt, fc_tripshedpoly, projtyp, proj_ctx=proj_ctx)
 
     # housing type mix
     housing_mix_data = LandUseBuffCalcs(fc_pcl_pt, fc_tripshedpoly, projtyp, [params.col_du], params.du_mix_buffdist,
-                                            params.col_housing_type, case_excs_list=['Other']).point_sum()
+                                            params.col_housing_type, case_excs_list=['Other'], proj_ctx=proj_ctx).point_sum()
 
     # acres of "natural resources" (land use type = forest or agriculture)
-    nat_resources_data = urbn.nat_resources(fc_tripshedpoly, projtyp, fc_pcl_poly, analysis_year)
+    nat_resources_data = urbn.nat_resources(fc_tripshedpoly, projtyp, fc_pcl_poly, analysis_year, proj_ctx=proj_ctx,
+                                            lutype_areas=lutype_areas)
     # combine into dict
     for d in [ilut_buff_vals, job_du_tot, mix_index_data, housing_mix_data, nat_resources_data]:
         year_dict.update(d)
@@ -109,22 +123,26 @@ def get_multiyear_data(fc_tripshedpoly, projtyp, base_df, analysis_year):
 
 def get_tripshed_data(fc_tripshed, project_type, analysis_years, csv_aggvals, base_dict={}):
 
-    # metrics that only have base year value
-    outdf_base = get_singleyr_data(fc_tripshed, project_type, analysis_years[0], base_dict)
-    
-    # outputs that use both base year and future year values
+    # trip shed polygon, its layer, and its buffers are made once, then shared by all metrics
+    proj_ctx = ProjectContext(fc_tripshed, project_type)
+    proj_ctx.build_buffers(tripshed_buffdists)
+
+    # single-year metrics and each analysis year are run at the same time, each in its own process (the pool is
+    # reused for every trip shed run, see metric_dag.get_pool()). Base year ag acres and natural resource acres
+    # both come from one overlay of the base year parcels.
+    base_year = analysis_years[0]
+    nodes = [MetricNode('lutype_areas', get_lutype_areas,
+                        (fc_tripshed, project_type, params.parcel_poly_fc_yr(base_year)), {'proj_ctx': proj_ctx}),
+             MetricNode('singleyr', get_singleyr_data, (fc_tripshed, project_type, base_year, base_dict),
+                        {'proj_ctx': proj_ctx, 'lutype_areas': DepResult('lutype_areas')})]
     for year in analysis_years:
-        df_year = get_multiyear_data(fc_tripshed, project_type, outdf_base, year)
-        # if it's base year, then append values to bottom of outdf_base,
-        # if it's future year, then left-join the values to the outdf.
-        # table has metrics as rows; years as columns (and will also append     
-        if year == min(analysis_years):
-            out_df = outdf_base.rename(columns={0: 'tripshed_{}'.format(year)})
-            df_year = df_year.rename(columns={0: 'tripshed_{}'.format(year)})
-            out_df = out_df.append(df_year)
-        else:
-            df_year = df_year.rename(columns={0: 'tripshed_{}'.format(year)})
-            out_df = out_df.join(df_year)
+        lu_areas_yr = DepResult('lutype_areas') if year == base_year else None
+        nodes.append(MetricNode('multiyr_{}'.format(year), get_multiyear_data, (fc_tripshed, project_type, None, year),
+                                {'proj_ctx': proj_ctx, 'lutype_areas': lu_areas_yr}))
+    metric_results = run_dag(nodes)
+
+    year_dfs = {year: metric_results['multiyr_{}'.format(year)] for year in analysis_years}
+    out_df = utils.combine_year_dfs(metric_results['singleyr'], year_dfs, 'tripshed')
         
     # get community type and regional level data
     df_aggvals = pd.read_csv(csv_aggvals, index_col='Unnamed: 0')
@@ -156,7 +174,7 @@ if __name__ == '__main__':
     
 
     # =======================BEGIN SCRIPT==============================================================
-    analysis_years = [2016, 2040]  # which years will be used.
+    analysis_years = params.analysis_years  # which years will be used.
     time_sufx = str(dt.datetime.now().strftime('%m%d%Y_%H%M'))
     output_csv = r'C:\TEMP_OUTPUT\ReplicaTripShed\PPA_TripShed_{}_{}.csv'.format(
         os.path.basename(tripshed_fc), time_sufx)
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -23,19 +27,37 @@ g_ESRI_variable_6 = 'collision_fl'
 # Python Version: 3.x
 # --------------------------------
 import time
-import arcpy
+
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    shapely = None
 
 import ppa_input_params as params
 import ppa_utils as utils
+import geom_backend
+import link_midpoints
+from project_context import ProjectContext
+
+colln_cols = [params.col_fwytag, params.col_nkilled, params.col_bike_ind, params.col_ped_ind]
+
+_colln_indexes = {}
 
 
 # for aggregate, polygon-based avgs (e.g., community type, whole region), use model for VMT; for
 # project, the VMT will be based on combo of project length and user-entered ADT for project
-def get_model_link_sums(fc_polygon, fc_model_links):
+def get_model_link_sums(fc_polygon, fc_model_links, proj_ctx=None):
     '''For all travel model highway links that have their center within a polygon (e.g. buffer
     around a project line, or a community type, or a trip shed), sum the values for user-specified
     metrics. E.g. daily VMT for all selected intersectin model links, total lane miles on intersecting
-    links, etc.'''
+    links, etc. If proj_ctx uses the geometry backend, its project geometry is used as the polygon.'''
+
+    link_data_cols =[params.col_capclass, params.col_distance, params.col_lanemi, params.col_dayvmt]
+    output_data_cols =[params.col_dayvmt, params.col_distance]
+
+    if proj_ctx is not None and not proj_ctx.use_gp_tools:
+        return get_model_link_sums_multi([proj_ctx.shape], fc_model_links)[0]
 
     sufx = int(time.perf_counter()) + 1
     fl_polygon = os.path.join('memory','fl_polygon{}'.format(sufx))
@@ -50,9 +72,6 @@ def get_model_link_sums(fc_polygon, fc_model_links):
     # select model links whose centroid is within the polygon area
     arcpy.SelectLayerByLocation_management(fl_model_links, "HAVE_THEIR_CENTER_IN", fl_polygon)
 
-    link_data_cols =[params.col_capclass, params.col_distance, params.col_lanemi, params.col_dayvmt]
-    output_data_cols =[params.col_dayvmt, params.col_distance]
-
     # load model links, selected to be near project, into a dataframe
     df_linkdata = utils.esri_object_to_df(fl_model_links, link_data_cols)
 
@@ -61,9 +80,13 @@ def get_model_link_sums(fc_polygon, fc_model_links):
     return out_dict
 
 
-def get_centerline_miles(selection_poly_fc, centerline_fc):
+def get_centerline_miles(selection_poly_fc, centerline_fc, proj_ctx=None):
     '''Calculate centerline miles for all road links whose center is within a polygon,
-    such as a buffer around a road segment, or community type, trip shed, etc.'''
+    such as a buffer around a road segment, or community type, trip shed, etc.
+    If proj_ctx uses the geometry backend, its project geometry is used as the polygon.'''
+    if proj_ctx is not None and not proj_ctx.use_gp_tools:
+        return get_centerline_miles_multi([proj_ctx.shape], centerline_fc)[0]
+
     sufx = int(time.perf_counter()) + 1
     fl_selection_poly = os.path.join('memory','fl_selection_poly{}'.format(sufx))
     fl_centerline = os.path.join('memory','fl_centerline{}'.format(sufx))
@@ -84,59 +107,56 @@ def get_centerline_miles(selection_poly_fc, centerline_fc):
     return cline_miles / params.ft2mile
 
 
-def get_collision_data(fc_project, project_type, fc_colln_pts, project_adt):
-    '''Inputs:
-        fc_project = project line around which a buffer will be drawn for selecting collision locations
-        project_type = whether it's a freeway project, arterial project, etc. Or if it is a 
-        community design project.
-        
-        With user-entered ADT (avg daily traffic) and a point layer of collision locations, function calculates
-        several key safety metrics including total collisions, collisions/100M VMT, percent bike/ped collisions, etc.'''
-        
-    arcpy.AddMessage("Aggregating collision data...")
+def get_model_link_sums_multi(geoms, fc_model_links):
+    '''get_model_link_sums() for many polygons at once. Returns list of dicts, one per polygon'''
+    output_data_cols = [params.col_dayvmt, params.col_distance]
 
-    fc_model_links = params.model_links_fc()
+    geom_idx, df_linkdata = link_midpoints.center_in_links(fc_model_links, geoms, output_data_cols)
+    col_sums = {col: np.bincount(geom_idx, weights=np.asarray(df_linkdata[col], dtype='float64'), minlength=len(geoms))
+                for col in output_data_cols}
 
-    sufx = int(time.perf_counter()) + 1
-    fl_project = g_ESRI_variable_5
-    fl_colln_pts = os.path.join('memory','fl_colln_pts{}'.format(sufx))
-    
-    if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-    arcpy.MakeFeatureLayer_management(fc_project, fl_project)
-    
-    if arcpy.Exists(fl_colln_pts): arcpy.Delete_management(fl_colln_pts)
-    arcpy.MakeFeatureLayer_management(fc_colln_pts, fl_colln_pts)
+    return [{col: col_sums[col][i] for col in output_data_cols} for i in range(len(geoms))]
 
-    # if for project segment, get annual VMT for project segment based on user input and segment length
-    df_projlen = utils.esri_object_to_df(fl_project, ["SHAPE@LENGTH"])
-    proj_len_mi = df_projlen.iloc[0][0] / params.ft2mile  # return project length in miles
 
-    # for aggregate, polygon-based avgs (e.g., community type, whole region), use model for VMT; for
-    # project, the VMT will be based on combo of project length and user-entered ADT for project
-    # approximate annual project VMT, assuming ADT is reflective of weekdays only, but assumes
-    if project_type == params.ptype_area_agg:
-        vmt_dict = get_model_link_sums(fc_project, fc_model_links)
-        dayvmt = vmt_dict[params.col_dayvmt]
-        ann_proj_vmt = dayvmt * 320
-        proj_len_mi = get_centerline_miles(fc_project, params.reg_artcollcline_fc) # only gets for collector streets and above
-    else:
-        ann_proj_vmt = project_adt * proj_len_mi * 320
+def get_centerline_miles_multi(geoms, centerline_fc):
+    '''get_centerline_miles() for many polygons at once. Returns array of miles, one per polygon'''
+    geom_idx, df_clines = link_midpoints.center_in_links(centerline_fc, geoms, [link_midpoints.col_len_ft])
+    cline_lens = np.asarray(df_clines[link_midpoints.col_len_ft], dtype='float64')
 
-    # get collision totals
-    searchdist = 0 if project_type == params.ptype_area_agg else params.colln_searchdist
-    arcpy.SelectLayerByLocation_management(fl_colln_pts, 'WITHIN_A_DISTANCE', fl_project, searchdist)
-    colln_cols =[params.col_fwytag, params.col_nkilled, params.col_bike_ind, params.col_ped_ind]
-    
-    df_collndata = utils.esri_object_to_df(fl_colln_pts, colln_cols)
-    
-    # filter so that fwy collisions don't get tagged to non-freeway projects, and vice-versa
+    return np.bincount(geom_idx, weights=cline_lens, minlength=len(geoms)) / params.ft2mile
+
+
+def get_colln_index(fc_colln_pts):
+    '''Collision points with a spatial index (shapely STRtree) for each value of the freeway tag, plus one for all
+    collisions, so that freeway/non-freeway filtering is done by picking an index instead of after selection.
+    Returns (attribute df, {fwy tag value or None for all: (STRtree, row indexes of df)}). Made once per process.'''
+    if _colln_indexes.get(fc_colln_pts) is None:
+        fs_collns = geom_backend.get_backend(geom_backend.name_shapely).read_features(fc_colln_pts, colln_cols)
+        pts = np.asarray(fs_collns.geoms)
+        fwytags = fs_collns.df[params.col_fwytag].values
+
+        colln_trees = {None: (shapely.STRtree(pts), np.arange(pts.shape[0]))}
+        for fwytag in (0, 1):
+            tag_rows = np.nonzero(fwytags == fwytag)[0]
+            colln_trees[fwytag] = (shapely.STRtree(pts[tag_rows]), tag_rows)
+
+        _colln_indexes[fc_colln_pts] = (fs_collns.df, colln_trees)
+
+    return _colln_indexes[fc_colln_pts]
+
+
+def colln_partition(project_type):
+    '''freeway tag value of collisions that count for project_type (None = all collisions)'''
     if project_type == params.ptype_fwy:
-        df_collndata = df_collndata.loc[df_collndata[params.col_fwytag] == 1]
+        return 1
     elif project_type == params.ptype_area_agg:
-        pass  # for aggregating at polygon level, like region or community type, we want all collisions on all roads
+        return None  # for aggregating at polygon level, like region or community type, we want all collisions on all roads
     else:
-        df_collndata = df_collndata.loc[df_collndata[params.col_fwytag] == 0]
+        return 0
+
 
+def collision_metrics(df_collndata, proj_len_mi, ann_proj_vmt):
+    '''collision totals and rates from table of selected collisions'''
     total_collns = df_collndata.shape[0]
     fatal_collns = df_collndata.loc[df_collndata[params.col_nkilled] > 0].shape[0]
     bikeped_collns = df_collndata.loc[(df_collndata[params.col_bike_ind] == params.ind_val_true)
@@ -159,3 +179,93 @@ def get_collision_data(fc_project, project_type, fc_colln_pts, project_adt):
                 "BIKEPED_COLLISNS_PER_CLMILE": bikeped_colln_clmile, "PCT_BIKEPED_COLLISNS": pct_bikeped_collns}
 
     return out_dict
+
+
+def get_collision_data_multi(geoms, fc_colln_pts):
+    '''get_collision_data() for many polygons (e.g. all community types) at once, with project type
+    ptype_area_agg. Collisions are joined to all polygons with one point-in-polygon query. Returns list of dicts,
+    one per polygon.'''
+    utils.add_message("Aggregating collision data...")
+
+    vmt_dicts = get_model_link_sums_multi(geoms, params.model_links_fc())
+    cline_miles = get_centerline_miles_multi(geoms, params.reg_artcollcline_fc) # only gets for collector streets and above
+
+    shapely_backend = geom_backend.get_backend(geom_backend.name_shapely)
+    df_collns, colln_trees = get_colln_index(fc_colln_pts)
+    tree, tree_rows = colln_trees[colln_partition(params.ptype_area_agg)]
+    pairs = tree.query(np.asarray([shapely_backend.to_native(g) for g in geoms]), predicate='intersects')
+
+    out_dicts = []
+    for i in range(len(geoms)):
+        df_collndata = df_collns.iloc[tree_rows[pairs[1][pairs[0] == i]]]
+        ann_poly_vmt = vmt_dicts[i][params.col_dayvmt] * 320
+        out_dicts.append(collision_metrics(df_collndata, cline_miles[i], ann_poly_vmt))
+
+    return out_dicts
+
+
+def get_collision_data(fc_project, project_type, fc_colln_pts, project_adt, proj_ctx=None):
+    '''Inputs:
+        fc_project = project line around which a buffer will be drawn for selecting collision locations
+        project_type = whether it's a freeway project, arterial project, etc. Or if it is a 
+        community design project.
+        
+        With user-entered ADT (avg daily traffic) and a point layer of collision locations, function calculates
+        several key safety metrics including total collisions, collisions/100M VMT, percent bike/ped collisions, etc.'''
+        
+    utils.add_message("Aggregating collision data...")
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, project_type)
+
+    fc_model_links = params.model_links_fc()
+
+    # if for project segment, get annual VMT for project segment based on user input and segment length
+    proj_len_mi = proj_ctx.len_mi  # project length in miles
+
+    # for aggregate, polygon-based avgs (e.g., community type, whole region), use model for VMT; for
+    # project, the VMT will be based on combo of project length and user-entered ADT for project
+    # approximate annual project VMT, assuming ADT is reflective of weekdays only, but assumes
+    if project_type == params.ptype_area_agg:
+        vmt_dict = get_model_link_sums(proj_ctx.fc_project, fc_model_links, proj_ctx)
+        dayvmt = vmt_dict[params.col_dayvmt]
+        ann_proj_vmt = dayvmt * 320
+        proj_len_mi = get_centerline_miles(proj_ctx.fc_project, params.reg_artcollcline_fc, proj_ctx) # only gets for collector streets and above
+    else:
+        ann_proj_vmt = project_adt * proj_len_mi * 320
+
+    # get collision totals
+    searchdist = 0 if project_type == params.ptype_area_agg else params.colln_searchdist
+
+    if proj_ctx.use_gp_tools:
+        sufx = int(time.perf_counter()) + 1
+        fl_project = proj_ctx.fl_project
+        fl_colln_pts = os.path.join('memory','fl_colln_pts{}'.format(sufx))
+        
+        if arcpy.Exists(fl_colln_pts): arcpy.Delete_management(fl_colln_pts)
+        arcpy.MakeFeatureLayer_management(fc_colln_pts, fl_colln_pts)
+
+        arcpy.SelectLayerByLocation_management(fl_colln_pts, 'WITHIN_A_DISTANCE', fl_project, searchdist)
+        df_collndata = utils.esri_object_to_df(fl_colln_pts, colln_cols)
+
+        # filter so that fwy collisions don't get tagged to non-freeway projects, and vice-versa
+        fwytag = colln_partition(project_type)
+        if fwytag is not None:
+            df_collndata = df_collndata.loc[df_collndata[params.col_fwytag] == fwytag]
+    elif proj_ctx.backend.name == geom_backend.name_shapely:
+        # fwy collisions don't get tagged to non-freeway projects, and vice-versa, by querying that index only
+        df_collns, colln_trees = get_colln_index(fc_colln_pts)
+        tree, tree_rows = colln_trees[colln_partition(project_type)]
+        colln_idx = tree.query(proj_ctx.shape, predicate='dwithin', distance=searchdist)
+        df_collndata = df_collns.iloc[np.sort(tree_rows[colln_idx])]
+    else:
+        backend = proj_ctx.backend
+        fs_collns = backend.read_features(fc_colln_pts, colln_cols)
+        colln_idx = backend.select_by_location(fs_collns, proj_ctx.shape, geom_backend.rel_within_dist, searchdist)
+        df_collndata = fs_collns.df.iloc[colln_idx]
+
+        fwytag = colln_partition(project_type)
+        if fwytag is not None:
+            df_collndata = df_collndata.loc[df_collndata[params.col_fwytag] == fwytag]
+
+    return collision_metrics(df_collndata, proj_len_mi, ann_proj_vmt)
@@ -12,13 +12,25 @@
 import arcpy
 
 import ppa_input_params as params
-from landuse_buff_calcs import LandUseBuffCalcs
+from landuse_buff_calcs import LandUseBuffCalcs, LUSumSpec
+from project_context import ProjectContext
 import transit_svc_measure as ts
 
 
-def complete_streets_idx(fc_pclpt, fc_project, project_type, posted_speedlim, transit_event_fc):
+lu_fac_cols = [params.col_area_ac, params.col_k12_enr, params.col_emptot, params.col_du]
+lu_vals_cols = [params.col_k12_enr, params.col_emptot, params.col_du]
+
+
+def cs_lu_spec():
+    '''land use sums needed for CSI, for getting them in a landuse_buff_calcs.point_sum_batch() run with other metrics'''
+    return LUSumSpec(lu_fac_cols, params.cs_buffdist)
+
+
+def complete_streets_idx(fc_pclpt, fc_project, project_type, posted_speedlim, transit_event_fc, proj_ctx=None,
+                         lu_vals_dict=None):
     '''Calculate complete street index (CSI) for project
         CSI = (students/acre + daily transit vehicle stops/acre + BY jobs/acre + BY du/acre) * (1-(posted speed limit - threshold speed limit)*speed penalty factor)
+        If lu_vals_dict (parcel sums from cs_lu_spec()) is given, parcel data are not reloaded.
         '''
     # don't give complete street score for freeway projects or if sponsor didn't enter speed limit
     if project_type == params.ptype_fwy or posted_speedlim <= 1: 
@@ -26,15 +38,17 @@ def complete_streets_idx(fc_pclpt, fc_project, project_type, posted_speedlim, tr
     else:
         arcpy.AddMessage("Calculating complete street score...")
     
+        if proj_ctx is None:
+            proj_ctx = ProjectContext(fc_project, project_type)
+
         # get transit service density around project
-        tran_stops_dict = ts.transit_svc_density(fc_project, transit_event_fc, project_type)
+        tran_stops_dict = ts.transit_svc_density(fc_project, transit_event_fc, project_type, proj_ctx=proj_ctx)
         transit_svc_density = list(tran_stops_dict.values())[0]
     
-        lu_fac_cols = [params.col_area_ac, params.col_k12_enr, params.col_emptot, params.col_du]
-        lu_vals_cols = [params.col_k12_enr, params.col_emptot, params.col_du]
-    
         # get sums of the lu_fac_cols within project buffer area
-        lu_vals_dict = LandUseBuffCalcs(fc_pclpt, fc_project, project_type, lu_fac_cols, params.cs_buffdist).point_sum()
+        if lu_vals_dict is None:
+            lu_vals_dict = LandUseBuffCalcs(fc_pclpt, fc_project, project_type, lu_fac_cols, params.cs_buffdist,
+                                            proj_ctx=proj_ctx).point_sum()
     
         #dens_score = (student_dens + trn_svc_dens + job_dens + du_dens)
         dens_score = sum([lu_vals_dict[i] / lu_vals_dict[params.col_area_ac] for i in lu_vals_cols]) + transit_svc_density
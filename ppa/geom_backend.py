@@ -0,0 +1,392 @@
+# --------------------------------
+# Name: geom_backend.py
+# Purpose: Geometry operations used by PPA metrics (buffer, intersect, select by location, spatial join,
+#           split line at points), with two interchangeable implementations:
+#               ShapelyBackend - shapely/NumPy only. Default. Runs on machines without ArcGIS.
+#               ArcpyBackend - same operations done with arcpy geometry objects
+#           Which backend is used is set by params.geom_backend. Features are passed around as FeatureSets:
+#           a list of geometries plus a dataframe of their attributes, in the same row order.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import functools
+
+import numpy as np
+import pandas as pd
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import shapely
+    from shapely.geometry import shape as shapely_shape
+    from shapely.ops import substring
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import layer_store
+
+name_shapely = 'shapely'
+name_arcpy = 'arcpy'
+
+# select_by_location() relationships. Same meanings as in arcpy SelectLayerByLocation.
+rel_within_dist = 'WITHIN_A_DISTANCE'
+rel_intersect = 'INTERSECT'
+rel_center_in = 'HAVE_THEIR_CENTER_IN'
+
+
+class FeatureSet(object):
+    '''Geometries plus a dataframe of their attributes (one row per geometry)'''
+    def __init__(self, geoms, attrs_df=None):
+        self.geoms = np.empty(len(geoms), dtype=object)
+        self.geoms[:] = list(geoms)
+        if attrs_df is None or attrs_df.shape[1] == 0: # no fields, e.g. read_features() of only geometry
+            self.df = pd.DataFrame(index=range(len(geoms)))
+        else:
+            self.df = attrs_df.reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def subset(self, idx):
+        '''new FeatureSet with only the rows idx (int indexes or boolean mask)'''
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.nonzero(idx)[0]
+        return FeatureSet(self.geoms[idx], self.df.iloc[idx])
+
+
+def _first_match(pairs, n_inputs):
+    '''from (2, n) array of [input index, match index] pairs, get each input's lowest-index match (-1 if no match)'''
+    out_idx = np.full(n_inputs, -1, dtype='int64')
+    if pairs.shape[1] == 0:
+        return out_idx
+    order = np.lexsort((pairs[1], pairs[0]))
+    in_idx, match_idx = pairs[0][order], pairs[1][order]
+    is_first = np.concatenate([[True], in_idx[1:] != in_idx[:-1]])
+    out_idx[in_idx[is_first]] = match_idx[is_first]
+
+    return out_idx
+
+
+def _join_attrs(df_a, df_b, idx_a, idx_b):
+    '''attribute table for pairs of features from two FeatureSets, like the arcpy Intersect "ALL" field option'''
+    out_a = df_a.iloc[idx_a].reset_index(drop=True)
+    out_b = df_b.iloc[idx_b].reset_index(drop=True)
+    out_b = out_b.rename(columns={c: '{}_1'.format(c) for c in out_b.columns if c in out_a.columns})
+
+    return pd.concat([out_a, out_b], axis=1)
+
+
+def _dissolve_groups(fset, field, union_func):
+    '''FeatureSet with one feature per value of field (in order of first appearance), whose geometry is the union,
+    by union_func, of the geometries with that value'''
+    codes, keys = pd.factorize(fset.df[field])
+    geoms = [union_func(fset.geoms[codes == i]) for i in range(len(keys))]
+
+    return FeatureSet(geoms, pd.DataFrame({field: list(keys)}))
+
+
+class ShapelyBackend(object):
+    name = name_shapely
+
+    def __init__(self):
+        if shapely is None:
+            raise ImportError("shapely must be installed to use the {} geometry backend".format(self.name))
+        self._feature_cache = {}
+
+    def to_native(self, geom):
+        '''convert any geometry with __geo_interface__ (arcpy, shapely, geojson dict) to a shapely geometry'''
+        if isinstance(geom, shapely.Geometry):
+            return geom
+        gi = geom if isinstance(geom, dict) else geom.__geo_interface__
+        return shapely_shape(gi)
+
+    def read_features(self, source, fields=[]):
+        '''Load features into a FeatureSet. source is a feature class name; its layer_store is used if there is a
+        current one, otherwise that layer is read with arcpy (from params.fgdb if source is only a name). Layers are
+        kept in memory for later calls in the same process.'''
+        cache_key = (source, tuple(fields))
+        if self._feature_cache.get(cache_key) is None:
+            store_dir = params.layer_store_path(source)
+            if layer_store.store_exists(store_dir):
+                store = layer_store.open_store(store_dir)
+                geoms = store.shapes()
+                attrs_df = store.to_df(fields)
+            elif arcpy is not None:
+                geoms, attrs_df = self._read_with_arcpy(source, fields)
+            else:
+                raise ValueError("{} has no current layer store in {}, and arcpy is not available to read it. Export " \
+                                 "it with layer_store.py, or run on a machine with arcpy." \
+                                 .format(source, params.layer_store_dir))
+
+            self._feature_cache[cache_key] = FeatureSet(geoms, attrs_df)
+
+        return self._feature_cache[cache_key]
+
+    def _read_with_arcpy(self, source, fields):
+        '''(shapely geometries, attribute df) of a layer that has no layer store'''
+        if not arcpy.Exists(source) and not os.path.dirname(source):
+            source = os.path.join(params.fgdb, source)
+        arcpy.AddMessage("{} has no current layer store; reading it with arcpy.".format(source))
+
+        wkbs = []
+        rows = []
+        with arcpy.da.SearchCursor(source, ["SHAPE@WKB"] + fields) as cur:
+            for row in cur:
+                wkbs.append(bytes(row[0]) if row[0] is not None else None) # None = feature with no geometry
+                rows.append(list(row[1:]))
+
+        return shapely.from_wkb(wkbs), pd.DataFrame(rows, columns=fields)
+
+    def lengths(self, geoms):
+        return shapely.length(np.asarray(geoms))
+
+    def areas(self, geoms):
+        return shapely.area(np.asarray(geoms))
+
+    def distances(self, geoms, geom):
+        return shapely.distance(np.asarray(geoms), geom)
+
+    def buffer(self, geom, dist, flat_end=False):
+        cap_style = 'flat' if flat_end else 'round'
+        return shapely.buffer(geom, dist, cap_style=cap_style)
+
+    def buffer_features(self, fset, dist, flat_end=False):
+        return FeatureSet(self.buffer(fset.geoms, dist, flat_end), fset.df)
+
+    def centers(self, geoms):
+        '''"center" as defined by arcpy HAVE_THEIR_CENTER_IN: midpoint for lines, centroid for everything else'''
+        geoms = np.asarray(geoms)
+        out_pts = shapely.centroid(geoms)
+        is_line = shapely.get_dimensions(geoms) == 1
+        if is_line.any():
+            out_pts[is_line] = shapely.line_interpolate_point(geoms[is_line], 0.5, normalized=True)
+
+        return out_pts
+
+    def select_by_location(self, fset, geom, relationship, search_dist=0):
+        '''indexes of features in fset that have the relationship to geom'''
+        if relationship == rel_center_in:
+            tree = shapely.STRtree(self.centers(fset.geoms))
+        else:
+            tree = shapely.STRtree(fset.geoms)
+
+        if search_dist > 0 or relationship == rel_within_dist:
+            idx = tree.query(geom, predicate='dwithin', distance=search_dist)
+        else:
+            idx = tree.query(geom, predicate='intersects')
+
+        return np.sort(idx)
+
+    def select_by_location_many(self, fset, geoms, relationship, search_dist=0):
+        '''select_by_location() for many geometries at once (e.g. every community type polygon). Returns (2, n) array
+        of [index in geoms, index in fset] pairs, sorted by geoms index'''
+        if relationship == rel_center_in:
+            tree = shapely.STRtree(self.centers(fset.geoms))
+        else:
+            tree = shapely.STRtree(fset.geoms)
+
+        geoms = np.asarray(geoms)
+        if search_dist > 0 or relationship == rel_within_dist:
+            pairs = tree.query(geoms, predicate='dwithin', distance=search_dist)
+        else:
+            pairs = tree.query(geoms, predicate='intersects')
+
+        return pairs[:, np.lexsort((pairs[1], pairs[0]))]
+
+    def intersect(self, fset_a, fset_b):
+        '''pieces where features in fset_a overlap features in fset_b, with attributes from both. Like arcpy Intersect,
+        output pieces have the lower dimension of the two inputs (e.g. line + polygon gives lines)'''
+        tree = shapely.STRtree(fset_b.geoms)
+        idx_a, idx_b = tree.query(fset_a.geoms, predicate='intersects')
+
+        out_dim = min(shapely.get_dimensions(fset_a.geoms).max(initial=0),
+                      shapely.get_dimensions(fset_b.geoms).max(initial=0))
+        pieces = shapely.intersection(fset_a.geoms[idx_a], fset_b.geoms[idx_b])
+
+        # drop pieces that only touch (e.g. polygons sharing an edge give a line)
+        pieces = np.array([self._keep_dim(g, out_dim) for g in pieces], dtype=object)
+        keep = ~shapely.is_empty(pieces)
+
+        return FeatureSet(pieces[keep], _join_attrs(fset_a.df, fset_b.df, idx_a[keep], idx_b[keep]))
+
+    def _keep_dim(self, geom, dim):
+        if shapely.get_dimensions(geom) == dim and shapely.get_type_id(geom) != 7:
+            return geom
+        parts = [g for g in shapely.get_parts(geom) if shapely.get_dimensions(g) == dim]
+        return shapely.union_all(parts) if parts else shapely.Point()
+
+    def boundary_crossings(self, line, fset_polys):
+        '''points where line crosses the boundaries of polygons in fset_polys'''
+        crossings = shapely.intersection(line, shapely.boundary(fset_polys.geoms))
+        pts = shapely.get_parts(crossings)
+        pts = pts[shapely.get_type_id(pts) == 0]  # only points, not overlapping line pieces
+
+        return pts
+
+    def spatial_join(self, fset_target, fset_join, relationship, search_dist=0):
+        '''For each target feature, index of the first feature in fset_join that has the relationship to it, or
+        -1 if none (like arcpy SpatialJoin JOIN_ONE_TO_ONE, KEEP_ALL)'''
+        target_geoms = self.centers(fset_target.geoms) if relationship == rel_center_in else fset_target.geoms
+        tree = shapely.STRtree(fset_join.geoms)
+        if search_dist > 0 or relationship == rel_within_dist:
+            pairs = tree.query(target_geoms, predicate='dwithin', distance=search_dist)
+        else:
+            pairs = tree.query(target_geoms, predicate='intersects')
+
+        return _first_match(pairs, len(fset_target))
+
+    def dissolve(self, fset, field):
+        '''one feature per value of field, like arcpy Dissolve'''
+        return _dissolve_groups(fset, field, shapely.union_all)
+
+    def split_line_at_points(self, line, points, tolerance=0):
+        '''split line into pieces at each point within tolerance of it'''
+        out_pieces = []
+        for part in shapely.get_parts(line):
+            part_len = part.length
+            near_pts = [pt for pt in points if part.distance(pt) <= tolerance]
+            cut_locs = sorted(set([0, part_len] + [part.project(pt) for pt in near_pts]))
+            for start, end in zip(cut_locs[:-1], cut_locs[1:]):
+                if end - start > 0:
+                    out_pieces.append(substring(part, start, end))
+
+        return out_pieces
+
+
+class ArcpyBackend(object):
+    '''Same operations as ShapelyBackend, on arcpy geometry objects. Feature loops are done in Python, so
+    this is for small feature sets; metrics keep using arcpy geoprocessing tools when this backend is set.'''
+    name = name_arcpy
+
+    def __init__(self):
+        if arcpy is None:
+            raise ImportError("arcpy must be available to use the {} geometry backend".format(self.name))
+
+    def to_native(self, geom):
+        if isinstance(geom, arcpy.Geometry):
+            return geom
+        gi = geom if isinstance(geom, dict) else geom.__geo_interface__
+        return arcpy.AsShape(gi)
+
+    def read_features(self, source, fields=[]):
+        geoms = []
+        rows = []
+        with arcpy.da.SearchCursor(source, ["SHAPE@"] + fields) as cur:
+            for row in cur:
+                geoms.append(row[0])
+                rows.append(list(row[1:]))
+
+        return FeatureSet(geoms, pd.DataFrame(rows, columns=fields))
+
+    def lengths(self, geoms):
+        return np.array([g.length for g in geoms], dtype='float64')
+
+    def areas(self, geoms):
+        return np.array([g.area for g in geoms], dtype='float64')
+
+    def distances(self, geoms, geom):
+        return np.array([g.distanceTo(geom) for g in geoms], dtype='float64')
+
+    def buffer(self, geom, dist, flat_end=False):
+        if flat_end:
+            return arcpy.Buffer_analysis([geom], arcpy.Geometry(), dist, "FULL", "FLAT")[0]
+        return geom.buffer(dist)
+
+    def buffer_features(self, fset, dist, flat_end=False):
+        if len(fset) == 0:
+            return fset
+        end_type = "FLAT" if flat_end else "ROUND"
+        buffs = arcpy.Buffer_analysis(list(fset.geoms), arcpy.Geometry(), dist, "FULL", end_type)
+        return FeatureSet(buffs, fset.df)
+
+    def centers(self, geoms):
+        return [g.positionAlongLine(0.5, True) if g.type == 'polyline' else arcpy.PointGeometry(g.centroid)
+                for g in geoms]
+
+    def _has_relationship(self, feat_geom, geom, search_dist):
+        if search_dist > 0:
+            return feat_geom.distanceTo(geom) <= search_dist
+        return not feat_geom.disjoint(geom)
+
+    def select_by_location(self, fset, geom, relationship, search_dist=0):
+        test_geoms = self.centers(fset.geoms) if relationship == rel_center_in else fset.geoms
+        idx = [i for i, g in enumerate(test_geoms) if self._has_relationship(g, geom, search_dist)]
+
+        return np.array(idx, dtype='int64')
+
+    def select_by_location_many(self, fset, geoms, relationship, search_dist=0):
+        pairs = [[i, j] for i, geom in enumerate(geoms)
+                 for j in self.select_by_location(fset, geom, relationship, search_dist)]
+
+        return np.array(pairs, dtype='int64').reshape(-1, 2).T
+
+    def intersect(self, fset_a, fset_b):
+        dim_codes = {'point': 1, 'multipoint': 1, 'polyline': 2, 'polygon': 4}
+        idx_a, idx_b, pieces = [], [], []
+        for i, ga in enumerate(fset_a.geoms):
+            for j, gb in enumerate(fset_b.geoms):
+                if ga.disjoint(gb):
+                    continue
+                out_dim = min(dim_codes[ga.type], dim_codes[gb.type])
+                piece = ga.intersect(gb, out_dim)
+                if piece is not None and not piece.isEmpty:
+                    idx_a.append(i)
+                    idx_b.append(j)
+                    pieces.append(piece)
+
+        return FeatureSet(pieces, _join_attrs(fset_a.df, fset_b.df, idx_a, idx_b))
+
+    def boundary_crossings(self, line, fset_polys):
+        out_pts = []
+        for poly in fset_polys.geoms:
+            crossing = line.intersect(poly.boundary(), 1)
+            out_pts += [arcpy.PointGeometry(pt, line.spatialReference) for pt in crossing]
+
+        return out_pts
+
+    def spatial_join(self, fset_target, fset_join, relationship, search_dist=0):
+        target_geoms = self.centers(fset_target.geoms) if relationship == rel_center_in else fset_target.geoms
+        out_idx = np.full(len(fset_target), -1, dtype='int64')
+        for i, tg in enumerate(target_geoms):
+            for j, jg in enumerate(fset_join.geoms):
+                if self._has_relationship(tg, jg, search_dist):
+                    out_idx[i] = j
+                    break
+
+        return out_idx
+
+    def dissolve(self, fset, field):
+        return _dissolve_groups(fset, field, lambda geoms: functools.reduce(lambda a, b: a.union(b), geoms))
+
+    def split_line_at_points(self, line, points, tolerance=0):
+        near_pts = [pt for pt in points if line.distanceTo(pt) <= tolerance]
+        cut_locs = sorted(set([0, line.length] + [line.measureOnLine(pt) for pt in near_pts]))
+
+        return [line.segmentAlongLine(start, end) for start, end in zip(cut_locs[:-1], cut_locs[1:]) if end > start]
+
+
+_backends = {}
+
+
+def get_backend(name=None):
+    '''Backend set by params.geom_backend, unless another name is given. If shapely is not installed,
+    the arcpy backend is used.'''
+    name = name if name else params.geom_backend
+    if name == name_shapely and shapely is None and arcpy is not None:
+        name = name_arcpy
+
+    if _backends.get(name) is None:
+        backend_classes = {name_shapely: ShapelyBackend, name_arcpy: ArcpyBackend}
+        _backends[name] = backend_classes[name]()
+
+    return _backends[name]
@@ -24,24 +24,16 @@ import arcpy
 
 import ppa_utils as utils
 import ppa_input_params as params
+from project_context import ProjectContext
 
 
-def netmiles_in_buffer(fc_project, fc_network, project_type):
+def netmiles_in_buffer(fc_project, fc_network, project_type, proj_ctx=None):
 
-    # if project is polygon, then use polygon. If line or point, then make polygon as buffer around line/point.
-    if project_type == params.ptype_area_agg:
-        fc_poly_buff = fc_project
-    else:
-        fc_poly_buff = g_ESRI_variable_1
-        arcpy.Buffer_analysis(fc_project, fc_poly_buff, params.bikeway_buff)
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, project_type)
 
-    fl_poly = g_ESRI_variable_2
-
-    if arcpy.Exists(fl_poly): arcpy.Delete_management(fl_poly)
-    arcpy.MakeFeatureLayer_management(fc_poly_buff, fl_poly)    
-
-    # if not arcpy.Exists(fl_poly):
-    #     utils.make_fl_conditional(fc_poly_buff, fl_poly)
+    # if project is polygon, then use polygon. If line or point, then use buffer around line/point.
+    fc_poly_buff = proj_ctx.buffer_fc(params.bikeway_buff)
 
     temp_intersect_fc = g_ESRI_variable_3
 
@@ -56,16 +48,17 @@ def netmiles_in_buffer(fc_project, fc_network, project_type):
 
     arcpy.Delete_management(temp_intersect_fc)
 
-    if fc_poly_buff != fc_project:
-        arcpy.Delete_management(fc_poly_buff)
     return net_len
 
 
-def get_bikeway_mileage_share(project_fc, proj_type):
+def get_bikeway_mileage_share(project_fc, proj_type, proj_ctx=None):
     arcpy.AddMessage("Calculating share of centerline miles near project that are bikeways...")
 
-    centerline_miles = netmiles_in_buffer(project_fc, params.reg_centerline_fc, proj_type)
-    bikeway_miles = netmiles_in_buffer(project_fc, params.reg_bikeway_fc, proj_type)
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(project_fc, proj_type)
+
+    centerline_miles = netmiles_in_buffer(project_fc, params.reg_centerline_fc, proj_type, proj_ctx)
+    bikeway_miles = netmiles_in_buffer(project_fc, params.reg_bikeway_fc, proj_type, proj_ctx)
 
     share_bikeways = bikeway_miles / centerline_miles
 
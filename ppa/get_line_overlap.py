@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -29,9 +33,20 @@ import os
 import datetime as dt
 import time
 
-import arcpy
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    shapely = None
 
-arcpy.env.overwriteOutput = True
+import ppa_input_params as params
+import ppa_utils as utils
+import geom_backend
+import line_buffers
+import npmrds_data_conflation as ndc
+from project_context import ProjectContext
+
+if arcpy is not None: arcpy.env.overwriteOutput = True
 
 dateSuffix = str(dt.date.today().strftime('%m%d%Y'))
 
@@ -105,33 +120,72 @@ def conflate_link2projline(fl_proj, fl_links_buffd, links_desc):
     return out_dict
 
 
-def get_line_overlap(fc_projline, fc_network_lines, links_desc):
-    arcpy.AddMessage("Estimating share of project line that is {}...".format(links_desc))
+def conflate_link2projline_backend(proj_ctx, fs_links_buffd, links_desc):
+    '''Same as conflate_link2projline(), using geom_backend. Project line is cut into pieces at the start/end
+    measures of the link buffers (see npmrds_data_conflation.conflate_tmc2projline_lr()); a piece overlaps the
+    links if its midpoint is within 30ft of a link buffer.'''
+    join_tol_ft = 30
+    proj_line = proj_ctx.shape
+    project_len = proj_ctx.len_ft
+
+    buff_geoms = np.asarray(fs_links_buffd.geoms)
+    buff_geoms = buff_geoms[shapely.intersects(proj_line, buff_geoms)]
+
+    link_overlap_dist = 0
+    if buff_geoms.shape[0] > 0:
+        tree = shapely.STRtree(buff_geoms)
+        for part in shapely.get_parts(proj_line):
+            buff_idx, meas_lo, meas_hi = ndc.buffer_measure_intervals(part, buff_geoms)
+            starts, ends = ndc.measure_pieces(part.length, meas_lo, meas_hi)
+            mid_pts = shapely.line_interpolate_point(part, (starts + ends) / 2)
+            has_link = np.isin(np.arange(mid_pts.shape[0]),
+                               tree.query(mid_pts, predicate='dwithin', distance=join_tol_ft)[0])
+            link_overlap_dist += (ends - starts)[has_link].sum()
+
+    overlap_pct = link_overlap_dist / project_len
+
+    links_desc = links_desc.replace(" ","_")
+    out_dict = {'project_length': project_len, 'overlap with {}'.format(links_desc): link_overlap_dist,
+                'pct_proj_{}'.format(links_desc): overlap_pct}
+
+    return out_dict
+
+
+def get_line_overlap(fc_projline, fc_network_lines, links_desc, proj_ctx=None):
+    utils.add_message("Estimating share of project line that is {}...".format(links_desc))
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_projline, None)
+
+    if not proj_ctx.use_gp_tools:
+        backend = proj_ctx.backend
+        fs_network_lines = backend.read_features(fc_network_lines)
+        link_idx = backend.select_by_location(fs_network_lines, proj_ctx.shape, geom_backend.rel_within_dist,
+                                              params.line_overlap_srchdist)
+        fs_link_buff = line_buffers.get_line_buffers(backend, fc_network_lines, params.line_overlap_buff_dist_ft, [])
+
+        return conflate_link2projline_backend(proj_ctx, fs_link_buff.subset(link_idx), links_desc)
 
     arcpy.OverwriteOutput = True
-    SEARCH_DIST_FT = 100
-    LINKBUFF_DIST_FT = 90
 
     # make feature layers of NPMRDS and project line
-    fl_projline = g_ESRI_variable_3
-    arcpy.MakeFeatureLayer_management(fc_projline, fl_projline)
+    fl_projline = proj_ctx.fl_project
 
     fl_network_lines = g_ESRI_variable_4
     arcpy.MakeFeatureLayer_management(fc_network_lines, fl_network_lines)
 
-    # make flat-ended buffers around links that intersect project
-    arcpy.SelectLayerByLocation_management(fl_network_lines, "WITHIN_A_DISTANCE", fl_projline, SEARCH_DIST_FT, "NEW_SELECTION")
+    # select links near project
+    arcpy.SelectLayerByLocation_management(fl_network_lines, "WITHIN_A_DISTANCE", fl_projline,
+                                           params.line_overlap_srchdist, "NEW_SELECTION")
 
-    # create temporar buffer layer, flat-tipped, around links; will be used to split project lines
-    temp_linkbuff = os.path.join(arcpy.env.scratchGDB, "TEMP_linkbuff_4projsplit")
-    fl_link_buff = g_ESRI_variable_5
-    arcpy.Buffer_analysis(fl_network_lines, temp_linkbuff, LINKBUFF_DIST_FT, "FULL", "FLAT")
-    arcpy.MakeFeatureLayer_management(temp_linkbuff, fl_link_buff)
+    # layer of prebuilt flat-tipped buffers around selected links; will be used to split project lines
+    fl_link_buff = line_buffers.make_buffer_layer(fl_network_lines, fc_network_lines,
+                                                  params.line_overlap_buff_dist_ft, g_ESRI_variable_5)
 
     # get dict of data
     projdata_dict = conflate_link2projline(fl_projline, fl_link_buff, links_desc)
     
-    arcpy.Delete_management(temp_linkbuff)
+    arcpy.Delete_management(fl_link_buff)
 
     return projdata_dict
 
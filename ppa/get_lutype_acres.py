@@ -1,118 +1,86 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
-# Esri start of added variables
-g_ESRI_variable_1 = 'fl_parcel'
-g_ESRI_variable_2 = 'fl_project'
-g_ESRI_variable_3 = 'fl_buff'
-g_ESRI_variable_4 = os.path.join(arcpy.env.scratchGDB, 'temp_intersect')
-g_ESRI_variable_5 = 'fl_intersect'
-# Esri end of added variables
-
 #--------------------------------
 # Name:get_lutype_acres.py
 # Purpose: Based on parcel polygon intersection with buffer around project segment, get % of acres near project that are of specific land use type
 #           This version of script calculates the percent based on on-parcel acres (i.e., the total acreage excludes water/rights of way)
+#           Areas come from ProjectContext.lutype_areas() (see polygon_overlay.py), so all land use types for a year
+#           share a single overlay of the buffer with the parcel polygons.
 #
 # Author: Darren Conly
-# Last Updated: 12/30/2019
+# Last Updated: 10/2026
 # Updated by: <name>
 # Copyright:   (c) SACOG
 # Python Version: 3.x
 #--------------------------------
-import time
-
 import ppa_input_params as params
+from project_context import ProjectContext
 
 class GetLandUseArea():
-    def __init__(self, fc_project, projtyp, fc_poly_parcels):
+    def __init__(self, fc_project, projtyp, fc_poly_parcels, proj_ctx=None, lutype_areas=None):
         
         #user inputs
         self.fc_project = fc_project
         self.projtyp = projtyp
         self.fc_poly_parcels = fc_poly_parcels
-        
-        # fixed values
-        self.fc_intersect = g_ESRI_variable_4
+        self.proj_ctx = proj_ctx if proj_ctx is not None else ProjectContext(fc_project, projtyp)
         
         # derived/calculated objects
-        self.buff_pclpoly_intersect()
-        
-    def buff_pclpoly_intersect(self):
-        # arcpy.AddMessage("script updated {}".format(int(time.perf_counter()))) # when troubleshooting
-        
-    
-        sufx = int(time.perf_counter()) + 1
-        fl_parcels = os.path.join(arcpy.env.scratchGDB, 'fl_parcels{}'.format(sufx))
-        fl_project = g_ESRI_variable_2
-    
-        if arcpy.Exists(fl_parcels): arcpy.Delete_management(fl_parcels)
-        
-        arcpy.MakeFeatureLayer_management(self.fc_poly_parcels, fl_parcels)
-        
-        if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-        arcpy.MakeFeatureLayer_management(self.fc_project, fl_project)  
-    
-        # create temporary buffer IF the input project fc is a line. 
-        # If it's a polygon, then don't make separate buffer
-        if self.projtyp == params.ptype_area_agg:
-            fc_buff = self.fc_project
-        else:
-            buff_dist = params.ilut_sum_buffdist  # distance in feet
-            fc_buff = os.path.join(arcpy.env.scratchGDB, "temp_buff_hmi")  # r"memory\temp_buff_hmi"
-            if arcpy.Exists(fc_buff): arcpy.Delete_management(fc_buff)
-            arcpy.Buffer_analysis(fl_project, fc_buff, buff_dist)
-    
-        fl_buff = g_ESRI_variable_3
-        arcpy.MakeFeatureLayer_management(fc_buff, fl_buff)
-        
-    
-        """ 
-        # calculate buffer area, inclusive of water bodies and rights of way
-        buff_area_ft2 = 0
-        with arcpy.da.SearchCursor(fl_buff, ["SHAPE@AREA"]) as cur:
-            for row in cur:
-                buff_area_ft2 += row[0]
-        buff_acre = buff_area_ft2 / params.ft2acre  # convert from ft2 to acres. may need to adjust for projection-related issues. See PPA1 for more info
-        """
-    
-        # create intersect layer of buffer with parcels of selected LUTYPE
-        if arcpy.Exists(self.fc_intersect): arcpy.Delete_management(self.fc_intersect)
-        arcpy.Intersect_analysis([fl_buff, fl_parcels], self.fc_intersect, "ALL", "", "INPUT")
-        
-        for item in [fl_parcels, fl_project, fl_buff]:
-            try:
-                arcpy.Delete_management(item)
-            except:
-                arcpy.AddWarning("Unable to delete feature layer {}".format(item))
-                continue
+        # {LUTYPE: on-parcel ft2 in buffer}, from one overlay of the buffer with the parcels. Can be passed in
+        # if already calculated (e.g. by another metric_dag node), otherwise it's shared through proj_ctx
+        self.lutype_areas = lutype_areas if lutype_areas is not None \
+            else self.proj_ctx.lutype_areas(self.fc_poly_parcels, params.ilut_sum_buffdist)
+
+    def get_lu_acres_by_type(self, lutypes=[]):
+        '''Net acres and share of on-parcel acres within buffer for every land use type in the buffer, plus any
+        types in lutypes that aren't in the buffer (as 0), from one pass over the overlay areas'''
+        # total area on parcels within buffer (excluding water and rights of way)
+        pclarea_inbuff_ft2 = sum(self.lutype_areas.values())  # total on-parcel acres within buffer
+
+        lutype_areas_ft2 = {lutype: 0 for lutype in lutypes}
+        lutype_areas_ft2.update({lutype: area for lutype, area in self.lutype_areas.items() if lutype is not None})
+
+        out_dict = {'total_net_pcl_acres': pclarea_inbuff_ft2 / params.ft2acre}
+        for lutype in sorted(lutype_areas_ft2.keys()):
+            lutype_intersect_ft2 = lutype_areas_ft2[lutype]  # total acres of land use type within buffer
+
+            # share of on-parcel land within buffer that is of land use type, and acres of land use type
+            out_dict['net_{}_acres'.format(lutype)] = lutype_intersect_ft2 / params.ft2acre
+            out_dict['pct_{}_inbuff'.format(lutype)] = lutype_intersect_ft2 / pclarea_inbuff_ft2 \
+                if pclarea_inbuff_ft2 > 0 else 0
+
+        return out_dict
 
     def get_lu_acres(self, lutype):
-        # calculate total area on parcels within buffer (excluding water and rights of way)
-        fl_intersect = g_ESRI_variable_5
-        
-        if arcpy.Exists(fl_intersect): arcpy.Delete_management(fl_intersect)
-        arcpy.MakeFeatureLayer_management(self.fc_intersect, fl_intersect)
-    
-        # get total acres within intersect polygons
-        pclarea_inbuff_ft2 = 0  # total on-parcel acres within buffer
-        lutype_intersect_ft2 = 0  # total acres of specified land use type within buffer
-        with arcpy.da.SearchCursor(fl_intersect, ["SHAPE@AREA", params.col_lutype]) as cur:
-            for row in cur:
-                pclarea_inbuff_ft2 += row[0]
-                if row[1] == lutype:
-                    lutype_intersect_ft2 += row[0]
-    
-        # get share of on-parcel land within buffer that is of specified land use type
-        pct_lutype = lutype_intersect_ft2 / pclarea_inbuff_ft2 if pclarea_inbuff_ft2 > 0 else 0
-    
-        # convert to acres
-        buff_acre = pclarea_inbuff_ft2 / params.ft2acre
-        lutype_intersect_acres = lutype_intersect_ft2 / params.ft2acre
-    
-        return {'total_net_pcl_acres': buff_acre, 'net_{}_acres'.format(lutype): lutype_intersect_acres,
-                'pct_{}_inbuff'.format(lutype): pct_lutype}
+        '''total net parcel acres in buffer, plus acres and share of them that are of land use type lutype'''
+        acres_by_type = self.get_lu_acres_by_type([lutype])
+        out_keys = ['total_net_pcl_acres', 'net_{}_acres'.format(lutype), 'pct_{}_inbuff'.format(lutype)]
+
+        return {k: acres_by_type[k] for k in out_keys}
+
+
+def get_lutype_areas(fc_project, projtyp, fc_poly_parcels, proj_ctx=None):
+    '''{LUTYPE: on-parcel ft2 in buffer} for fc_poly_parcels, e.g. as a metric_dag node whose result is passed to
+    get_lu_acres() and urbanization_metrics.nat_resources() for the same parcel year'''
+    return GetLandUseArea(fc_project, projtyp, fc_poly_parcels, proj_ctx=proj_ctx).lutype_areas
+
+
+def get_lu_acres(fc_project, projtyp, fc_poly_parcels, lutype, proj_ctx=None, lutype_areas=None):
+    '''Function form of GetLandUseArea(...).get_lu_acres(lutype), e.g. for running as a metric_dag node'''
+    return GetLandUseArea(fc_project, projtyp, fc_poly_parcels, proj_ctx=proj_ctx,
+                          lutype_areas=lutype_areas).get_lu_acres(lutype)
+
+
+def get_lu_acres_by_type(fc_project, projtyp, fc_poly_parcels, lutypes=[], proj_ctx=None, lutype_areas=None):
+    '''Function form of GetLandUseArea(...).get_lu_acres_by_type(lutypes), e.g. for running as a metric_dag node'''
+    return GetLandUseArea(fc_project, projtyp, fc_poly_parcels, proj_ctx=proj_ctx,
+                          lutype_areas=lutype_areas).get_lu_acres_by_type(lutypes)
 
 
 
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -22,13 +26,12 @@ g_ESRI_variable_4 = 'fl_tmc_buff'
 #--------------------------------
 
 
-import os
-
-import arcpy
 import pandas as pd
 
 import ppa_input_params as params
+import ppa_utils as utils
 import npmrds_data_conflation as ndc
+from project_context import ProjectContext
 
 def get_wtdavg_truckdata(in_df, col_name):
     len_cols = ['{}_calc_len'.format(dirn) for dirn in params.directions_tmc]
@@ -50,37 +53,8 @@ def get_wtdavg_truckdata(in_df, col_name):
 
 
 
-def get_tmc_truck_data(fc_projline, str_project_type):
-
-    arcpy.OverwriteOutput = True
-    fl_projline = g_ESRI_variable_1
-    arcpy.MakeFeatureLayer_management(fc_projline, fl_projline)
-
-    # make feature layer from speed data feature class
-    fl_speed_data = g_ESRI_variable_2
-    arcpy.MakeFeatureLayer_management(params.fc_speed_data, fl_speed_data)
-
-    # make flat-ended buffers around TMCs that intersect project
-    arcpy.SelectLayerByLocation_management(fl_speed_data, "WITHIN_A_DISTANCE", fl_projline, params.tmc_select_srchdist, "NEW_SELECTION")
-    if str_project_type == 'Freeway':
-        sql = g_ESRI_variable_3.format(params.col_roadtype, params.roadtypes_fwy)
-        arcpy.SelectLayerByAttribute_management(fl_speed_data, "SUBSET_SELECTION", sql)
-    else:
-        sql = "{} NOT IN {}".format(params.col_roadtype, params.roadtypes_fwy)
-        arcpy.SelectLayerByAttribute_management(fl_speed_data, "SUBSET_SELECTION", sql)
-
-    # create temporar buffer layer, flat-tipped, around TMCs; will be used to split project lines
-    scratch_gdb = arcpy.env.scratchGDB
-        
-    temp_tmcbuff = os.path.join(scratch_gdb, "TEMP_tmcbuff_4projsplit")
-    fl_tmc_buff = g_ESRI_variable_4
-    arcpy.Buffer_analysis(fl_speed_data, temp_tmcbuff, params.tmc_buff_dist_ft, "FULL", "FLAT")
-    arcpy.MakeFeatureLayer_management(temp_tmcbuff, fl_tmc_buff)
-
-    # get "full" table with data for all directions
-    projdata_df = ndc.conflate_tmc2projline(fl_projline, params.directions_tmc, params.col_tmcdir, 
-                                            fl_tmc_buff, params.truck_data_calc_dict)
-
+def get_truck_outputs(projdata_df):
+    '''distance-weighted truck data values for project, from conflate_tmc2projline() output'''
     out_dict = {}
     for field, calcmthd in params.truck_data_calc_dict.items():
         if calcmthd == params.calc_distwt_avg:
@@ -91,7 +65,33 @@ def get_tmc_truck_data(fc_projline, str_project_type):
         
     return out_dict
 
-    arcpy.Delete_management(temp_tmcbuff)
+
+def get_tmc_truck_data(fc_projline, str_project_type, proj_ctx=None):
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_projline, str_project_type)
+
+    # get "full" table with data for all directions
+    projdata_df = ndc.get_tmc_projdata(proj_ctx, str_project_type, params.truck_data_calc_dict)
+
+    return get_truck_outputs(projdata_df)
+
+
+def get_tmc_speed_truck_data(fc_projline, str_project_type, proj_ctx=None):
+    '''Same outputs as npmrds_data_conflation.get_npmrds_data() and get_tmc_truck_data(), from one TMC conflation
+    with the speed and truck fields together. Returns (speed/reliability dict, truck data dict).'''
+    utils.add_message("Calculating congestion, reliability, and truck metrics...")
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_projline, str_project_type)
+
+    fields_calc_dict = dict(params.spd_data_calc_dict)
+    fields_calc_dict.update(params.truck_data_calc_dict)
+    calc_groups = {'speed': list(params.spd_data_calc_dict.keys()), 'truck': list(params.truck_data_calc_dict.keys())}
+
+    projdata = ndc.get_tmc_projdata(proj_ctx, str_project_type, fields_calc_dict, calc_groups)
+
+    return ndc.simplify_outputs(projdata['speed'], 'proj_length_ft')[0], get_truck_outputs(projdata['truck'])
 
 '''
 if __name__ == '__main__':
@@ -27,6 +27,7 @@ import time
 import arcpy
 
 import ppa_input_params as params
+from project_context import ProjectContext
 
 def trace():
     import traceback, inspect
@@ -40,45 +41,25 @@ def trace():
     return line, filename, synerror
 
 
-def get_poly_area(poly_fl):
-    buff_area_ft2 = 0
-    with arcpy.da.SearchCursor(poly_fl, ["SHAPE@AREA"]) as cur:
-        for row in cur:
-            buff_area_ft2 += row[0]
 
-    buff_acre = buff_area_ft2 / params.ft2acre  # convert from ft2 to acres. may need to adjust for projection-related issues. See PPA1 for more info
-    return buff_acre
-
-
-def intersection_density(fc_project, fc_intersxns, project_type):
+def intersection_density(fc_project, fc_intersxns, project_type, proj_ctx=None):
     arcpy.AddMessage("Calculating intersection density...")
     
-    fl_project = g_ESRI_variable_1
     fl_intersxns = os.path.join('memory',g_ESRI_variable_2)
 
 
     try:
-        if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-        arcpy.MakeFeatureLayer_management(fc_project, fl_project)
-        
+        if proj_ctx is None:
+            proj_ctx = ProjectContext(fc_project, project_type)
+
         if arcpy.Exists(fl_intersxns): arcpy.Delete_management(fl_intersxns)    
         arcpy.MakeFeatureLayer_management(fc_intersxns, fl_intersxns)
 
         # analysis area. If project is line or point, then it's a buffer around the line/point.
         # If it's a polygon (e.g. ctype or region), then no buffer and analysis area is that within the input polygon
-        if project_type == params.ptype_area_agg:
-            fc_buff = fc_project
-        else:
-            params.intersxn_dens_buff
-            fc_buff = r"memory\temp_buff_qmi"
-            arcpy.Buffer_analysis(fl_project, fc_buff, params.intersxn_dens_buff)
-
-        fl_buff = "fl_buff"
-    
-        if arcpy.Exists(fl_buff): arcpy.Delete_management(fl_buff)
-        arcpy.MakeFeatureLayer_management(fc_buff, fl_buff)
+        fl_buff = proj_ctx.buffer_fl(params.intersxn_dens_buff)
 
-        buff_acres = get_poly_area(fl_buff)
+        buff_acres = proj_ctx.buffer_acres(params.intersxn_dens_buff)
 
         # get count of transit stops within buffer
         arcpy.SelectLayerByLocation_management(fl_intersxns, "INTERSECT", fl_buff, 0, "NEW_SELECTION")
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -17,19 +21,176 @@ Get following numbers within 0.5mi of project area:
 
 """
 import time
+from collections import namedtuple
 
-import arcpy
 import pandas as pd
 
 import ppa_input_params as params
+import ppa_utils as utils
+import geom_backend
+import layer_store
+from project_context import ProjectContext
+
+
+# one requested parcel aggregation for point_sum_batch(). Same meaning as the LandUseBuffCalcs arguments;
+# density=True returns values per net parcel acre, like LandUseBuffCalcs.point_sum_density()
+LUSumSpec = namedtuple('LUSumSpec', ['val_fields', 'buffdist', 'case_field', 'case_excs_list', 'density'])
+LUSumSpec.__new__.__defaults__ = (None, [], False)
+
+col_pcl_dist = 'PROJ_DIST_FT'  # distance from each parcel point to the project
+
+
+def load_parcel_pts(fc_pclpt, proj_ctx, fields, buffdist, get_dists=False):
+    '''Load data for all parcel points within buffdist of the project into a dataframe. If get_dists=True,
+    also add column with each parcel's distance to the project, so that smaller buffers can be
+    taken from the same dataframe without another spatial selection.'''
+    sufx = int(time.perf_counter()) + 1
+    fl_parcel = os.path.join('memory','fl_parcel{}'.format(sufx))
+    
+    if arcpy.Exists(fl_parcel): arcpy.Delete_management(fl_parcel)
+    arcpy.MakeFeatureLayer_management(fc_pclpt, fl_parcel)
+
+    arcpy.SelectLayerByLocation_management(fl_parcel, "WITHIN_A_DISTANCE", proj_ctx.fl_project, buffdist)
+
+    # {parcel OID: distance to project}. Parcels inside a polygon "project" are distance 0.
+    pcl_dists = {}
+    if get_dists:
+        near_tbl = os.path.join('memory', 'pcl_near{}'.format(sufx))
+        if arcpy.Exists(near_tbl): arcpy.Delete_management(near_tbl)
+        arcpy.GenerateNearTable_analysis(fl_parcel, proj_ctx.fl_project, near_tbl, buffdist, "NO_LOCATION",
+                                         "NO_ANGLE", "CLOSEST")
+        with arcpy.da.SearchCursor(near_tbl, ["IN_FID", "NEAR_DIST"]) as cur:
+            for row in cur:
+                pcl_dists[row[0]] = row[1]
+        arcpy.Delete_management(near_tbl)
+
+    rows_pcldata = []
+    with arcpy.da.SearchCursor(fl_parcel, ["OID@"] + fields) as cur:
+        for row in cur:
+            df_row = list(row[1:])
+            if get_dists:
+                df_row.append(pcl_dists.get(row[0], buffdist)) # parcel was selected, so is within buffdist
+            rows_pcldata.append(df_row)
+
+    df_cols = fields + [col_pcl_dist] if get_dists else fields
+    parcel_df = pd.DataFrame(rows_pcldata, columns=df_cols)
+
+    arcpy.Delete_management(fl_parcel)
+
+    return parcel_df
+
+
+def load_parcel_pts_store(pcl_store_dir, proj_ctx, fields, buffdist):
+    '''Same as load_parcel_pts(get_dists=True), but reads from the parcel point layer_store instead
+    of making an arcpy selection and cursor scan.'''
+    pcl_store = layer_store.open_store(pcl_store_dir)
+    pcl_idx, pcl_dists = pcl_store.query_within(proj_ctx.geometry, buffdist)
+
+    parcel_df = pcl_store.to_df(fields, pcl_idx)
+    parcel_df[col_pcl_dist] = pcl_dists
+
+    return parcel_df
+
+
+def load_parcel_pts_backend(fc_pclpt, proj_ctx, fields, buffdist):
+    '''Same as load_parcel_pts(get_dists=True), but with the non-arcpy geometry backend'''
+    backend = proj_ctx.backend
+    fs_parcels = backend.read_features(fc_pclpt, fields)
+    pcl_idx = backend.select_by_location(fs_parcels, proj_ctx.shape, geom_backend.rel_within_dist, buffdist)
+
+    parcel_df = fs_parcels.df.iloc[pcl_idx].reset_index(drop=True)
+    parcel_df[col_pcl_dist] = backend.distances(fs_parcels.geoms[pcl_idx], proj_ctx.shape)
+
+    return parcel_df
+
+
+def sum_parcel_df(parcel_df, val_fields, case_field=None, case_excs_list=[]):
+    '''Sum val_fields for parcels in parcel_df, optionally by case_field (e.g. EJ flag, housing type)'''
+    if case_field is not None:
+        parcel_df = parcel_df[val_fields + [case_field]]
+        parcel_df = parcel_df.loc[~parcel_df[case_field].isin(case_excs_list)] #exclude specified categories
+        out_df = parcel_df.groupby(case_field).sum().T # get sum by category (case field)
+        # NEXT ISSUE - need to figure out how to show all case types, even if no parcels with that case type within the buffer
+    else:
+        out_df = pd.DataFrame(parcel_df[val_fields].sum(axis=0)).T
+
+    out_recs = out_df.to_dict('records')
+    out_dict = out_recs[0] if len(out_recs) > 0 else {} # no parcels within buffer with a non-excluded case value
+
+    return out_dict
+
+
+def sums_to_density(dict_totals):
+    '''convert parcel sums to values per net parcel acre. Area is area of entire parcels whose centroid is within the buffer'''
+    area_unit = "NetPclAcre"
+    dict_out = {}
+    for valfield, val in dict_totals.items():
+        if valfield == params.col_area_ac:
+            continue
+        else:
+            val_density = dict_totals[valfield] / dict_totals[params.col_area_ac]
+            dict_out_key = "{}_{}".format(valfield, area_unit)
+            dict_out[dict_out_key] = val_density
+
+    return dict_out
+
+
+def point_sum_batch(fc_pclpt, proj_ctx, lu_specs):
+    '''Get parcel sums/densities for many LUSumSpecs (different fields, buffer distances, case fields) with one
+    spatial selection and one cursor pass over the parcel points, or one query of the parcel layer_store if it
+    exists. Each parcel's distance to the project is found once, then each spec takes the parcels within its
+    own buffer distance.
+    Returns list of output dicts, in same order as lu_specs.'''
+    utils.add_message("Aggregating land use data...")
+
+    is_area_agg = proj_ctx.project_type == params.ptype_area_agg
+    buffdists = [0 if is_area_agg else spec.buffdist for spec in lu_specs]
+    max_dist = max(buffdists)
+
+    # only need each parcel's distance if specs use different buffer distances
+    get_dists = len(set(buffdists)) > 1
+
+    load_fields = []
+    for spec in lu_specs:
+        spec_fields = list(spec.val_fields) + [spec.case_field] if spec.case_field else list(spec.val_fields)
+        if spec.density:
+            spec_fields.append(params.col_area_ac)
+        load_fields += [f for f in spec_fields if f not in load_fields]
+
+    # use columnar parcel store if one has been made for this parcel layer
+    pcl_store_dir = params.layer_store_path(fc_pclpt)
+    if layer_store.store_exists(pcl_store_dir):
+        parcel_df = load_parcel_pts_store(pcl_store_dir, proj_ctx, load_fields, max_dist)
+        get_dists = True
+    elif proj_ctx.use_gp_tools:
+        parcel_df = load_parcel_pts(fc_pclpt, proj_ctx, load_fields, max_dist, get_dists)
+    else:
+        parcel_df = load_parcel_pts_backend(fc_pclpt, proj_ctx, load_fields, max_dist)
+        get_dists = True
+
+    out_dicts = []
+    for spec, buffdist in zip(lu_specs, buffdists):
+        spec_df = parcel_df.loc[parcel_df[col_pcl_dist] <= buffdist] if get_dists else parcel_df
+
+        val_fields = list(spec.val_fields)
+        if spec.density and params.col_area_ac not in val_fields:
+            val_fields.append(params.col_area_ac)
+
+        dict_totals = sum_parcel_df(spec_df, val_fields, spec.case_field, spec.case_excs_list)
+        out_dicts.append(sums_to_density(dict_totals) if spec.density else dict_totals)
+
+    return out_dicts
+
 
 class LandUseBuffCalcs():
     '''
     Class will always automatically calculate the sum totals (e.g. total population) 
     for all parcels within a distance of a project line. Optionally,
-    The user can run the point_sum_density() method to get the density (e.g. population density) within the buffer area
+    The user can run the point_sum_density() method to get the density (e.g. population density) within the buffer area.
+    To get several sums/densities at once, use point_sum_batch() instead.
     '''
-    def __init__(self,fc_pclpt, fc_project, project_type, val_fields, buffdist, case_field=None, case_excs_list=[]):
+    def __init__(self,fc_pclpt, fc_project, project_type, val_fields, buffdist, case_field=None, case_excs_list=[],
+                 proj_ctx=None):
         
         # user inputs
         self.fc_pclpt = fc_pclpt
@@ -39,49 +200,12 @@ class LandUseBuffCalcs():
         self.buffdist = buffdist
         self.case_field = case_field
         self.case_excs_list = case_excs_list
+        self.proj_ctx = proj_ctx if proj_ctx is not None else ProjectContext(fc_project, project_type)
         
 
     def point_sum(self):
-        arcpy.AddMessage("Aggregating land use data...")
-        
-        sufx = int(time.perf_counter()) + 1
-        fl_parcel = os.path.join('memory','fl_parcel{}'.format(sufx))
-        fl_project = g_ESRI_variable_2
-        
-        if arcpy.Exists(fl_parcel): arcpy.Delete_management(fl_parcel)
-        arcpy.MakeFeatureLayer_management(self.fc_pclpt, fl_parcel)
-        
-        if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-        arcpy.MakeFeatureLayer_management(self.fc_project, fl_project)    
-    
-        buff_dist = 0 if self.project_type == params.ptype_area_agg else self.buffdist
-        arcpy.SelectLayerByLocation_management(fl_parcel, "WITHIN_A_DISTANCE", fl_project, buff_dist)
-    
-        # If there are no points in the buffer (e.g., no collisions on segment, no parcels, etc.),
-        # still add those columns, but make them = 0
-        file_len = arcpy.GetCount_management(fl_parcel)
-        file_len = int(file_len.getOutput(0))
-    
-        if self.case_field is not None:
-            self.val_fields.append(self.case_field)
-    
-        # load parcel data into dataframe
-        rows_pcldata = []
-        with arcpy.da.SearchCursor(fl_parcel, self.val_fields) as cur:
-            for row in cur:
-                df_row = list(row)
-                rows_pcldata.append(df_row)
-    
-        parcel_df = pd.DataFrame(rows_pcldata, columns = self.val_fields)
-    
-        if self.case_field is not None:
-            parcel_df = parcel_df.loc[~parcel_df[self.case_field].isin(self.case_excs_list)] #exclude specified categories
-            out_df = parcel_df.groupby(self.case_field).sum().T # get sum by category (case field)
-            # NEXT ISSUE - need to figure out how to show all case types, even if no parcels with that case type within the buffer
-        else:
-            out_df = pd.DataFrame(parcel_df[self.val_fields].sum(axis=0)).T
-    
-        out_dict = out_df.to_dict('records')[0]
+        lu_spec = LUSumSpec(self.val_fields, self.buffdist, self.case_field, self.case_excs_list)
+        out_dict = point_sum_batch(self.fc_pclpt, self.proj_ctx, [lu_spec])[0]
     
         return out_dict
     
@@ -93,28 +217,12 @@ class LandUseBuffCalcs():
         # area used in density calculation is land on parcels whose centroid is within the buffer distance. It includes
         # area of entire parcel, both inside and outside the buffer, not "slices" of parcels that are bisected by buffer boundary.
         
-        # make sure you calculate the area for normalizing
-        if params.col_area_ac not in self.val_fields:
-            self.val_fields.append(params.col_area_ac)
-    
-        #get values (e.g. total pop, total jobs, etc.)
-        dict_totals = self.point_sum()
-    
-        # calculate density per unit of area for each value (e.g. jobs/acre, pop/acre, etc.)
         # This density is based on total parcel area, i.e., even if parts of some of the parcels are outside of the
         # buffer polygon. Since it is density this is a good method (alternative, which would give same answer, is to do
         # the intersect, then divide that area by the area-weighted value (value = pop, emptot, etc.). But this is simpler and
         # gives same density number.
-    
-        area_unit = "NetPclAcre"
-        dict_out = {}
-        for valfield, val in dict_totals.items():
-            if valfield == params.col_area_ac:
-                continue
-            else:
-                val_density = dict_totals[valfield] / dict_totals[params.col_area_ac]
-                dict_out_key = "{}_{}".format(valfield, area_unit)
-                dict_out[dict_out_key] = val_density
+        lu_spec = LUSumSpec(self.val_fields, self.buffdist, self.case_field, self.case_excs_list, density=True)
+        dict_out = point_sum_batch(self.fc_pclpt, self.proj_ctx, [lu_spec])[0]
     
         return dict_out
 
@@ -0,0 +1,580 @@
+# --------------------------------
+# Name: layer_store.py
+# Purpose: Columnar, memory-mapped copy of a point layer (e.g., parcel points for one year) with a uniform
+#           grid spatial index, so that "points within X feet of a project" is an array slice instead of an
+#           arcpy selection + cursor scan. Reading a store only needs NumPy, so it also works without ArcGIS.
+#           Line and polygon layers can also be stored (as WKB), for use by geom_backend without arcpy.
+#           Each store records the data version of its source layer (see source_version()); a store made from an
+#           older version of its layer is not used.
+#
+#           Store layout (one folder per layer):
+#               meta.json - field names, dtypes, string categories, grid index parameters, source layer and its version
+#               x.npy, y.npy - point coordinates (point stores)
+#               wkb_data.npy, wkb_offsets.npy, bounds.npy - WKB bytes for each shape and their bounding boxes (shape stores)
+#               <field>.npy - one file per attribute field. String fields are saved as integer codes
+#               grid_cell_start.npy - row offsets for each grid cell (rows are sorted by grid cell)
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import json
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import ppa_utils as utils
+
+meta_file = 'meta.json'
+col_x = 'x'
+col_y = 'y'
+file_cell_start = 'grid_cell_start.npy'
+col_wkb_data = 'wkb_data'
+col_wkb_offsets = 'wkb_offsets'
+col_bounds = 'bounds'
+
+store_type_point = 'point'
+store_type_shape = 'shape'
+
+default_cell_size = 1320 # feet
+
+# max number of point-segment pairs to compute distances for at one time, to limit memory use
+max_pairs_per_chunk = 4000000
+points_per_block = 4096 # points compared at one time with the segments near them, when computing distances without shapely
+
+_data_versions = None # {layer name: data version} from params.data_version_table, read once per process
+_store_current = {} # {store folder: True if made from the current version of its source layer}
+
+
+# =============WRITING STORES=============================================
+
+def write_point_store(out_dir, xs, ys, field_data, cell_size=default_cell_size, source=None):
+    '''Write point coordinates and attributes to a columnar store in out_dir.
+    field_data = {field name: 1D array or list of values, same length as xs}'''
+    xs = np.asarray(xs, dtype='float64')
+    ys = np.asarray(ys, dtype='float64')
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    # grid index. Rows are sorted by grid cell so that each cell's points are one contiguous slice.
+    xmin, ymin = float(xs.min()), float(ys.min())
+    n_cols = int((xs.max() - xmin) // cell_size) + 1
+    n_rows = int((ys.max() - ymin) // cell_size) + 1
+    cell_ids = ((ys - ymin) // cell_size).astype('int64') * n_cols + ((xs - xmin) // cell_size).astype('int64')
+
+    sort_order = np.argsort(cell_ids, kind='stable')
+    cell_counts = np.bincount(cell_ids, minlength=n_rows * n_cols)
+    cell_start = np.concatenate([[0], np.cumsum(cell_counts)]).astype('int64')
+
+    np.save(os.path.join(out_dir, '{}.npy'.format(col_x)), xs[sort_order])
+    np.save(os.path.join(out_dir, '{}.npy'.format(col_y)), ys[sort_order])
+    np.save(os.path.join(out_dir, file_cell_start), cell_start)
+
+    fields_meta = write_fields(out_dir, field_data, sort_order)
+
+    meta = {'store_type': store_type_point, 'source': source, 'source_version': source_version(source),
+            'created': str(dt.datetime.now()),
+            'row_count': int(xs.size), 'fields': fields_meta,
+            'grid': {'xmin': xmin, 'ymin': ymin, 'cell_size': cell_size, 'n_cols': n_cols, 'n_rows': n_rows}}
+
+    with open(os.path.join(out_dir, meta_file), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    return out_dir
+
+
+def write_fields(out_dir, field_data, row_order=None):
+    '''save each attribute field to its own .npy file, rows in row_order. Returns field info for meta file.'''
+    fields_meta = {}
+    for fname, vals in field_data.items():
+        vals = pd.Series(vals)
+        if row_order is not None:
+            vals = vals.iloc[row_order]
+        if vals.dtype.kind == 'O' and vals.dropna().map(lambda v: isinstance(v, (int, float))).all():
+            vals = pd.to_numeric(vals) # numeric field with nulls; nulls become NaN
+
+        if vals.dtype.kind in ('O', 'U', 'S'):
+            # strings saved as integer codes, -1 = null; category labels kept in meta file
+            codes, cats = pd.factorize(vals, sort=True)
+            np.save(os.path.join(out_dir, '{}.npy'.format(fname)), codes.astype('int32'))
+            fields_meta[fname] = {'dtype': 'category', 'categories': [str(c) for c in cats]}
+        else:
+            np.save(os.path.join(out_dir, '{}.npy'.format(fname)), vals.to_numpy())
+            fields_meta[fname] = {'dtype': str(vals.dtype)}
+
+    return fields_meta
+
+
+def write_shape_store(out_dir, wkbs, bounds, field_data, source=None):
+    '''Write line or polygon features to a store in out_dir. wkbs = list of WKB bytes for each feature;
+    bounds = (n, 4) array of each feature's xmin, ymin, xmax, ymax'''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    wkb_lens = np.array([len(b) for b in wkbs], dtype='int64')
+    wkb_offsets = np.concatenate([[0], np.cumsum(wkb_lens)]).astype('int64')
+    wkb_data = np.frombuffer(b''.join(wkbs), dtype='uint8')
+
+    np.save(os.path.join(out_dir, '{}.npy'.format(col_wkb_data)), wkb_data)
+    np.save(os.path.join(out_dir, '{}.npy'.format(col_wkb_offsets)), wkb_offsets)
+    np.save(os.path.join(out_dir, '{}.npy'.format(col_bounds)), np.asarray(bounds, dtype='float64').reshape(-1, 4))
+
+    fields_meta = write_fields(out_dir, field_data)
+
+    meta = {'store_type': store_type_shape, 'source': source, 'source_version': source_version(source),
+            'created': str(dt.datetime.now()),
+            'row_count': len(wkbs), 'fields': fields_meta}
+
+    with open(os.path.join(out_dir, meta_file), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    return out_dir
+
+
+def export_point_store(fc_points, out_dir, fields=None, cell_size=default_cell_size):
+    '''Export an arcpy point feature class to a columnar store. If fields is None, all attribute
+    fields are exported.'''
+    if fields is None:
+        fields = [f.name for f in arcpy.ListFields(fc_points)
+                  if f.type not in ('OID', 'Geometry', 'Blob', 'Raster', 'GlobalID')
+                  and f.name.lower() not in ('shape_length', 'shape_area')]
+
+    arcpy.AddMessage("Exporting {} to {}...".format(fc_points, out_dir))
+    xs, ys = [], []
+    field_data = {f: [] for f in fields}
+    with arcpy.da.SearchCursor(fc_points, ['SHAPE@X', 'SHAPE@Y'] + fields) as cur:
+        for row in cur:
+            xs.append(row[0])
+            ys.append(row[1])
+            for i, f in enumerate(fields):
+                field_data[f].append(row[i + 2])
+
+    return write_point_store(out_dir, xs, ys, field_data, cell_size, source=fc_points)
+
+
+def export_shape_store(fc_shapes, out_dir, fields=None):
+    '''Export an arcpy line or polygon feature class to a shape store. If fields is None, all attribute
+    fields are exported.'''
+    if fields is None:
+        fields = [f.name for f in arcpy.ListFields(fc_shapes)
+                  if f.type not in ('OID', 'Geometry', 'Blob', 'Raster', 'GlobalID')
+                  and f.name.lower() not in ('shape_length', 'shape_area')]
+
+    arcpy.AddMessage("Exporting {} to {}...".format(fc_shapes, out_dir))
+    wkbs, bounds = [], []
+    field_data = {f: [] for f in fields}
+    with arcpy.da.SearchCursor(fc_shapes, ['SHAPE@WKB', 'SHAPE@'] + fields) as cur:
+        for row in cur:
+            ext = row[1].extent
+            wkbs.append(bytes(row[0]))
+            bounds.append([ext.XMin, ext.YMin, ext.XMax, ext.YMax])
+            for i, f in enumerate(fields):
+                field_data[f].append(row[i + 2])
+
+    return write_shape_store(out_dir, wkbs, bounds, field_data, source=fc_shapes)
+
+
+# =============SOURCE LAYER VERSIONS=============================================
+
+def read_data_versions():
+    '''{layer name: data version} from params.data_version_table, or {} if there is no such table'''
+    global _data_versions
+    if _data_versions is None:
+        _data_versions = {}
+        ver_table = os.path.join(params.fgdb, params.data_version_table)
+        if arcpy is not None and arcpy.Exists(ver_table):
+            with arcpy.da.SearchCursor(ver_table, [params.col_dataver_layer, params.col_dataver_version]) as cur:
+                for row in cur:
+                    _data_versions[row[0]] = str(row[1])
+
+    return _data_versions
+
+
+def fgdb_version(gdb_path):
+    '''newest mod time of the files in a file geodatabase folder. Editing any layer in the geodatabase changes it.'''
+    mtimes = [entry.stat().st_mtime for entry in os.scandir(gdb_path)
+              if entry.is_file() and not entry.name.endswith('.lock')]
+
+    return max(mtimes) if mtimes else None
+
+
+def source_version(fc):
+    '''data version of layer fc: its row in params.data_version_table or, if it has none and is in a file geodatabase,
+    the geodatabase's mod time. None if neither can be read (e.g., no version table and no arcpy).'''
+    if fc is None:
+        return None
+
+    layer_ver = read_data_versions().get(os.path.basename(fc))
+    if layer_ver is None:
+        workspace = os.path.dirname(fc) if os.path.dirname(fc) else params.fgdb
+        while workspace and not workspace.lower().endswith('.gdb') and os.path.dirname(workspace) != workspace:
+            workspace = os.path.dirname(workspace) # layer in a feature dataset
+        if workspace.lower().endswith('.gdb') and os.path.isdir(workspace):
+            layer_ver = fgdb_version(workspace)
+
+    return layer_ver
+
+
+def store_is_current(store_dir):
+    '''False if the store was made from an older version of its source layer than the current one. Stores whose
+    layer version can't be read are taken to be current.'''
+    if _store_current.get(store_dir) is None:
+        with open(os.path.join(store_dir, meta_file), 'r') as f:
+            meta = json.load(f)
+
+        current_ver = source_version(meta.get('source'))
+        is_current = current_ver is None or meta.get('source_version') == current_ver
+        if not is_current:
+            utils.add_message("Layer store {} was made from an older version of {} and will not be used. " \
+                              "Re-export it to use it again.".format(store_dir, meta.get('source')))
+        _store_current[store_dir] = is_current
+
+    return _store_current[store_dir]
+
+
+def store_exists(store_dir):
+    '''True if store_dir has a store that was made from the current version of its source layer'''
+    return store_dir is not None and os.path.exists(os.path.join(store_dir, meta_file)) \
+           and store_is_current(store_dir)
+
+
+# =============GEOMETRY HELPERS=============================================
+
+def geom_parts(geom):
+    '''Split geometry (anything with __geo_interface__: arcpy Geometry, shapely, or a geojson-like dict) into
+    (list of vertex arrays for each line or ring, list of polygons, each polygon being a list of ring arrays)'''
+    gi = geom if isinstance(geom, dict) else geom.__geo_interface__
+    gtype, coords = gi['type'], gi['coordinates']
+
+    if gtype == 'Point':
+        lines, polys = [np.array([coords[:2]], dtype='float64')], []
+    elif gtype in ('MultiPoint', 'LineString'):
+        lines, polys = [np.array([c[:2] for c in coords], dtype='float64')], []
+    elif gtype == 'MultiLineString':
+        lines, polys = [np.array([c[:2] for c in line], dtype='float64') for line in coords], []
+    elif gtype == 'Polygon':
+        polys = [[np.array([c[:2] for c in ring], dtype='float64') for ring in coords]]
+        lines = [ring for poly in polys for ring in poly]
+    elif gtype == 'MultiPolygon':
+        polys = [[np.array([c[:2] for c in ring], dtype='float64') for ring in poly] for poly in coords]
+        lines = [ring for poly in polys for ring in poly]
+    else:
+        raise ValueError("Geometry type {} not supported.".format(gtype))
+
+    if gtype == 'MultiPoint':
+        # each point is its own zero-length "segment"
+        lines = [np.repeat(pt[np.newaxis, :], 2, axis=0) for pt in lines[0]]
+
+    return lines, polys
+
+
+def segment_arrays(lines):
+    '''start and end coordinates of every segment in lines, as two (n, 2) arrays. Single vertices become
+    zero-length segments.'''
+    starts, ends = [], []
+    for verts in lines:
+        if len(verts) == 1:
+            verts = np.repeat(verts, 2, axis=0)
+        starts.append(verts[:-1])
+        ends.append(verts[1:])
+
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def points_to_segments_dist(px, py, seg_start, seg_end, max_dist=np.inf):
+    '''distance from each point to the nearest of the segments. Points are taken in blocks, and each block is only
+    compared with the segments whose bounding box is within max_dist of the block's bounding box, so distances
+    greater than max_dist are not exact (points with no segment near their block get inf). Blocks are tightest when
+    nearby points are next to each other in px, py (e.g., store rows, which are sorted by grid cell).'''
+    out_dist = np.full(px.size, np.inf)
+    if px.size == 0:
+        return out_dist
+
+    seg_xmin = np.minimum(seg_start[:, 0], seg_end[:, 0])
+    seg_xmax = np.maximum(seg_start[:, 0], seg_end[:, 0])
+    seg_ymin = np.minimum(seg_start[:, 1], seg_end[:, 1])
+    seg_ymax = np.maximum(seg_start[:, 1], seg_end[:, 1])
+
+    for b in range(0, px.size, points_per_block):
+        bpx, bpy = px[b:b + points_per_block], py[b:b + points_per_block]
+        near = (seg_xmin <= bpx.max() + max_dist) & (seg_xmax >= bpx.min() - max_dist) \
+               & (seg_ymin <= bpy.max() + max_dist) & (seg_ymax >= bpy.min() - max_dist)
+        if not near.any():
+            continue
+
+        ax, ay = seg_start[near, 0], seg_start[near, 1]
+        dx, dy = seg_end[near, 0] - ax, seg_end[near, 1] - ay
+        seg_len2 = dx * dx + dy * dy
+        seg_len2[seg_len2 == 0] = 1 # zero-length segments; projection param t will be 0 because numerator is 0
+
+        chunk = max(1, max_pairs_per_chunk // max(1, ax.size))
+        for i in range(0, bpx.size, chunk):
+            cpx = bpx[i:i + chunk, np.newaxis]
+            cpy = bpy[i:i + chunk, np.newaxis]
+            t = np.clip(((cpx - ax) * dx + (cpy - ay) * dy) / seg_len2, 0, 1)
+            dist2 = (cpx - (ax + t * dx)) ** 2 + (cpy - (ay + t * dy)) ** 2
+            out_dist[b + i:b + i + cpx.shape[0]] = np.sqrt(dist2.min(axis=1))
+
+    return out_dist
+
+
+def points_in_polygon(px, py, poly_rings):
+    '''True for each point inside polygon (even-odd rule, so holes are excluded)'''
+    inside = np.zeros(px.size, dtype=bool)
+    for ring in poly_rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        chunk = max(1, max_pairs_per_chunk // max(1, x1.size))
+        for i in range(0, px.size, chunk):
+            cpx = px[i:i + chunk, np.newaxis]
+            cpy = py[i:i + chunk, np.newaxis]
+            crosses = (y1 > cpy) != (y2 > cpy)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_int = x1 + (cpy - y1) * (x2 - x1) / (y2 - y1)
+            n_cross = (crosses & (cpx < x_int)).sum(axis=1)
+            inside[i:i + chunk] ^= (n_cross % 2 == 1)
+
+    return inside
+
+
+def geom_distance(px, py, geom, max_dist=np.inf):
+    '''distance from each point to geom. Points inside a polygon are distance 0. Distances greater than max_dist
+    are not exact (see points_to_segments_dist()).'''
+    lines, polys = geom_parts(geom)
+    seg_start, seg_end = segment_arrays(lines)
+    dists = points_to_segments_dist(px, py, seg_start, seg_end, max_dist)
+
+    for poly_rings in polys:
+        dists[points_in_polygon(px, py, poly_rings)] = 0
+
+    return dists
+
+
+def to_shapely(geom):
+    '''geom (arcpy, shapely, or geojson-like dict) as a shapely geometry'''
+    if isinstance(geom, shapely.Geometry):
+        return geom
+
+    return shapely.geometry.shape(geom if isinstance(geom, dict) else geom.__geo_interface__)
+
+
+def points_within(px, py, geom, dist):
+    '''(True for each point within dist of geom, distances of those points). Points inside a polygon are distance 0.
+    Uses a prepared shapely geometry if shapely is installed, otherwise NumPy (see geom_distance()). With dist 0, only
+    points inside (or on) geom are found, without computing distances.'''
+    if shapely is not None:
+        geom = to_shapely(geom)
+        shapely.prepare(geom)
+        if dist == 0:
+            in_dist = shapely.intersects_xy(geom, px, py)
+            return in_dist, np.zeros(np.count_nonzero(in_dist))
+
+        pts = shapely.points(px, py)
+        if hasattr(shapely, 'dwithin'): # shapely 2.1+
+            in_dist = shapely.dwithin(geom, pts, dist)
+            return in_dist, shapely.distance(geom, pts[in_dist])
+
+        dists = shapely.distance(geom, pts)
+        in_dist = dists <= dist
+        return in_dist, dists[in_dist]
+
+    polys = geom_parts(geom)[1]
+    if dist == 0 and polys:
+        in_dist = np.zeros(px.size, dtype=bool)
+        for poly_rings in polys:
+            in_dist |= points_in_polygon(px, py, poly_rings)
+        return in_dist, np.zeros(np.count_nonzero(in_dist))
+
+    dists = geom_distance(px, py, geom, dist)
+    in_dist = dists <= dist
+    return in_dist, dists[in_dist]
+
+
+# =============READING STORES=============================================
+
+class GridIndex(object):
+    '''Uniform grid over the store's points. Because rows are sorted by cell id (row-major), the cells in
+    one row of the grid are one contiguous slice of the store's rows.'''
+    def __init__(self, grid_meta, cell_start):
+        self.xmin = grid_meta['xmin']
+        self.ymin = grid_meta['ymin']
+        self.cell_size = grid_meta['cell_size']
+        self.n_cols = grid_meta['n_cols']
+        self.n_rows = grid_meta['n_rows']
+        self.cell_start = cell_start
+
+    def rows_in_bbox(self, xmin, ymin, xmax, ymax):
+        '''store row indexes of all points in grid cells that overlap the bounding box'''
+        c0 = max(int((xmin - self.xmin) // self.cell_size), 0)
+        c1 = min(int((xmax - self.xmin) // self.cell_size), self.n_cols - 1)
+        r0 = max(int((ymin - self.ymin) // self.cell_size), 0)
+        r1 = min(int((ymax - self.ymin) // self.cell_size), self.n_rows - 1)
+        if c0 > c1 or r0 > r1:
+            return np.array([], dtype='int64')
+
+        slices = [np.arange(self.cell_start[r * self.n_cols + c0], self.cell_start[r * self.n_cols + c1 + 1])
+                  for r in range(r0, r1 + 1)]
+
+        return np.concatenate(slices)
+
+
+class ColumnStore(object):
+    '''Read-only access to the attribute columns of a store. Columns are memory-mapped, so only the rows
+    a query touches are read from disk.'''
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, meta_file), 'r') as f:
+            self.meta = json.load(f)
+
+        self.fields = list(self.meta['fields'].keys())
+        self._columns = {}
+
+    def _load_array(self, name):
+        return np.load(os.path.join(self.store_dir, '{}.npy'.format(name)), mmap_mode='r')
+
+    def column(self, field, idx=None):
+        '''values of field, for all rows or only rows idx. String fields are returned as their labels.'''
+        if self._columns.get(field) is None:
+            self._columns[field] = self._load_array(field)
+
+        vals = self._columns[field] if idx is None else self._columns[field][idx]
+        fmeta = self.meta['fields'][field]
+        if fmeta['dtype'] == 'category':
+            vals = np.array(fmeta['categories'] + [None], dtype=object)[vals] # code -1 (null) gets last item
+
+        return vals
+
+    def to_df(self, fields, idx=None):
+        return pd.DataFrame({f: self.column(f, idx) for f in fields}, columns=fields)
+
+
+class PointStore(ColumnStore):
+    '''Store made by write_point_store()'''
+    def __init__(self, store_dir):
+        super(PointStore, self).__init__(store_dir)
+        self.x = self._load_array(col_x)
+        self.y = self._load_array(col_y)
+        self.grid = GridIndex(self.meta['grid'], np.load(os.path.join(store_dir, file_cell_start)))
+        self._tree = None
+
+    def shapes(self, idx=None):
+        '''points as shapely geometries'''
+        import shapely
+        xs = self.x if idx is None else self.x[idx]
+        ys = self.y if idx is None else self.y[idx]
+        return shapely.points(np.asarray(xs), np.asarray(ys))
+
+    def query_within(self, geom, dist):
+        '''(row indexes, distances) of all points within dist of geom (see points_within())'''
+        if shapely is not None:
+            geom = to_shapely(geom)
+            xmin, ymin, xmax, ymax = shapely.bounds(geom)
+        else:
+            all_verts = np.concatenate(geom_parts(geom)[0])
+            xmin, ymin = all_verts.min(axis=0)
+            xmax, ymax = all_verts.max(axis=0)
+        xmin, ymin, xmax, ymax = xmin - dist, ymin - dist, xmax + dist, ymax + dist
+
+        idx = self.grid.rows_in_bbox(xmin, ymin, xmax, ymax)
+        px, py = self.x[idx], self.y[idx]
+
+        # cheap bbox filter before exact distances
+        in_bbox = (px >= xmin) & (px <= xmax) & (py >= ymin) & (py <= ymax)
+        idx, px, py = idx[in_bbox], px[in_bbox], py[in_bbox]
+
+        in_dist, dists = points_within(px, py, geom, dist)
+
+        return idx[in_dist], dists
+
+    def strtree(self):
+        '''shapely STRtree of the points, made the first time it is used'''
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.shapes())
+
+        return self._tree
+
+    def query_within_many(self, geoms, dist):
+        '''query_within() for many geometries at once, with one STRtree query of prepared geometries (needs shapely).
+        Returns (index in geoms of each geometry-point pair, row index of each pair's point), sorted by geoms index.'''
+        geoms = np.array([to_shapely(geom) for geom in geoms], dtype=object)
+        shapely.prepare(geoms)
+        if dist == 0:
+            pairs = self.strtree().query(geoms, predicate='intersects')
+        else:
+            pairs = self.strtree().query(geoms, predicate='dwithin', distance=dist)
+        pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+
+        return pairs[0], pairs[1]
+
+
+class ShapeStore(ColumnStore):
+    '''Store made by write_shape_store()'''
+    def __init__(self, store_dir):
+        super(ShapeStore, self).__init__(store_dir)
+        self.wkb_data = self._load_array(col_wkb_data)
+        self.wkb_offsets = self._load_array(col_wkb_offsets)
+        self.bounds = self._load_array(col_bounds)
+
+    def wkbs(self, idx=None):
+        idx = np.arange(self.meta['row_count']) if idx is None else np.asarray(idx)
+        return [self.wkb_data[self.wkb_offsets[i]:self.wkb_offsets[i + 1]].tobytes() for i in idx]
+
+    def shapes(self, idx=None):
+        '''features as shapely geometries'''
+        import shapely
+        return shapely.from_wkb(self.wkbs(idx))
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        '''row indexes of features whose bounding box overlaps the given bounding box'''
+        bnds = self.bounds
+        return np.nonzero((bnds[:, 0] <= xmax) & (bnds[:, 2] >= xmin) & (bnds[:, 1] <= ymax) & (bnds[:, 3] >= ymin))[0]
+
+
+_open_stores = {} # stores already opened by this process, by folder
+
+
+def open_store(store_dir):
+    '''PointStore or ShapeStore, depending on what type of layer is in store_dir'''
+    if _open_stores.get(store_dir) is None:
+        if not store_is_current(store_dir):
+            raise ValueError("Layer store {} was made from an older version of its source layer. Re-export it " \
+                             "(see layer_store.py) before using it.".format(store_dir))
+        with open(os.path.join(store_dir, meta_file), 'r') as f:
+            store_type = json.load(f).get('store_type', store_type_point)
+        store_class = ShapeStore if store_type == store_type_shape else PointStore
+        _open_stores[store_dir] = store_class(store_dir)
+
+    return _open_stores[store_dir]
+
+
+if __name__ == '__main__':
+    arcpy.env.workspace = params.fgdb
+
+    # re-export stores whenever their source feature classes are updated
+    years = sorted(set([params.base_year] + params.analysis_years))
+    for year in years:
+        export_point_store(params.parcel_pt_fc_yr(year), params.parcel_pt_store_yr(year))
+
+    # layers read by geom_backend.ShapelyBackend, so that metrics can run without arcpy
+    point_fcs = [params.collisions_fc]
+    shape_fcs = [params.accdata_fc, params.fc_speed_data, params.freight_route_fc, params.reg_artcollcline_fc] \
+                + [params.parcel_poly_fc_yr(year) for year in years] + [params.model_links_fc(year) for year in years]
+
+    for fc in point_fcs:
+        export_point_store(fc, params.layer_store_path(fc))
+    for fc in shape_fcs:
+        export_shape_store(fc, params.layer_store_path(fc))
@@ -0,0 +1,133 @@
+# --------------------------------
+# Name: line_buffers.py
+# Purpose: Flat-ended buffers around NPMRDS TMCs and STAA truck routes, which are used to cut project lines into
+#           pieces for TMC and truck route conflation. The buffers only change when the line layers are rebuilt, so
+#           they are made once here instead of each time a project is run:
+#               - buffer feature class in fgdb (params.line_buff_fc()), with spatial index and an ORIG_FID field
+#                 linking each buffer to its line, for tools that use arcpy geoprocessing
+#               - layer_store copy of the buffers, in the same row order as the lines, for geom_backend, with each
+#                 line's length so that buffers made from an older version of the lines are caught
+#           Run this script whenever fc_speed_data or freight_route_fc are updated, after re-making their layer stores.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import layer_store
+import geom_backend
+import ppa_utils as utils
+
+col_orig_fid = 'ORIG_FID' # line OID, added by arcpy Buffer
+col_src_row = 'src_row' # row of line in its layer store
+col_src_len = 'src_len_ft' # length of line, in its layer store
+
+# line layers to buffer, and their buffer distances
+buffered_line_layers = {params.fc_speed_data: params.tmc_buff_dist_ft,
+                        params.freight_route_fc: params.line_overlap_buff_dist_ft}
+
+_buffer_sets = {}
+
+
+def build_buffer_fc(fc_lines, buff_dist_ft):
+    '''buffer feature class in params.fgdb, with all fields of fc_lines plus ORIG_FID'''
+    fc_buff = os.path.join(params.fgdb, params.line_buff_fc(fc_lines, buff_dist_ft))
+    utils.add_message("Buffering {} to {}...".format(fc_lines, fc_buff))
+    if arcpy.Exists(fc_buff): arcpy.Delete_management(fc_buff)
+
+    arcpy.Buffer_analysis(fc_lines, fc_buff, buff_dist_ft, "FULL", "FLAT")
+    arcpy.AddSpatialIndex_management(fc_buff)
+
+    return fc_buff
+
+
+def build_buffer_store(fc_lines, buff_dist_ft):
+    '''layer store of buffers, one per line, in the same order geom_backend reads fc_lines'''
+    backend = geom_backend.get_backend(geom_backend.name_shapely)
+    fs_lines = backend.read_features(fc_lines)
+    buffs = backend.buffer(fs_lines.geoms, buff_dist_ft, flat_end=True)
+
+    store_dir = params.layer_store_path(params.line_buff_fc(fc_lines, buff_dist_ft))
+    utils.add_message("Writing buffers of {} to {}...".format(fc_lines, store_dir))
+
+    field_data = {col_src_row: np.arange(len(buffs)), col_src_len: backend.lengths(fs_lines.geoms)}
+
+    return layer_store.write_shape_store(store_dir, list(shapely.to_wkb(buffs)), shapely.bounds(buffs), field_data,
+                                         source=fc_lines)
+
+
+def get_line_buffers(backend, fc_lines, buff_dist_ft, fields):
+    '''FeatureSet of the prebuilt buffers of every line in fc_lines, with fields from fc_lines. Rows are in the same
+    order as backend.read_features(fc_lines, fields), so a selection of lines can be used to subset the buffers.
+    Raises ValueError if the buffers were made from different lines than fc_lines has now.'''
+    cache_key = (backend.name, fc_lines, buff_dist_ft, tuple(fields))
+    if _buffer_sets.get(cache_key) is None:
+        fs_lines = backend.read_features(fc_lines, fields)
+        buff_name = params.line_buff_fc(fc_lines, buff_dist_ft)
+
+        if backend.name == geom_backend.name_shapely and layer_store.store_exists(params.layer_store_path(buff_name)):
+            # buffer store: each buffer's line length must match its line's
+            fs_buffs = backend.read_features(buff_name, [col_src_len])
+            buffs_match = len(fs_buffs) == len(fs_lines) \
+                          and np.allclose(fs_buffs.df[col_src_len].values, backend.lengths(fs_lines.geoms))
+        else:
+            # buffer feature class: each buffer's ORIG_FID must be its line's OID
+            fs_buffs = backend.read_features(os.path.join(params.fgdb, buff_name), [col_orig_fid])
+            line_oids = [row[0] for row in arcpy.da.SearchCursor(layer_path(fc_lines), 'OID@')]
+            buffs_match = fs_buffs.df[col_orig_fid].tolist() == line_oids
+
+        if not buffs_match:
+            raise ValueError("{} was made from a different version of {} than the current one. Re-run " \
+                             "line_buffers.py.".format(buff_name, fc_lines))
+
+        _buffer_sets[cache_key] = geom_backend.FeatureSet(fs_buffs.geoms, fs_lines.df)
+
+    return _buffer_sets[cache_key]
+
+
+def layer_path(fc_name):
+    '''fc_name, or its path in params.fgdb if it is only a name'''
+    return fc_name if os.path.dirname(fc_name) else os.path.join(params.fgdb, fc_name)
+
+
+def make_buffer_layer(fl_lines, fc_lines, buff_dist_ft, fl_buff):
+    '''feature layer, named fl_buff, of the prebuilt buffers of the lines selected in fl_lines'''
+    fc_buff = os.path.join(params.fgdb, params.line_buff_fc(fc_lines, buff_dist_ft))
+    if not arcpy.Exists(fc_buff):
+        raise ValueError("Buffer feature class {} not found. Run line_buffers.py to make it.".format(fc_buff))
+
+    line_oids = [row[0] for row in arcpy.da.SearchCursor(fl_lines, 'OID@')]
+    if line_oids:
+        sql = "{} IN ({})".format(col_orig_fid, ', '.join(str(oid) for oid in line_oids))
+    else:
+        sql = "{} IS NULL".format(col_orig_fid) # no lines selected, so no buffers
+
+    if arcpy.Exists(fl_buff): arcpy.Delete_management(fl_buff)
+    arcpy.MakeFeatureLayer_management(fc_buff, fl_buff, sql)
+
+    return fl_buff
+
+
+if __name__ == '__main__':
+    arcpy.env.workspace = params.fgdb
+    arcpy.env.overwriteOutput = True
+
+    for fc, buff_dist in buffered_line_layers.items():
+        build_buffer_fc(fc, buff_dist)
+        if shapely is not None:
+            build_buffer_store(fc, buff_dist)
@@ -0,0 +1,104 @@
+# --------------------------------
+# Name: link_midpoints.py
+# Purpose: Midpoint, length, and attributes of each model link (per model year) and road centerline, saved as a
+#           layer_store point store with a grid index. Metrics that select lines with HAVE_THEIR_CENTER_IN
+#           (model link VMT and vehicle occupancy, centerline miles) then do a point query on the midpoints
+#           instead of computing line centers for every link at run time.
+#           Run this script whenever the model link or centerline feature classes are updated.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import layer_store
+import geom_backend
+import ppa_utils as utils
+
+col_len_ft = 'len_ft'
+
+# model link fields used by collisions.py and link_occup_data.py
+model_link_fields = [params.col_capclass, params.col_distance, params.col_lanemi, params.col_dayvmt,
+                     params.col_tranvol, params.col_dayvehvol, params.col_sovvol, params.col_hov2vol,
+                     params.col_hov3vol, params.col_daycommvehvol]
+
+_midpt_stores = {}
+
+
+def build_midpoint_store(fc_lines, fields=[]):
+    '''midpoint store for fc_lines, with each line's length (col_len_ft) and fields'''
+    backend = geom_backend.get_backend(geom_backend.name_shapely)
+    fs_lines = backend.read_features(fc_lines, fields)
+    midpts = backend.centers(fs_lines.geoms) # same "center" as arcpy HAVE_THEIR_CENTER_IN
+
+    field_data = {f: fs_lines.df[f].values for f in fields}
+    field_data[col_len_ft] = backend.lengths(fs_lines.geoms)
+
+    store_dir = params.line_midpt_store(fc_lines)
+    utils.add_message("Writing midpoints of {} to {}...".format(fc_lines, store_dir))
+    xs = np.array([pt.x for pt in midpts])
+    ys = np.array([pt.y for pt in midpts])
+
+    return layer_store.write_point_store(store_dir, xs, ys, field_data, source=fc_lines)
+
+
+def has_midpoint_store(fc_lines):
+    return layer_store.store_exists(params.line_midpt_store(fc_lines))
+
+
+def open_midpoint_store(fc_lines):
+    '''midpoint store of fc_lines, opened once per process so its STRtree is only made once'''
+    store_dir = params.line_midpt_store(fc_lines)
+    if _midpt_stores.get(store_dir) is None:
+        _midpt_stores[store_dir] = layer_store.open_store(store_dir)
+
+    return _midpt_stores[store_dir]
+
+
+def center_in_links(fc_lines, geoms, fields, search_dist=0):
+    '''For each line (e.g. model link) whose center is within search_dist of one of geoms (or inside it, for polygons
+    with search_dist 0), returns (index in geoms of each geometry-line pair, df of fields for each pair's line).
+    fields can include col_len_ft. Uses the midpoint store of fc_lines if there is one, with one STRtree query for
+    all geoms if shapely is installed; otherwise lines are selected with geom_backend. Metrics run with arcpy tools
+    (ProjectContext.use_gp_tools) select lines with HAVE_THEIR_CENTER_IN instead of calling this.'''
+    if has_midpoint_store(fc_lines):
+        midpt_store = open_midpoint_store(fc_lines)
+        if shapely is not None:
+            geom_idx, rows = midpt_store.query_within_many(geoms, search_dist)
+            return geom_idx, midpt_store.to_df(fields, rows)
+
+        pair_geoms = [np.array([], dtype='int64')]
+        pair_rows = [np.array([], dtype='int64')]
+        for i, geom in enumerate(geoms):
+            rows = midpt_store.query_within(geom, search_dist)[0]
+            pair_geoms.append(np.full(rows.shape[0], i, dtype='int64'))
+            pair_rows.append(rows)
+
+        return np.concatenate(pair_geoms), midpt_store.to_df(fields, np.concatenate(pair_rows))
+
+    backend = geom_backend.get_backend()
+    data_fields = [f for f in fields if f != col_len_ft]
+    fs_lines = backend.read_features(fc_lines, data_fields)
+    geom_idx, line_idx = backend.select_by_location_many(fs_lines, geoms, geom_backend.rel_center_in, search_dist)
+
+    df_pairs = fs_lines.df.iloc[line_idx].reset_index(drop=True)
+    if col_len_ft in fields:
+        df_pairs[col_len_ft] = backend.lengths(fs_lines.geoms[line_idx])
+
+    return geom_idx, df_pairs[fields]
+
+
+if __name__ == '__main__':
+    years = sorted(set([params.base_year] + params.analysis_years))
+    for year in years:
+        build_midpoint_store(params.model_links_fc(year), model_link_fields)
+
+    build_midpoint_store(params.reg_artcollcline_fc)
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -18,11 +22,16 @@ g_ESRI_variable_2 = 'modlink_fl'
 # Copyright:   (c) SACOG
 # Python Version: 3.x
 # --------------------------------
+import numpy as np
 import pandas as pd
-import arcpy
 
 import ppa_input_params as params
 import ppa_utils as utils
+import link_midpoints
+from project_context import ProjectContext
+
+link_data_fields = [params.col_capclass, params.col_lanemi, params.col_tranvol, params.col_dayvehvol, params.col_sovvol,
+                    params.col_hov2vol, params.col_hov3vol, params.col_daycommvehvol]
 
 
 def link_vehocc(row):
@@ -36,14 +45,27 @@ def link_vehocc(row):
     return out_row
 
 
-def get_wtdavg_vehocc(in_df):
+def link_vehocc_array(in_df):
+    '''vehicle occupancy of every link in in_df at once (same calculation as link_vehocc())'''
+    vol_sov, vol_hov2, vol_hov3, vol_commveh = [np.asarray(in_df[col], dtype='float64') for col in
+                                                [params.col_sovvol, params.col_hov2vol, params.col_hov3vol,
+                                                 params.col_daycommvehvol]]
+    total_veh_vol = vol_sov + vol_hov2 + vol_hov3 + vol_commveh
 
-    col_wtdvol = 'col_wtdvol'
-    in_df = in_df.loc[in_df[params.col_dayvehvol] > 0]  # exclude links with daily volume of zero.
-    in_df[col_wtdvol] = in_df.apply(lambda x: link_vehocc(x), axis = 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out_vals = (vol_commveh + vol_sov + vol_hov2 * params.fac_hov2 + vol_hov3 * params.fac_hov3) / total_veh_vol
 
-    sumprod = in_df[params.col_lanemi].dot(in_df[col_wtdvol])
-    lanemi_tot = in_df[params.col_lanemi].sum()
+    return out_vals
+
+
+def get_wtdavg_vehocc(in_df):
+    '''lane-mile weighted average vehicle occupancy of links in in_df that have daily volume > 0'''
+    has_vol = np.asarray(in_df[params.col_dayvehvol], dtype='float64') > 0  # exclude links with daily volume of zero.
+    link_occ = link_vehocc_array(in_df)[has_vol]
+    link_lanemi = np.asarray(in_df[params.col_lanemi], dtype='float64')[has_vol]
+
+    sumprod = link_lanemi.dot(link_occ)
+    lanemi_tot = link_lanemi.sum()
     output_val = sumprod / lanemi_tot
 
     return output_val
@@ -58,21 +80,64 @@ def get_wtdavg_vehvol(in_df, col_vehtype):
     return output_vehvol
 
 
-def get_linkoccup_data(fc_project, project_type, fc_model_links):
-    arcpy.AddMessage("Getting modeled vehicle occupancy data...")
-    fl_project = g_ESRI_variable_1
+def get_linkoccup_data_multi(geoms, project_types, fc_model_links):
+    '''get_linkoccup_data() for many geometries (projects, community types, region, etc.) from a single load of
+    fc_model_links. geoms = project lines or polygons as geom_backend geometries; project_types = project type of
+    each geometry. Returns list with one output dict per geometry.'''
+    # model links with center within search distance of each geometry, as geometry index + link data for each pair
+    geom_idx, df_links = link_midpoints.center_in_links(fc_model_links, geoms, link_data_fields,
+                                                        params.modlink_searchdist)
+
+    # only keep links that are on same road type as project (e.g. fwy vs. arterial)
+    is_fwy = np.array([ptype == params.ptype_fwy for ptype in project_types], dtype=bool)
+    link_capclass = df_links[params.col_capclass].values
+    on_roadtype = np.where(is_fwy[geom_idx], np.isin(link_capclass, params.capclasses_fwy),
+                           np.isin(link_capclass, params.capclass_arterials))
+    geom_idx, df_links = geom_idx[on_roadtype], df_links.loc[on_roadtype]
+
+    # per-link values, then lane-mile weighted sums for each geometry
+    lanemi = np.asarray(df_links[params.col_lanemi], dtype='float64')
+    tranvol = np.asarray(df_links[params.col_tranvol], dtype='float64')
+    link_occ = link_vehocc_array(df_links)
+    has_vol = np.asarray(df_links[params.col_dayvehvol], dtype='float64') > 0
+    has_trn = ~np.isnan(tranvol)
+
+    n_geoms = len(geoms)
+    group_sum = lambda mask, vals: np.bincount(geom_idx[mask], weights=vals[mask], minlength=n_geoms)
+    link_cnt = np.bincount(geom_idx, minlength=n_geoms)
+    trnlink_cnt = np.bincount(geom_idx[has_trn], minlength=n_geoms)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_trantrips = group_sum(has_trn, lanemi * tranvol) / group_sum(has_trn, lanemi)
+        avg_vehocc = group_sum(has_vol, lanemi * link_occ) / group_sum(has_vol, lanemi)
+
+    # 0 if no links found
+    avg_trantrips = np.where(trnlink_cnt > 0, avg_trantrips, 0)
+    avg_vehocc = np.where(link_cnt > 0, avg_vehocc, 0)
+
+    return [{"avg_2way_trantrips": trn_val, "avg_2way_vehocc": occ_val}
+            for trn_val, occ_val in zip(avg_trantrips, avg_vehocc)]
+
+
+def get_linkoccup_data(fc_project, project_type, fc_model_links, proj_ctx=None):
+    utils.add_message("Getting modeled vehicle occupancy data...")
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, project_type)
+
+    if not proj_ctx.use_gp_tools:
+        return get_linkoccup_data_multi([proj_ctx.shape], [project_type], fc_model_links)[0]
+
+    fl_project = proj_ctx.fl_project
     fl_model_links = g_ESRI_variable_2
 
-    arcpy.MakeFeatureLayer_management(fc_project, fl_project)
+    if arcpy.Exists(fl_model_links): arcpy.Delete_management(fl_model_links)
     arcpy.MakeFeatureLayer_management(fc_model_links, fl_model_links)
 
     # get model links that are on specified link type with centroid within search distance of project
     arcpy.SelectLayerByLocation_management(fl_model_links, 'HAVE_THEIR_CENTER_IN', fl_project, params.modlink_searchdist)
 
     # load data into dataframe then subselect only ones that are on same road type as project (e.g. fwy vs. arterial)
-    df_cols = [params.col_capclass, params.col_lanemi, params.col_tranvol, params.col_dayvehvol, params.col_sovvol, params.col_hov2vol, params.col_hov3vol,
-               params.col_daycommvehvol]
-    df_linkdata = utils.esri_object_to_df(fl_model_links, df_cols)
+    df_linkdata = utils.esri_object_to_df(fl_model_links, link_data_fields)
 
     if project_type == params.ptype_fwy:
         df_linkdata = df_linkdata.loc[df_linkdata[params.col_capclass].isin(params.capclasses_fwy)]
@@ -0,0 +1,209 @@
+# --------------------------------
+# Name: map_render.py
+# Purpose: Make the map images for the PPA report (one per row of map_img_config.csv). Layouts don't depend on each
+#           other, so they are exported at the same time by a pool of worker processes, each with its own copy of
+#           the APRX so that workers don't lock each other's project file. The zoom extent around the project line
+#           is found once and passed to all workers instead of being re-read for every layout.
+#           If params.map_fast_render is True and matplotlib is installed, maps with no data layer (project line
+#           only) are drawn with matplotlib from the project geometry instead of exporting an ArcGIS layout.
+#           Output images have the same names and formats either way.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import shutil
+import tempfile
+import traceback
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import matplotlib
+    matplotlib.use('Agg') # no display needed
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+import ppa_input_params as params
+import metric_dag
+
+ext_ratio = 1.33 # map extent is this many times the size of the project line extent. > 1 zooms away from project line
+img_formats = ['png', 'jpg']
+no_data_layer = ['', 'none'] # DataLayer values of maps that only show the project line
+
+_worker_aprx = None # each worker process's own copy of the APRX, made by init_worker()
+_worker_aprx_dir = None # temporary folder of _worker_aprx, deleted by close_worker()
+
+
+def expand_extent(xmin, ymin, xmax, ymax, ratio=ext_ratio):
+    '''(xmin, ymin, xmax, ymax) of extent grown (ratio > 1) or shrunk (ratio < 1) evenly around its center, so that
+    the feature stays at the center of the map'''
+    dx = (ratio - 1.0) * (xmax - xmin) / 2.0
+    dy = (ratio - 1.0) * (ymax - ymin) / 2.0
+
+    return (xmin - dx, ymin - dy, xmax + dx, ymax + dy)
+
+
+def first_feature_extent(in_features, where_clause=None):
+    '''(xmin, ymin, xmax, ymax) of first feature in in_features matching where_clause, or None if no feature'''
+    with arcpy.da.SearchCursor(in_features, ["SHAPE@"], where_clause) as rows:
+        for row in rows:
+            ext = row[0].extent
+            return (ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+
+    return None
+
+
+def init_worker(aprx_path):
+    '''Runs once in each worker process: saves and opens the worker's own copy of the APRX in a temporary folder,
+    which is deleted when the worker exits'''
+    global _worker_aprx, _worker_aprx_dir
+    arcpy.env.overwriteOutput = True
+
+    _worker_aprx_dir = tempfile.mkdtemp(prefix='ppa_aprx')
+    aprx_copy = os.path.join(_worker_aprx_dir, "TEMP{}.aprx".format(os.getpid()))
+    arcpy.mp.ArcGISProject(aprx_path).saveACopy(aprx_copy)
+    _worker_aprx = arcpy.mp.ArcGISProject(aprx_copy)
+
+    # pool worker processes don't run atexit functions when they exit, but do run multiprocessing finalizers
+    if multiprocessing.parent_process() is not None:
+        multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def close_worker():
+    '''Close the worker's copy of the APRX and delete its temporary folder'''
+    global _worker_aprx, _worker_aprx_dir
+    _worker_aprx = None
+    if _worker_aprx_dir is not None:
+        shutil.rmtree(_worker_aprx_dir, ignore_errors=True)
+        _worker_aprx_dir = None
+
+
+def export_layout(map_config, proj_extents, out_folder, img_format):
+    '''Export the layout of map_config, a (map name, layout name, project line layer name, where clause, output image
+    name) tuple, zoomed to the project line. proj_extents is {where clause: extent} of the project line template
+    layer. Runs after init_worker(). Returns error message, or None if no errors.'''
+    map_name, layout_name, layer_name, where_clause, out_img = map_config
+    msg = None
+    try:
+        aprx = _worker_aprx
+        if layout_name not in [l.name for l in aprx.listLayouts()]:
+            return None # if specified layout isn't in APRX project file, skip map
+
+        lyt = aprx.listLayouts(layout_name)[0]
+        map_obj = aprx.listMaps(map_name)[0]
+
+        if layer_name != "":  # if there's a feat class for project line
+            try:
+                lyr = map_obj.listLayers(layer_name)[0] # layer object--based on layer name, not FC path
+                if os.path.basename(lyr.dataSource) == params.proj_line_template_fc:
+                    ext = proj_extents.get(where_clause)
+                else:
+                    ext = first_feature_extent(lyr, where_clause)
+
+                if ext is not None:  # zoom to project line feature
+                    ext_zoom = arcpy.Extent(*expand_extent(*ext))
+                    mf = lyt.listElements('MAPFRAME_ELEMENT')[0]
+                    mf.camera.setExtent(ext_zoom)
+                    mf.panToExtent(ext_zoom)
+            except:
+                msg = "{}, {}".format(arcpy.GetMessages(2), traceback.format_exc())
+
+        out_file = os.path.join(out_folder, out_img)
+        if os.path.exists(out_file):
+            try:
+                os.remove(out_file)
+            except:
+                pass
+
+        if img_format.lower() == 'png':
+            lyt.exportToPNG(out_file)
+        else:
+            lyt.exportToJPEG(out_file) # after zooming in, export the layout to a JPG
+    except:
+        msg = "{}, {}".format(arcpy.GetMessages(2), traceback.format_exc())
+
+    return msg
+
+
+def geom_line_coords(geom):
+    '''list of [(x, y), ...] coordinate lists of each part of a line geometry (arcpy, shapely, etc.)'''
+    geo_int = geom.__geo_interface__
+    if geo_int['type'] == 'LineString':
+        return [geo_int['coordinates']]
+    elif geo_int['type'] == 'MultiLineString':
+        return list(geo_int['coordinates'])
+
+    return []
+
+
+def render_projline_map(project_fc, proj_extent, out_file, img_format):
+    '''Draw the project line on a blank background with matplotlib, with the same zoom as the layout maps'''
+    fig, ax = plt.subplots(figsize=params.map_fast_render_size_in)
+    with arcpy.da.SearchCursor(project_fc, ["SHAPE@"]) as cur:
+        for row in cur:
+            for part in geom_line_coords(row[0]):
+                ax.plot([pt[0] for pt in part], [pt[1] for pt in part], color=params.map_fast_render_color,
+                        linewidth=3, solid_capstyle='round')
+
+    xmin, ymin, xmax, ymax = expand_extent(*proj_extent)
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+    ax.set_aspect('equal', adjustable='datalim')
+    ax.set_axis_off()
+
+    if os.path.exists(out_file): os.remove(out_file)
+    fig.savefig(out_file, dpi=params.map_fast_render_dpi, format=img_format, bbox_inches='tight')
+    plt.close(fig)
+
+
+def export_maps(map_configs, project_fc, out_folder, img_format, max_workers=None):
+    '''Make image of each map in map_configs, a list of (map name, layout name, project line layer name, where
+    clause, output image name, data layer name) tuples, into out_folder. The project line template layer must already
+    have the project's features. Layouts are exported by up to max_workers processes (default
+    params.map_export_max_workers). Returns list of error messages.'''
+    if img_format.lower() not in img_formats:
+        return ["Map images not created. Must be PNG or JPG."]
+
+    template_fc = os.path.join(params.fgdb, params.proj_line_template_fc)
+    proj_extents = {where: first_feature_extent(template_fc, where) for where in set(cfg[3] for cfg in map_configs)}
+
+    # project-line-only maps drawn with matplotlib, the rest exported from their ArcGIS layouts
+    fast_render = params.map_fast_render and plt is not None
+    layout_configs = []
+    for cfg in map_configs:
+        proj_extent = proj_extents[cfg[3]]
+        if fast_render and cfg[5].strip().lower() in no_data_layer and proj_extent is not None:
+            render_projline_map(project_fc, proj_extent, os.path.join(out_folder, cfg[4]), img_format)
+        else:
+            layout_configs.append(cfg[:5])
+
+    if not layout_configs:
+        return []
+
+    max_workers = max_workers if max_workers else params.map_export_max_workers
+    n_workers = min(max_workers if max_workers else os.cpu_count(), len(layout_configs))
+    if n_workers <= 1:
+        init_worker(params.aprx_path)
+        try:
+            err_msgs = [export_layout(cfg, proj_extents, out_folder, img_format) for cfg in layout_configs]
+        finally:
+            close_worker()
+    else:
+        arcpy.AddMessage("Exporting {} maps in parallel...".format(len(layout_configs)))
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=metric_dag.get_mp_context(),
+                                 initializer=init_worker, initargs=(params.aprx_path,)) as pool:
+            err_msgs = list(pool.map(export_layout, layout_configs, [proj_extents] * len(layout_configs),
+                                     [out_folder] * len(layout_configs), [img_format] * len(layout_configs)))
+
+    return [msg for msg in err_msgs if msg is not None]
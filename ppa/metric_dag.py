@@ -0,0 +1,193 @@
+# --------------------------------
+# Name: metric_dag.py
+# Purpose: Run a set of PPA metric functions as a dependency graph (DAG). Each metric is a MetricNode with the
+#           function to call, its arguments, and the names of other nodes whose results it needs. Nodes whose
+#           inputs are ready are run at the same time in a process pool, each with its own scratch workspace
+#           so that tools writing to arcpy.env.scratchGDB do not overwrite each other's outputs.
+#           The pool is made the first time it's needed and reused by every later run_dag() call in the process,
+#           so worker processes (and their arcpy imports and loaded data) are only started once.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+import ppa_input_params as params
+import ppa_utils as utils
+
+run_serial = 'serial'
+run_process = 'process'
+
+_pool = None # worker pool shared by all run_dag() calls (see get_pool())
+_pool_workers = None
+_pool_scratch = None # parent folder of the nodes' scratch workspaces, deleted with the pool
+
+
+class DepResult(object):
+    '''Placeholder, in a MetricNode's args or kwargs, for the result of another node'''
+    def __init__(self, node_name):
+        self.node_name = node_name
+
+
+class MetricNode(object):
+    '''One metric function call. func must be a module-level function so it can be sent to worker processes.
+    Any DepResult in args/kwargs is replaced by that node's result before func is called; those nodes, plus
+    any named in deps, run first.'''
+    def __init__(self, name, func, args=(), kwargs=None, deps=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs if kwargs is not None else {}
+
+        self.deps = list(deps) if deps is not None else []
+        for val in list(self.args) + list(self.kwargs.values()):
+            if isinstance(val, DepResult) and val.node_name not in self.deps:
+                self.deps.append(val.node_name)
+
+    def filled_args(self, results):
+        '''args and kwargs with DepResults replaced by results of other nodes'''
+        fill = lambda v: results[v.node_name] if isinstance(v, DepResult) else v
+        args = tuple(fill(v) for v in self.args)
+        kwargs = {k: fill(v) for k, v in self.kwargs.items()}
+
+        return args, kwargs
+
+
+def topo_order(nodes):
+    '''nodes sorted so each node comes after all nodes it depends on. Raises ValueError if a dependency is
+    missing or if dependencies are circular.'''
+    node_names = [n.name for n in nodes]
+    if len(set(node_names)) < len(node_names):
+        raise ValueError("Metric node names must be unique: {}".format(node_names))
+
+    for node in nodes:
+        missing = [d for d in node.deps if d not in node_names]
+        if missing:
+            raise ValueError("Metric node {} depends on nodes not in graph: {}".format(node.name, missing))
+
+    out_order = []
+    done = set()
+    remaining = list(nodes)
+    while remaining:
+        ready = [n for n in remaining if all(d in done for d in n.deps)]
+        if not ready:
+            raise ValueError("Circular dependencies among metric nodes {}".format([n.name for n in remaining]))
+        out_order += ready
+        done.update(n.name for n in ready)
+        remaining = [n for n in remaining if n.name not in done]
+
+    return out_order
+
+
+def run_node(func, args, kwargs, scratch_dir=None):
+    '''Runs in worker process. Gives the node its own scratch workspace (arcpy.env.scratchGDB and
+    scratchFolder are made within scratch_dir)'''
+    if scratch_dir is not None:
+        if not os.path.exists(scratch_dir):
+            os.makedirs(scratch_dir)
+        if arcpy is not None:
+            arcpy.env.scratchWorkspace = scratch_dir
+            arcpy.env.workspace = params.fgdb
+            arcpy.env.overwriteOutput = True
+
+    return func(*args, **kwargs)
+
+
+def get_mp_context():
+    '''Process start context for the pool. Inside ArcGIS Pro, sys.executable is the Pro application rather than
+    python, so the worker processes need to be pointed at the python executable.'''
+    mp_ctx = multiprocessing.get_context('spawn')
+    exe_name = os.path.basename(sys.executable).lower()
+    if not exe_name.startswith('python'):
+        python_exe = os.path.join(sys.exec_prefix, 'python.exe' if os.name == 'nt' else 'python')
+        if os.path.exists(python_exe):
+            mp_ctx.set_executable(python_exe)
+
+    return mp_ctx
+
+
+def get_pool(max_workers=None):
+    '''process pool shared by all run_dag() calls in this process. Only remade if max_workers changes or the
+    pool was shut down.'''
+    global _pool, _pool_workers, _pool_scratch
+    if _pool is None or max_workers != _pool_workers:
+        shutdown_pool()
+        scratch_parent = arcpy.env.scratchFolder if arcpy is not None else None
+        _pool_scratch = tempfile.mkdtemp(prefix='ppa_dag_', dir=scratch_parent)
+        _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_mp_context())
+        _pool_workers = max_workers
+
+    return _pool
+
+
+def shutdown_pool():
+    '''stop the shared pool's worker processes and delete their scratch workspaces'''
+    global _pool, _pool_workers, _pool_scratch
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+    if _pool_scratch is not None:
+        shutil.rmtree(_pool_scratch, ignore_errors=True)
+    _pool, _pool_workers, _pool_scratch = None, None, None
+
+
+atexit.register(shutdown_pool)
+
+
+def run_dag(nodes, run_mode=None, max_workers=None):
+    '''Run all nodes and return dict of {node name: result}. run_mode = 'serial' runs nodes one at a time in
+    this process; 'process' runs nodes in a pool of worker processes as soon as their inputs are ready.
+    Defaults are params.metric_run_mode and params.metric_max_workers.'''
+    run_mode = run_mode if run_mode else params.metric_run_mode
+    max_workers = max_workers if max_workers else params.metric_max_workers
+    ordered_nodes = topo_order(nodes)
+
+    results = {}
+    if run_mode == run_serial or len(nodes) <= 1:
+        for node in ordered_nodes:
+            args, kwargs = node.filled_args(results)
+            results[node.name] = node.func(*args, **kwargs)
+
+        return results
+
+    pool = get_pool(max_workers)
+    utils.add_message("Running {} metrics in parallel...".format(len(nodes)))
+
+    pending = [n for n in ordered_nodes]
+    running = {}
+    try:
+        while pending or running:
+            ready = [n for n in pending if all(d in results for d in n.deps)]
+            for node in ready:
+                args, kwargs = node.filled_args(results)
+                # node names are unique within a graph, and graphs are run one at a time, so a node's scratch
+                # workspace can be reused by the same node in later runs
+                node_scratch = os.path.join(_pool_scratch, node.name)
+                running[pool.submit(run_node, node.func, args, kwargs, node_scratch)] = node.name
+            pending = [n for n in pending if n not in ready]
+
+            done, not_done = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    except BrokenProcessPool:
+        shutdown_pool() # a worker died; next run_dag() call starts a new pool
+        raise
+    finally:
+        for future in running.keys():
+            future.cancel()
+
+    return results
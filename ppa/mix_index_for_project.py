@@ -2,7 +2,11 @@
 #
 
 # Esri start of added imports
-import sys, os, arcpy
+import sys
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -23,106 +27,94 @@ g_ESRI_variable_2 = 'fl_project'
 # Copyright:   (c) SACOG
 # Python Version: 3.x
 # --------------------------------
-import time
+import numpy as np
 import pandas as pd
-import arcpy
 
 import ppa_input_params as params
 import ppa_utils as utils
+from landuse_buff_calcs import LUSumSpec, point_sum_batch
+from project_context import ProjectContext
 
 # =============FUNCTIONS=============================================
 
 
-def make_summary_df(in_fl, input_cols,  landuse_cols, col_hh, park_calc_dict):
+lu_sum_cols = [params.col_hh, params.col_k12_enr, params.col_emptot, params.col_empfood, params.col_empret,
+               params.col_empsvc]
+lu_fac_cols = [params.col_k12_enr, params.col_emptot, params.col_empfood, params.col_empret, params.col_empsvc,
+               params.col_parkac]
 
-    # load into dataframe
-    parcel_df = utils.esri_object_to_df(in_fl, input_cols)
 
-    col_parkac = park_calc_dict['park_acres_field']
-    col_lutype = park_calc_dict['lutype_field']
-    lutype_parks = park_calc_dict['park_lutype']
-    col_area_ac = park_calc_dict['area_field']
+def mix_idx_lu_specs(buffdist=params.mix_index_buffdist):
+    '''parcel sums needed for the mix index, for landuse_buff_calcs.point_sum_batch(): sums of HH and job/enrollment
+    fields, and parcel acres by land use type (for park acres)'''
+    return [LUSumSpec(lu_sum_cols, buffdist),
+            LUSumSpec([params.col_area_ac], buffdist, params.col_lutype)]
 
-    # add col for park acres, set to total parcel acres where land use type is parks/open space land use type
-    parcel_df.loc[(parcel_df[col_lutype] == lutype_parks), col_parkac] = parcel_df[col_area_ac]
 
-    cols = landuse_cols + [col_hh]
-    out_df = pd.DataFrame(parcel_df[cols].sum(axis = 0)).T
+def mix_idx_from_sums(lu_sums, lutype_acres):
+    '''Get mix index from the two dicts returned by point_sum_batch() for mix_idx_lu_specs()'''
+    return mix_idx_from_sums_batch([lu_sums], [lutype_acres])[0]
 
-    return out_df
 
+def mix_idx_from_sums_batch(lu_sums_list, lutype_acres_list):
+    '''mix_idx_from_sums() for many buffers at once (e.g., every project in a batch run). Inputs are lists
+    with one lu_sums and one lutype_acres dict per buffer; returns list of {mix_idx_col: value} dicts'''
+    summ_df = pd.DataFrame(list(lu_sums_list), columns=lu_sum_cols)
+    summ_df[params.col_parkac] = [lutype_ac.get(params.lutype_parks, 0) for lutype_ac in lutype_acres_list]
 
-def get_wtd_idx(x, facs, params_df):
-    output = 0
-    
-    for fac in facs:
-        fac_ratio = '{}_ratio'.format(fac)
-        fac_out = x[fac_ratio] * params_df.loc[fac]['weight']
-        output += fac_out
-    
-    return output
-        
+    out_df = calc_mix_index(summ_df, params.params_df, params.col_hh, lu_fac_cols, params.mix_idx_col)
 
-def calc_mix_index(in_df, params_df, hh_col, lu_factor_cols, mix_idx_col):
-    lu_facs = params_df.index
-    
-    for fac in lu_facs:
-        
-        # add column for the "ideal", or "balanced" ratio of that land use to HHs
-        bal_col = "{}_bal".format(fac) 
-        in_df.loc[in_df[hh_col] != 0, bal_col] = in_df[hh_col] * params_df.loc[fac]['bal_ratio_per_hh']
-        
-        # if no HH, set bal_col = -1
-        in_df.fillna(-1)
-        
-        ratio_col = "{}_ratio".format(fac)
-        
-        # if balance value > actual value, return actual value / balance value
-        in_df.loc[(in_df[hh_col] != 0) & (in_df[bal_col] > in_df[fac]), ratio_col] = in_df[fac] / in_df[bal_col]
-    
-        # if balance value < actual value, return balance value / actual value
-        in_df.loc[(in_df[hh_col] != 0) & (in_df[bal_col] < in_df[fac]), ratio_col] = in_df[bal_col] / in_df[fac]
-        
-        # if no HH, set ratio col = -1
-        in_df.fillna(-1)
-        
-    in_df[mix_idx_col] = in_df.apply(lambda x: get_wtd_idx(x, lu_facs, params_df), axis = 1)
-    
-    return in_df
+    # if you want to make CSV.
+    #out_df[[col_hh, mix_idx_col]].to_csv(out_csv, index = False)
+    #print("Done! Output CSV: {}".format(out_csv))
 
+    return [{params.mix_idx_col: out_val} for out_val in out_df[params.mix_idx_col]]
 
-def get_mix_idx(fc_parcel, fc_project, project_type):
-    arcpy.AddMessage("Calculating mix index...")
 
-    sufx = int(time.perf_counter()) + 1
-    fl_parcel = os.path.join('memory','fl_parcel{}'.format(sufx))
-    fl_project = g_ESRI_variable_2
+def mix_index_array(hh_vals, fac_vals, bal_ratios, weights):
+    '''Mix index for many rows at once. hh_vals = (n,) array of households; fac_vals = (n, k) array of land use
+    factor values; bal_ratios, weights = (k,) arrays of balanced ratio per HH and weight for each factor.
+    NaN where HH = 0 or where a factor's value is exactly equal to its balanced value. Also used by
+    data_prep/mix_index/mix_index_for_parcel.py.'''
+    hh_vals = np.asarray(hh_vals, dtype='float64')
+    fac_vals = np.asarray(fac_vals, dtype='float64').reshape(hh_vals.shape[0], -1)
 
-    if arcpy.Exists(fl_parcel): arcpy.Delete_management(fl_parcel)
-    arcpy.MakeFeatureLayer_management(fc_parcel, fl_parcel)
-    
-    if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
-    arcpy.MakeFeatureLayer_management(fc_project, fl_project)
+    # one factor at a time, adding factors in params_df order so results match the original row-by-row version
+    out_idx = np.zeros(hh_vals.shape[0], dtype='float64')
+    for i, (bal_ratio, weight) in enumerate(zip(bal_ratios, weights)):
+        fac_i = fac_vals[:, i]
+        bal_i = hh_vals * bal_ratio
 
-    in_cols = [params.col_parcelid, params.col_hh, params.col_k12_enr, params.col_emptot, params.col_empfood,
-               params.col_empret, params.col_empsvc, params.col_area_ac, params.col_lutype]
+        # ratio is always <= 1: actual / balanced value if below balance, else balanced / actual value
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio_i = np.minimum(fac_i, bal_i) / np.maximum(fac_i, bal_i)
+        ratio_i[fac_i == bal_i] = np.nan
+        out_idx += ratio_i * weight
 
-    lu_fac_cols = [params.col_k12_enr, params.col_emptot, params.col_empfood, params.col_empret, params.col_empsvc, params.col_parkac]
-    # make parcel feature layer
+    out_idx[hh_vals == 0] = np.nan
 
-    buffer_dist = 0 if project_type == params.ptype_area_agg else params.mix_index_buffdist
-    arcpy.SelectLayerByLocation_management(fl_parcel, "WITHIN_A_DISTANCE", fl_project, buffer_dist, "NEW_SELECTION")
+    return out_idx
 
-    summ_df = make_summary_df(fl_parcel, in_cols, lu_fac_cols, params.col_hh, params.park_calc_dict)
 
-    out_df = calc_mix_index(summ_df, params.params_df, params.col_hh, lu_fac_cols, params.mix_idx_col)
+def calc_mix_index(in_df, params_df, hh_col, lu_factor_cols, mix_idx_col):
+    '''adds mix_idx_col to in_df, with mix index for each row'''
+    lu_facs = list(params_df.index)
+    in_df[mix_idx_col] = mix_index_array(in_df[hh_col].values, in_df[lu_facs].values,
+                                         params_df.loc[lu_facs, 'bal_ratio_per_hh'].values,
+                                         params_df.loc[lu_facs, 'weight'].values)
 
-    # if you want to make CSV.
-    #out_df[[col_hh, mix_idx_col]].to_csv(out_csv, index = False)
-    #print("Done! Output CSV: {}".format(out_csv))
+    return in_df
+
+
+def get_mix_idx(fc_parcel, fc_project, project_type, proj_ctx=None):
+    utils.add_message("Calculating mix index...")
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, project_type)
+
+    lu_sums, lutype_acres = point_sum_batch(fc_parcel, proj_ctx, mix_idx_lu_specs())
 
-    out_val = out_df[params.mix_idx_col][0]
-    return {params.mix_idx_col: out_val}
+    return mix_idx_from_sums(lu_sums, lutype_acres)
 
 # ===============================SCRIPT=================================================
 
@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # geometry work done with geom_backend instead
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -7,7 +11,7 @@ g_ESRI_variable_1 = 'fl_splitprojlines'
 g_ESRI_variable_2 = 'fl_splitproj_w_tmcdata'
 g_ESRI_variable_3 = "{} = '{}'"
 g_ESRI_variable_4 = '{} IS NOT NULL'
-g_ESRI_variable_5 = os.path.join(arcpy.env.packageWorkspace,'index')
+g_ESRI_variable_5 = os.path.join(arcpy.env.packageWorkspace,'index') if arcpy else 'index'
 g_ESRI_variable_6 = 'fl_project'
 g_ESRI_variable_7 = 'fl_speed_data'
 g_ESRI_variable_8 = '{} IN {}'
@@ -34,14 +38,21 @@ import re
 import datetime as dt
 import time
 
-import arcpy
 #from arcgis.features import SpatialDataFrame
+import numpy as np
 import pandas as pd
+try:
+    import shapely
+except ImportError: # linear referencing conflation needs shapely; otherwise split/join version is used
+    shapely = None
 
 import ppa_input_params as params
 import ppa_utils as utils
+import geom_backend
+import line_buffers
+from project_context import ProjectContext
 
-arcpy.env.overwriteOutput = True
+if arcpy: arcpy.env.overwriteOutput = True
 
 dateSuffix = str(dt.date.today().strftime('%m%d%Y'))
 
@@ -69,19 +80,76 @@ def get_wtd_speed(in_df, in_field, direction, fld_pc_len_ft):
     return {fielddir: proj_mph}
 
 
+def calc_dir_metrics(df_spddata, direcn, fld_shp_len, fields_calc_dict):
+    '''From table of project line pieces (length + TMC data), get length-weighted TMC data values for direction direcn'''
+    speed_data_fields = [k for k, v in fields_calc_dict.items()]
+    flds_df = [fld_shp_len] + speed_data_fields
+    out_dict = {}
+
+    # remove project pieces with no speed data so their distance isn't included in weighting
+    df_spddata = df_spddata.loc[pd.notnull(df_spddata[speed_data_fields[0]])].astype(float)
+    
+    # remove rows where there wasn't enough NPMRDS data to get a valid speed or reliability reading
+    df_spddata = df_spddata.loc[df_spddata[flds_df].min(axis=1) > 0]
+    
+    dir_len = df_spddata[fld_shp_len].sum() #sum of lengths of project segments that intersect TMCs in the specified direction
+    out_dict["{}_calc_len".format(direcn)] = dir_len #"calc" length because it may not be same as project length
+    
+    
+    # go through and do conflation calculation for each TMC-based data field based on correct method of aggregation
+    for field, calcmthd in fields_calc_dict.items():
+        if calcmthd == params.calc_inv_avg: # See PPA documentation on how to calculated "inverted speed average" method
+            sd_dict = get_wtd_speed(df_spddata, field, direcn, fld_shp_len)
+            out_dict.update(sd_dict)
+        elif calcmthd == params.calc_distwt_avg:
+            fielddir = "{}{}".format(direcn, field)  # add direction tag to field names
+            # if there's speed data, get weighted average value.
+            linklen_w_speed_data = df_spddata[fld_shp_len].sum()
+            if linklen_w_speed_data > 0: #wgtd avg = sum(piece's data * piece's len)/(sum of all piece lengths)
+                avg_data_val = (df_spddata[field]*df_spddata[fld_shp_len]).sum() \
+                                / df_spddata[fld_shp_len].sum()
+
+                out_dict[fielddir] = avg_data_val
+            else:
+                out_dict[fielddir] = df_spddata[field].mean() #if no length, just return mean speed? Maybe instead just return 'no data avaialble'? Or -1 to keep as int?
+                continue
+        else:
+            continue
+
+    return out_dict
+
+
+def projdata_by_group(dir_pieces, proj_len_ft, fld_shp_len, fields_calc_dict, calc_groups=None):
+    '''Conflation output table(s) from {direction: table of project pieces with TMC data}.
+    calc_groups = {group name: fields} for fields that are aggregated separately (e.g. speed and truck fields), since
+    pieces missing any one field in a group are left out of that group's lengths and averages. Returns one-row df,
+    or {group name: one-row df} if calc_groups is given.'''
+    groups = calc_groups if calc_groups is not None else {None: list(fields_calc_dict.keys())}
+
+    out_dfs = {}
+    for grp, grp_fields in groups.items():
+        grp_calc_dict = {f: fields_calc_dict[f] for f in grp_fields}
+        out_row_dict = {"proj_length_ft": proj_len_ft}
+        for direcn, df_spddata in dir_pieces.items():
+            df_grp = df_spddata[[fld_shp_len] + grp_fields].copy()
+            out_row_dict.update(calc_dir_metrics(df_grp, direcn, fld_shp_len, grp_calc_dict))
+        out_dfs[grp] = pd.DataFrame([out_row_dict])
+
+    return out_dfs if calc_groups is not None else out_dfs[None]
+
+
 def conflate_tmc2projline(fl_proj, dirxn_list, tmc_dir_field,
-                          fl_tmcs_buffd, fields_calc_dict):
+                          fl_tmcs_buffd, fields_calc_dict, calc_groups=None):
 
     speed_data_fields = [k for k, v in fields_calc_dict.items()]
-    out_row_dict = {}
+    dir_pieces = {}
     
     # get length of project
     fld_shp_len = "SHAPE@LENGTH"
-    fld_totprojlen = "proj_length_ft"
     
     with arcpy.da.SearchCursor(fl_proj, fld_shp_len) as cur:
         for row in cur:
-            out_row_dict[fld_totprojlen] = row[0]
+            proj_len_ft = row[0]
     
     for direcn in dirxn_list:
         # https://support.esri.com/en/technical-article/000012699
@@ -118,52 +186,162 @@ def conflate_tmc2projline(fl_proj, dirxn_list, tmc_dir_field,
         arcpy.SpatialJoin_analysis(temp_splitprojlines, fl_tmcs_buffd, temp_splitproj_w_tmcdata,
                                    "JOIN_ONE_TO_ONE", "KEEP_ALL", "#", "HAVE_THEIR_CENTER_IN", "30 Feet")
                                    
-        # convert to fl and select records where "check field" col val is not none
+        # convert to fl. Records with null TMC data are left out by calc_dir_metrics(), separately for each calc group
         arcpy.MakeFeatureLayer_management(temp_splitproj_w_tmcdata, fl_splitproj_w_tmcdata)
         
-        check_field = speed_data_fields[0]  # choose first speed value field for checking--if it's null, then don't include those rows in aggregation
-        sql_notnull = g_ESRI_variable_4.format(check_field)
-        arcpy.SelectLayerByAttribute_management(fl_splitproj_w_tmcdata, "NEW_SELECTION", sql_notnull)
-        
-        # convert the selected records into a numpy array then a pandas dataframe
+        # convert the records into a numpy array then a pandas dataframe
         flds_df = [fld_shp_len] + speed_data_fields 
-        df_spddata = utils.esri_object_to_df(fl_splitproj_w_tmcdata, flds_df)
-
-        # remove project pieces with no speed data so their distance isn't included in weighting
-        df_spddata = df_spddata.loc[pd.notnull(df_spddata[speed_data_fields[0]])].astype(float)
-        
-        # remove rows where there wasn't enough NPMRDS data to get a valid speed or reliability reading
-        df_spddata = df_spddata.loc[df_spddata[flds_df].min(axis=1) > 0]
-        
-        dir_len = df_spddata[fld_shp_len].sum() #sum of lengths of project segments that intersect TMCs in the specified direction
-        out_row_dict["{}_calc_len".format(direcn)] = dir_len #"calc" length because it may not be same as project length
-        
-        
-        # go through and do conflation calculation for each TMC-based data field based on correct method of aggregation
-        for field, calcmthd in fields_calc_dict.items():
-            if calcmthd == params.calc_inv_avg: # See PPA documentation on how to calculated "inverted speed average" method
-                sd_dict = get_wtd_speed(df_spddata, field, direcn, fld_shp_len)
-                out_row_dict.update(sd_dict)
-            elif calcmthd == params.calc_distwt_avg:
-                fielddir = "{}{}".format(direcn, field)  # add direction tag to field names
-                # if there's speed data, get weighted average value.
-                linklen_w_speed_data = df_spddata[fld_shp_len].sum()
-                if linklen_w_speed_data > 0: #wgtd avg = sum(piece's data * piece's len)/(sum of all piece lengths)
-                    avg_data_val = (df_spddata[field]*df_spddata[fld_shp_len]).sum() \
-                                    / df_spddata[fld_shp_len].sum()
-    
-                    out_row_dict[fielddir] = avg_data_val
-                else:
-                    out_row_dict[fielddir] = df_spddata[field].mean() #if no length, just return mean speed? Maybe instead just return 'no data avaialble'? Or -1 to keep as int?
-                    continue
-            else:
-                continue
+        dir_pieces[direcn] = utils.esri_object_to_df(fl_splitproj_w_tmcdata, flds_df)
 
     #cleanup
     fcs_to_delete = [temp_intersctpts, temp_intrsctpt_singlpt, temp_splitprojlines, temp_splitproj_w_tmcdata]
     for fc in fcs_to_delete:
         arcpy.Delete_management(fc)
-    return pd.DataFrame([out_row_dict])
+
+    return projdata_by_group(dir_pieces, proj_len_ft, fld_shp_len, fields_calc_dict, calc_groups)
+
+
+def get_tmc_buffers_backend(proj_ctx, str_project_type, tmc_data_fields):
+    '''Geometry backend version of selecting TMCs near the project and getting the flat-ended buffers around them.
+    Returns FeatureSet of TMC buffers with TMC direction and data fields.'''
+    backend = proj_ctx.backend
+    tmc_fields = [params.col_roadtype, params.col_tmcdir] + tmc_data_fields
+    fs_tmcs = backend.read_features(params.fc_speed_data, tmc_fields)
+    tmc_idx = backend.select_by_location(fs_tmcs, proj_ctx.shape, geom_backend.rel_within_dist,
+                                         params.tmc_select_srchdist)
+
+    roadtypes = fs_tmcs.df[params.col_roadtype].iloc[tmc_idx]
+    if str_project_type == 'Freeway':
+        tmc_idx = tmc_idx[roadtypes.isin(params.roadtypes_fwy).values]
+    else:
+        tmc_idx = tmc_idx[(pd.notnull(roadtypes) & ~roadtypes.isin(params.roadtypes_fwy)).values]
+
+    # buffers are prebuilt by line_buffers.py, in same row order as TMCs
+    fs_tmc_buffs = line_buffers.get_line_buffers(backend, params.fc_speed_data, params.tmc_buff_dist_ft, tmc_fields)
+
+    return fs_tmc_buffs.subset(tmc_idx)
+
+
+def buffer_measure_intervals(proj_part, buff_geoms):
+    '''Linear referencing of project line against TMC buffers: for each stretch of proj_part (single-part line) that
+    is inside a buffer, returns buffer index and start/end measure (distance along proj_part, in feet)'''
+    pieces = shapely.intersection(proj_part, np.asarray(buff_geoms))
+    piece_parts, buff_idx = shapely.get_parts(pieces, return_index=True)
+
+    # only keep line pieces (project can also just touch a buffer at a point)
+    is_line = (shapely.get_dimensions(piece_parts) == 1) & (shapely.length(piece_parts) > 0)
+    piece_parts, buff_idx = piece_parts[is_line], buff_idx[is_line]
+
+    meas_start = shapely.line_locate_point(proj_part, shapely.get_point(piece_parts, 0))
+    meas_end = shapely.line_locate_point(proj_part, shapely.get_point(piece_parts, -1))
+
+    return buff_idx, np.minimum(meas_start, meas_end), np.maximum(meas_start, meas_end)
+
+
+def measure_pieces(part_len, meas_lo, meas_hi):
+    '''start/end measures of the pieces a project line part is cut into at every buffer start/end measure'''
+    breaks = np.unique(np.concatenate([[0, part_len], meas_lo, meas_hi]))
+    keep = (breaks[1:] - breaks[:-1]) > 0
+
+    return breaks[:-1][keep], breaks[1:][keep]
+
+
+def conflate_tmc2projline_lr(proj_line, proj_len_ft, dirxn_list, tmc_dir_field, fs_tmcs_buffd, fields_calc_dict,
+                             calc_groups=None):
+    '''In-memory linear referencing version of conflate_tmc2projline(). Instead of splitting the project line into
+    new features and spatial joining them to TMC buffers, each buffer's overlap with the project is found once as
+    start/end measures along the project line. For each direction, the project is cut into pieces at that
+    direction's measures, and all pieces (all directions) get their TMC from one query of piece midpoints.
+    All fields in fields_calc_dict are then aggregated from the same pieces.'''
+    fld_shp_len = "SHAPE@LENGTH"
+    join_tol_ft = 30 # same search distance as spatial join in arcpy version
+    data_fields = [k for k, v in fields_calc_dict.items()]
+
+    # TMC buffers that intersect the project line
+    buff_geoms = np.asarray(fs_tmcs_buffd.geoms)
+    fs_tmcs_proj = fs_tmcs_buffd.subset(np.nonzero(shapely.intersects(proj_line, buff_geoms))[0])
+    buff_geoms = np.asarray(fs_tmcs_proj.geoms)
+    buff_dirs = fs_tmcs_proj.df[tmc_dir_field].values
+
+    # project pieces as measure ranges on each part, for each direction
+    proj_parts = shapely.get_parts(proj_line)
+    piece_parts, piece_dirs, piece_starts, piece_ends = [], [], [], []
+    for i, part in enumerate(proj_parts):
+        buff_idx, meas_lo, meas_hi = buffer_measure_intervals(part, buff_geoms)
+        for dir_i, direcn in enumerate(dirxn_list):
+            in_dir = buff_dirs[buff_idx] == direcn
+            starts, ends = measure_pieces(part.length, meas_lo[in_dir], meas_hi[in_dir])
+            piece_parts.append(np.full(starts.shape[0], i))
+            piece_dirs.append(np.full(starts.shape[0], dir_i))
+            piece_starts.append(starts)
+            piece_ends.append(ends)
+
+    piece_parts, piece_dirs = np.concatenate(piece_parts), np.concatenate(piece_dirs)
+    piece_starts, piece_ends = np.concatenate(piece_starts), np.concatenate(piece_ends)
+
+    # each piece gets the first same-direction TMC buffer within join_tol_ft of its midpoint (HAVE_THEIR_CENTER_IN)
+    mid_pts = shapely.line_interpolate_point(proj_parts[piece_parts], (piece_starts + piece_ends) / 2)
+    pairs = shapely.STRtree(buff_geoms).query(mid_pts, predicate='dwithin', distance=join_tol_ft)
+    dir_names = np.asarray(dirxn_list, dtype=object)
+    pairs = pairs[:, buff_dirs[pairs[1]] == dir_names[piece_dirs[pairs[0]]]]
+    join_idx = geom_backend._first_match(pairs, mid_pts.shape[0])
+
+    df_pieces = fs_tmcs_proj.df[data_fields].reindex(join_idx).reset_index(drop=True)
+    df_pieces.insert(0, fld_shp_len, piece_ends - piece_starts)
+    dir_pieces = {direcn: df_pieces.loc[piece_dirs == dir_i].reset_index(drop=True)
+                  for dir_i, direcn in enumerate(dirxn_list)}
+
+    return projdata_by_group(dir_pieces, proj_len_ft, fld_shp_len, fields_calc_dict, calc_groups)
+
+
+def lr_supported(proj_line):
+    '''True if every part of proj_line is simple and not closed, so each point on a part has only one measure and
+    conflate_tmc2projline_lr() can be used'''
+    proj_parts = shapely.get_parts(proj_line)
+
+    return bool(shapely.is_simple(proj_parts).all() and not shapely.is_closed(proj_parts).any())
+
+
+def conflate_tmc2projline_backend(proj_ctx, dirxn_list, tmc_dir_field, fs_tmcs_buffd, fields_calc_dict,
+                                  calc_groups=None):
+    '''Same as conflate_tmc2projline(), using the geometry backend instead of arcpy geoprocessing tools.
+    fs_tmcs_buffd = FeatureSet of TMC buffers, from get_tmc_buffers_backend(). Project lines that cross or loop back
+    on themselves use the split/join version, since measures along them are ambiguous.'''
+    backend = proj_ctx.backend
+    if backend.name == geom_backend.name_shapely and lr_supported(proj_ctx.shape):
+        return conflate_tmc2projline_lr(proj_ctx.shape, proj_ctx.len_ft, dirxn_list, tmc_dir_field, fs_tmcs_buffd,
+                                        fields_calc_dict, calc_groups)
+
+    return conflate_tmc2projline_split(backend, proj_ctx.shape, proj_ctx.len_ft, dirxn_list, tmc_dir_field,
+                                       fs_tmcs_buffd, fields_calc_dict, calc_groups)
+
+
+def conflate_tmc2projline_split(backend, proj_line, proj_len_ft, dirxn_list, tmc_dir_field, fs_tmcs_buffd,
+                                fields_calc_dict, calc_groups=None):
+    '''Split/join conflation with the geometry backend: same steps as the arcpy tools in conflate_tmc2projline()'''
+    speed_data_fields = [k for k, v in fields_calc_dict.items()]
+
+    fld_shp_len = "SHAPE@LENGTH"
+    dir_pieces = {}
+
+    # get TMCs whose buffers intersect the project line
+    tmc_idx = backend.select_by_location(fs_tmcs_buffd, proj_line, geom_backend.rel_intersect)
+    fs_tmcs_proj = fs_tmcs_buffd.subset(tmc_idx)
+
+    for direcn in dirxn_list:
+        fs_tmcs_dir = fs_tmcs_proj.subset(fs_tmcs_proj.df[tmc_dir_field] == direcn)
+
+        # split project line into pieces where it crosses TMC buffer boundaries, with same 10ft tolerance as arcpy version
+        split_pts = backend.boundary_crossings(proj_line, fs_tmcs_dir)
+        fs_proj_pieces = geom_backend.FeatureSet(backend.split_line_at_points(proj_line, split_pts, 10))
+
+        # get TMC data onto each piece whose center is in (or within 30ft of) a TMC buffer. Pieces without TMC get nulls.
+        join_idx = backend.spatial_join(fs_proj_pieces, fs_tmcs_dir, geom_backend.rel_center_in, 30)
+        df_spddata = fs_tmcs_dir.df[speed_data_fields].reindex(join_idx).reset_index(drop=True)
+        df_spddata.insert(0, fld_shp_len, backend.lengths(fs_proj_pieces.geoms))
+        dir_pieces[direcn] = df_spddata
+
+    return projdata_by_group(dir_pieces, proj_len_ft, fld_shp_len, fields_calc_dict, calc_groups)
     
     
 def simplify_outputs(in_df, proj_len_col):
@@ -213,12 +391,17 @@ def make_df(in_dict):
     return df_out
 
 
-def get_npmrds_data(fc_projline, str_project_type):
-    arcpy.AddMessage("Calculating congestion and reliability metrics...")
-    arcpy.OverwriteOutput = True
+def get_tmc_projdata(proj_ctx, str_project_type, fields_calc_dict, calc_groups=None):
+    '''Select TMCs near project and conflate their data onto the project line. Returns "full" table with data for
+    all directions (or {group name: table} if calc_groups is given; see projdata_by_group()). Fields from several
+    calc dicts (e.g. speed and truck data) can be done together so the conflation is only done once.'''
+    if not proj_ctx.use_gp_tools:
+        fs_tmc_buff = get_tmc_buffers_backend(proj_ctx, str_project_type, list(fields_calc_dict.keys()))
+        return conflate_tmc2projline_backend(proj_ctx, params.directions_tmc, params.col_tmcdir,
+                                             fs_tmc_buff, fields_calc_dict, calc_groups)
 
-    fl_projline = g_ESRI_variable_6
-    arcpy.MakeFeatureLayer_management(fc_projline, fl_projline)
+    arcpy.OverwriteOutput = True
+    fl_projline = proj_ctx.fl_project
 
     # make feature layer from speed data feature class
     fl_speed_data = g_ESRI_variable_7
@@ -233,24 +416,31 @@ def get_npmrds_data(fc_projline, str_project_type):
         sql = "{} NOT IN {}".format(params.col_roadtype, params.roadtypes_fwy)
         arcpy.SelectLayerByAttribute_management(fl_speed_data, "SUBSET_SELECTION", sql)
 
-    # create temporar buffer layer, flat-tipped, around TMCs; will be used to split project lines
-    temp_tmcbuff = os.path.join(arcpy.env.scratchGDB, "TEMP_linkbuff_4projsplit")
-    fl_tmc_buff = g_ESRI_variable_9
-    arcpy.Buffer_analysis(fl_speed_data, temp_tmcbuff, params.tmc_buff_dist_ft, "FULL", "FLAT")
-    arcpy.MakeFeatureLayer_management(temp_tmcbuff, fl_tmc_buff)
+    # layer of prebuilt flat-tipped buffers around selected TMCs; will be used to split project lines
+    fl_tmc_buff = line_buffers.make_buffer_layer(fl_speed_data, params.fc_speed_data, params.tmc_buff_dist_ft,
+                                                 g_ESRI_variable_9)
 
     # get "full" table with data for all directions
-    projdata_df = conflate_tmc2projline(fl_projline, params.directions_tmc, params.col_tmcdir,
-                                        fl_tmc_buff, params.spd_data_calc_dict)
-
-    # trim down table to only include outputs for directions that are "on the segment",
-    # i.e., that have most overlap with segment
-    out_dict = simplify_outputs(projdata_df, 'proj_length_ft')[0]
+    projdata = conflate_tmc2projline(fl_projline, params.directions_tmc, params.col_tmcdir,
+                                     fl_tmc_buff, fields_calc_dict, calc_groups)
 
     #cleanup
-    arcpy.Delete_management(temp_tmcbuff)
+    arcpy.Delete_management(fl_tmc_buff)
 
-    return out_dict
+    return projdata
+
+
+def get_npmrds_data(fc_projline, str_project_type, proj_ctx=None):
+    utils.add_message("Calculating congestion and reliability metrics...")
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_projline, str_project_type)
+
+    projdata_df = get_tmc_projdata(proj_ctx, str_project_type, params.spd_data_calc_dict)
+
+    # trim down table to only include outputs for directions that are "on the segment",
+    # i.e., that have most overlap with segment
+    return simplify_outputs(projdata_df, 'proj_length_ft')[0]
 
 
 # =====================RUN SCRIPT===========================
@@ -0,0 +1,113 @@
+# --------------------------------
+# Name: polygon_overlay.py
+# Purpose: Area of every land use type (parcel LUTYPE) within a project buffer or polygon, from a single overlay
+#           of the buffer with the parcel polygons. Only parcels that a spatial index says could touch the buffer
+#           are clipped:
+#               - shapely backend: parcel bounding boxes in the parcel polygon layer_store give the candidate
+#                 parcels, which are then clipped to the buffer in memory
+#               - arcpy: parcels are selected by location first, so Intersect only processes the selected parcels
+#           ProjectContext.lutype_areas() memoizes the result, so that ag acres, natural resource acres, etc. for
+#           the same parcel year share one overlay.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+import pandas as pd
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import layer_store
+import geom_backend
+
+col_area_ft2 = 'area_ft2'
+
+
+def area_by_lutype(lutypes, areas_ft2):
+    '''{LUTYPE: total area} of overlay pieces. Pieces on parcels with no LUTYPE are under key None, so that
+    sum(values) is always the total on-parcel area.'''
+    df_pieces = pd.DataFrame({params.col_lutype: pd.Series(lutypes, dtype=object),
+                              col_area_ft2: pd.Series(areas_ft2, dtype='float64')})
+    s_areas = df_pieces.groupby(params.col_lutype, dropna=False)[col_area_ft2].sum()
+
+    return {(None if pd.isna(lutype) else lutype): float(area) for lutype, area in s_areas.items()}
+
+
+def lutype_areas_store(buff, fc_poly_parcels):
+    '''overlay of shapely polygon buff with the parcel polygon layer_store of fc_poly_parcels'''
+    store = layer_store.open_store(params.layer_store_path(fc_poly_parcels))
+    cand_idx = store.query_bbox(*shapely.bounds(buff))
+
+    pcl_geoms = store.shapes(cand_idx)
+    shapely.prepare(buff)
+    in_buff = shapely.intersects(buff, pcl_geoms)
+    pieces = shapely.intersection(buff, pcl_geoms[in_buff])
+
+    return area_by_lutype(store.column(params.col_lutype, cand_idx[in_buff]), shapely.area(pieces))
+
+
+def lutype_areas_backend(backend, buff, fc_poly_parcels):
+    '''overlay of buff with fc_poly_parcels, using any geometry backend (e.g. parcels with no layer_store)'''
+    fs_parcels = backend.read_features(fc_poly_parcels, [params.col_lutype])
+    pcl_idx = backend.select_by_location(fs_parcels, buff, geom_backend.rel_intersect)
+
+    fs_intersect = backend.intersect(geom_backend.FeatureSet([buff]), fs_parcels.subset(pcl_idx))
+
+    return area_by_lutype(fs_intersect.df[params.col_lutype].values, backend.areas(fs_intersect.geoms))
+
+
+def lutype_areas_gp(fl_buff, fc_poly_parcels, sufx):
+    '''overlay of buffer feature layer fl_buff with fc_poly_parcels, using arcpy geoprocessing tools'''
+    fl_parcels = 'fl_pcl_overlay{}'.format(sufx)
+    fc_intersect = os.path.join(arcpy.env.scratchGDB, 'pcl_overlay{}'.format(sufx))
+
+    for item in [fl_parcels, fc_intersect]:
+        if arcpy.Exists(item): arcpy.Delete_management(item)
+
+    # only parcels touching the buffer go into the Intersect
+    arcpy.MakeFeatureLayer_management(fc_poly_parcels, fl_parcels)
+    arcpy.SelectLayerByLocation_management(fl_parcels, "INTERSECT", fl_buff)
+    arcpy.Intersect_analysis([fl_buff, fl_parcels], fc_intersect, "ALL", "", "INPUT")
+
+    lutypes = []
+    areas_ft2 = []
+    with arcpy.da.SearchCursor(fc_intersect, [params.col_lutype, "SHAPE@AREA"]) as cur:
+        for row in cur:
+            lutypes.append(row[0])
+            areas_ft2.append(row[1])
+
+    for item in [fl_parcels, fc_intersect]:
+        try:
+            arcpy.Delete_management(item)
+        except:
+            arcpy.AddWarning("Unable to delete {}".format(item))
+            continue
+
+    return area_by_lutype(lutypes, areas_ft2)
+
+
+def lutype_areas(proj_ctx, fc_poly_parcels, buffdist):
+    '''{LUTYPE: on-parcel area (ft2)} within buffdist of the project in proj_ctx (or within the polygon, for
+    polygon "projects"). Use ProjectContext.lutype_areas() instead of calling this directly, so results are reused.'''
+    if proj_ctx.use_gp_tools:
+        return lutype_areas_gp(proj_ctx.buffer_fl(buffdist), fc_poly_parcels, proj_ctx.sufx)
+
+    backend = proj_ctx.backend
+    buff = proj_ctx.buffer_shape(buffdist)
+    if backend.name == geom_backend.name_shapely \
+            and layer_store.store_exists(params.layer_store_path(fc_poly_parcels)):
+        return lutype_areas_store(buff, fc_poly_parcels)
+
+    return lutype_areas_backend(backend, buff, fc_poly_parcels)
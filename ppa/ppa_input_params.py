@@ -1,5 +1,9 @@
 # Esri start of added imports
-import sys, os, arcpy
+import sys, os
+try:
+    import arcpy
+except ImportError: # arcpy only needed for tools that use arcpy geoprocessing (see geom_backend)
+    arcpy = None
 # Esri end of added imports
 
 # Esri start of added variables
@@ -24,6 +28,15 @@ server_folder = g_ESRI_variable_1
 fgdb = os.path.join(server_folder, r"PPA2_GIS_SVR\owner_PPA.sde")  # os.path.join(server_folder, gdb_name)
 projexn_wkid_sacog = 2226 # NAD 1983 StatePlane California II FIPS 0402 (US Feet)
 
+# geometry backend for metrics that support it (see geom_backend.py). 'shapely' runs without arcpy, using layer_store
+# copies of input layers; 'arcpy' uses arcpy geoprocessing tools.
+geom_backend = 'shapely'
+
+# how project metrics are run (see metric_dag.py). 'process' runs independent metrics at the same time in a pool of
+# worker processes; 'serial' runs them one after another in the tool's own process.
+metric_run_mode = 'process'
+metric_max_workers = None # None = one worker per CPU
+
 # input feature classes
 region_fc = 'sacog_region'
 fc_speed_data = 'npmrds_metrics_v8' #npmrds speed data
@@ -43,6 +56,9 @@ proj_line_template_fc = 'Project_Line_Template' # has symbology that the project
 all_projects_fc = "All_PPA_Projects2020"
 
 # layers with multiple potential year values (e.g. base, various future years, etc)
+base_year = 2016 # year for metrics that only have a base year value
+analysis_years = [2016, 2040] # years for metrics with base and future year values. Each year is run in its own process (see metric_dag.py)
+
 def parcel_pt_fc_yr(in_year=2016):
     return "parcel_data_pts_{}".format(in_year)
 
@@ -55,10 +71,53 @@ def model_links_fc(in_year=2016):
     return "model_links_{}".format(in_year)
 
 
+# columnar copies of layers made by layer_store.py, for spatial queries without arcpy cursor scans.
+# If a layer has no store, or its store is older than its layer's data version, tools use the feature class in fgdb instead.
+layer_store_dir = os.path.join(server_folder, r"PPA2_GIS_SVR\layer_store")
+
+def layer_store_path(fc_name):
+    return os.path.join(layer_store_dir, os.path.basename(fc_name))
+
+
+def parcel_pt_store_yr(in_year=2016):
+    return layer_store_path(parcel_pt_fc_yr(in_year))
+
+
+def line_midpt_store(fc_lines):
+    '''store of line midpoints, lengths, and attributes (e.g. model links), made by link_midpoints.py'''
+    return layer_store_path("{}_midpts".format(os.path.basename(fc_lines)))
+
+
+# table in fgdb with the data version of each input layer, one row per layer. Update a layer's row whenever the layer
+# is updated; layer stores (see layer_store.py) and saved results (see result_cache.py) made from an older version are
+# then not used. For a file geodatabase without this table, the geodatabase's mod time is used as every layer's version.
+data_version_table = 'PPA_data_versions'
+col_dataver_layer = 'layer_name'
+col_dataver_version = 'data_version'
+
+
+# saved metric results (see result_cache.py), reused when the same project line is re-run with the same project type,
+# ADT, speed limit, input data, geometry backend, and buffer/search distances. Input layer versions come from
+# data_version_table (see result_cache.input_layer_versions()); input_data_version is only used for layers whose version
+# can't be read, and can also be changed to clear all saved results.
+use_result_cache = True
+result_cache_dir = os.path.join(server_folder, r"PPA2_GIS_SVR\result_cache")
+result_cache_max_mb = 500 # least recently used results are deleted when cache is bigger than this
+result_cache_xy_tol = 0.01 # feet; project vertices are rounded to this before hashing
+input_data_version = '2020-04'
+
+
 # input CSV of community type and regional values for indicated metrics; used to compare how project scores compared to 
 # "typical" values for the region and for the community type in which the project lies.
 aggvals_csv = os.path.join(server_folder, r"PPA2\Input_Template\CSV\Agg_ppa_vals04222020_1017.csv")
 
+# Replica trip data downloads are saved as columnar stores (see trip_table_store.py) the first time a trip shed tool
+# reads them, so that later runs on the same download don't re-read the CSVs. None = save next to the downloaded CSVs
+replica_trip_store_dir = None
+replica_stream_min_mb = 4000 # downloads bigger than this (all CSVs, MB) are aggregated in chunks instead of loaded whole
+replica_chunk_rows = 1000000 # trips read at a time when aggregating in chunks
+replica_stream_max_workers = None # CSVs aggregated at the same time when aggregating in chunks. None = one per CPU
+
 # project type
 ptype_fwy = 'Freeway'
 ptype_arterial = 'Arterial or Transit Expansion'
@@ -66,6 +125,15 @@ ptype_sgr = 'Complete Street or State of Good Repair'
 ptype_commdesign = "Community Design"
 ptype_area_agg = 'AreaAvg' # e.g., regional average, community type avg
 
+# batch runs of many projects (PPA2_batch_projects.py): fields in the input project layer
+batch_fld_projname = 'proj_name'
+batch_fld_juris = 'jurisdiction'
+batch_fld_ptype = 'proj_type' # must be one of the ptype_* values above
+batch_fld_adt = 'adt'
+batch_fld_speedlim = 'speed_lim'
+batch_fld_pci = 'pci'
+batch_max_workers = None # None = one worker per CPU
+
 
 # ===================================OUTPUT TEMPLATE DATA=========================================================
 # template_csv = r"Q:\ProjectLevelPerformanceAssessment\PPAv2\PPA2_0_code\PPA2\ExcelTemplate\output_rows_template.csv"
@@ -120,6 +188,11 @@ aprx_path = os.path.join(server_folder, r"PPA2_GIS_SVR\PPA2_GIS_SVR_v2.aprx")
 mapimg_configs_csv = os.path.join(server_folder, r"PPA2\Input_Template\CSV\map_img_config.csv") # configs for making maps imgs
 map_placement_csv = os.path.join(server_folder, r"PPA2\Input_Template\CSV\map_report_key.csv") # configs for inserting maps into Excel reports
 map_img_format = "png" #jpg, png, svg, etc.
+map_export_max_workers = 4 # processes exporting map layouts at the same time, each with its own copy of the APRX. 1 = one at a time
+map_fast_render = False # if True, maps with no data layer (project line only) are drawn with matplotlib, not ArcGIS
+map_fast_render_size_in = (8, 6) # width, height in inches of matplotlib-drawn maps
+map_fast_render_dpi = 96 # same as default layout export resolution
+map_fast_render_color = '#e31a1c' # project line color in matplotlib-drawn maps
 
 msg_ok = "C_OK" # message that returns if utils script executes correctly.
 msg_fail = "Run_Failed"
@@ -196,6 +269,14 @@ directions_tmc = ["NORTHBOUND", "SOUTHBOUND", "EASTBOUND", "WESTBOUND"]
 tmc_select_srchdist = 300 # units in feet. will select TMCs within this distance of project line for analysis.
 tmc_buff_dist_ft = 90  # buffer distance, in feet, around the TMCs
 
+# share of project on STAA truck routes (get_line_overlap.py)
+line_overlap_srchdist = 100 # feet. will select truck route lines within this distance of project line
+line_overlap_buff_dist_ft = 90 # buffer distance, in feet, around truck route lines
+
+# flat-ended buffers around TMCs and truck routes are made once by line_buffers.py, not each time a project is run.
+def line_buff_fc(fc_lines, buff_dist_ft):
+    return "{}_buff{}ft".format(os.path.basename(fc_lines), buff_dist_ft)
+
 # ===================================MODEL-BASED LAND USE  PARAMETERS==============================================
 
 # parameters for mix index
@@ -14,19 +14,33 @@ import os
 # import pdb
 import sys
 import datetime as dt
-import time
 import gc
 import csv
 import math
-import shutil
+import pickle
 
 # import xlwings as xw
 import openpyxl
 from openpyxl.drawing.image import Image
+from openpyxl.utils.indexed_list import IndexedList
 import pandas as pd
-import arcpy
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 
 import ppa_input_params as params
+import map_render
+
+_xl_templates = {} # {template path: (file mod time, sheet names, pickled workbook, IndexedList attribute names)}
+
+
+def add_message(msg):
+    '''show message in ArcGIS tool messages, or print it if running without arcpy'''
+    if arcpy is not None:
+        arcpy.AddMessage(msg)
+    else:
+        print(msg)
 
 
 def trace():
@@ -111,6 +125,20 @@ def join_xl_import_template(template_xlsx, template_sheet, in_df, joincolidx=0):
     
     return df_out
 
+def combine_year_dfs(df_base, year_dfs, col_prefix='projval'):
+    '''Combines single-year output df (metrics with only a base year value) with the dfs of each analysis year
+    (dict of {year: df}) into one table with metrics as rows and a <col_prefix>_<year> column for each year.
+    Earliest year's values are added under the single-year values; other years are left-joined as more columns.'''
+    years = sorted(year_dfs.keys())
+    base_col = '{}_{}'.format(col_prefix, years[0])
+
+    df_out = df_base.rename(columns={0: base_col})
+    df_out = pd.concat([df_out, year_dfs[years[0]].rename(columns={0: base_col})])
+    for year in years[1:]:
+        df_out = df_out.join(year_dfs[year].rename(columns={0: '{}_{}'.format(col_prefix, year)}))
+
+    return df_out
+
 def append_proj_to_master_fc(project_fc, proj_attributes_dict, master_fc):
     '''Takes project line and appends it to master line feature class with all lines users have entered'''
     arcpy.AddMessage("Archiving project line geometry...")
@@ -141,6 +169,48 @@ def append_proj_to_master_fc(project_fc, proj_attributes_dict, master_fc):
     return t_returns
 
 
+def _pickle_workbook(wb):
+    '''(pickled wb, names of its IndexedList attributes). IndexedLists (style tables, shared strings) lose their
+    items when unpickled, so they are pickled as plain lists and rebuilt by _unpickle_workbook()'''
+    idx_lists = {k: v for k, v in vars(wb).items() if isinstance(v, IndexedList)}
+    try:
+        for k, v in idx_lists.items():
+            setattr(wb, k, list(v))
+        wb_pickle = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for k, v in idx_lists.items():
+            setattr(wb, k, v)
+
+    return wb_pickle, list(idx_lists.keys())
+
+
+def _unpickle_workbook(wb_pickle, idx_list_attrs):
+    wb = pickle.loads(wb_pickle)
+    for k in idx_list_attrs:
+        setattr(wb, k, IndexedList(getattr(wb, k)))
+
+    return wb
+
+
+def get_template_workbook(xl_template, required_sheets=[]):
+    '''New in-memory copy of Excel template xl_template, as openpyxl workbook. Each template is only parsed the first
+    time it is used in a process (or after the file changes); later calls copy the already-parsed workbook, which
+    is much faster than re-reading templates with charts and images. Raises ValueError if the template doesn't
+    have all of required_sheets.'''
+    mod_time = os.path.getmtime(xl_template)
+    cached = _xl_templates.get(xl_template)
+    if cached is None or cached[0] != mod_time:
+        wb = openpyxl.load_workbook(xl_template)
+        cached = (mod_time, wb.sheetnames) + _pickle_workbook(wb)
+        _xl_templates[xl_template] = cached
+
+    missing_sheets = [s for s in required_sheets if s not in cached[1]]
+    if missing_sheets:
+        raise ValueError("Report template {} is missing sheets {}".format(xl_template, missing_sheets))
+
+    return _unpickle_workbook(*cached[2:])
+
+
 class Publish(object):
     def __init__(self, in_df, xl_template, import_tab, xl_out, project_fc, ptype, selecd_po_sheets=None, 
                  proj_name='UnnamedProject'):
@@ -165,28 +235,21 @@ class Publish(object):
         
         #xlsx related params
         self.xl_out_path = os.path.join(self.out_folder, self.xl_out)
-        shutil.copyfile(xl_template, self.xl_out_path)
-        self.xl_workbook = openpyxl.load_workbook(self.xl_out_path) #work off of a copy of the template, so template remains free. Important for multi-user reliability.
+        self.xl_workbook = get_template_workbook(xl_template, [import_tab] + self.sheets_all_rpts) # in-memory copy of the template, so template remains free. Important for multi-user reliability.
 
 
     def overwrite_df_to_xlsx(self, unused=0, start_row=0, start_col=0):  # why does there need to be an argument?
-        '''Writes pandas dataframe <in_df_ to <tab_name> sheet of <xlsx_template> excel workbook.'''
+        '''Writes pandas dataframe <in_df_ to <tab_name> sheet of <xlsx_template> excel workbook, as one block of
+        cells starting below/right of start_row/start_col.'''
         in_df = self.in_df.reset_index()
-        df_records = in_df.to_records(index=False)
-        
-        # get header row for output
-        out_header_list = [list(in_df.columns)]  # get header row for output
-        
-        out_data_list = [list(i) for i in df_records]  # get output data rows
-    
-        comb_out_list = out_header_list + out_data_list
-    
+        comb_out_list = [list(in_df.columns)] + in_df.values.tolist() # header row, then data rows
+
         ws = self.xl_workbook[self.import_tab]
-        for i, row in enumerate(comb_out_list):
-            for j, val in enumerate(row):
-                cell = ws.cell(row=(start_row + (i + 1)), column=(start_col + (j + 1)))
-                if (cell):
-                    cell.value = val
+        out_range = ws.iter_rows(min_row=start_row + 1, max_row=start_row + len(comb_out_list),
+                                 min_col=start_col + 1, max_col=start_col + in_df.shape[1])
+        for ws_row, out_row in zip(out_range, comb_out_list):
+            for cell, val in zip(ws_row, out_row):
+                cell.value = val
                     
     def build_configs(self):
         in_csv = self.mapimg_configs_csv
@@ -194,6 +257,7 @@ class Publish(object):
         p_layout = "MapLayout" # layout that will be made into image
         p_where = "SQL" # background data layer (e.g. collision heat layer)
         p_projline = "ProjLineLayer"
+        p_datalayer = "DataLayer" # data shown with project line. Blank or None if map only shows project line
         
         out_config_list = []
         
@@ -204,8 +268,9 @@ class Publish(object):
                 v_layout = row[p_layout]
                 v_projline = row[p_projline]
                 v_where = row[p_where]
+                v_datalayer = row.get(p_datalayer) or ""
                 
-                out_config_row = [v_map, v_layout, v_projline, v_where]
+                out_config_row = [v_map, v_layout, v_projline, v_where, v_datalayer]
                 out_config_list.append(out_config_row)
         
         return out_config_list
@@ -225,6 +290,10 @@ class Publish(object):
                 self.Where = l_print_config[3]    #..where to get features in the layer.
             else:
                 self.Where = ""
+            if(n_elements>4):
+                self.DataLayer = l_print_config[4]    #..data layer shown with project line, if any
+            else:
+                self.DataLayer = ""
     
             self.OutputImageName = "{}.{}".format(self.MapFrame, imgtyp)
             
@@ -234,38 +303,19 @@ class Publish(object):
         ratio = how you want to change extent. Ratio > 1 zooms away from project line; <1 zooms in to project line
         '''
         try:
-            # spref = ext.spatialReference
-            xmin = ext.XMin
-            xmax = ext.XMax
-            ymin = ext.YMin
-            ymax = ext.YMax 
-            width = ext.width
-            height = ext.height
-            dx = (ratio-1.0)*width/2.0 # divided by two so that diff is split evenly between opposite sides, so featur is still center of the extent
-            dy = (ratio-1.0)*height/2.0
-            xxmin = xmin - dx 
-            xxmax = xmax + dx
-            yymin = ymin - dy 
-            yymax = ymax + dy
-            new_ext = arcpy.Extent(xxmin, yymin, xxmax, yymax)
+            new_ext = arcpy.Extent(*map_render.expand_extent(ext.XMin, ext.YMin, ext.XMax, ext.YMax, ratio))
         except:
             new_ext = None 
         return new_ext 
     
     # generates image files from maps
     def exportMap(self):
+        '''Makes image of each map in map_img_config.csv in the scratch folder. Layouts are exported at the same time
+        by worker processes, each with its own copy of the APRX (see map_render.py).'''
         arcpy.AddMessage('Generating maps for report...')
         arcpy.env.overwriteOutput = True
         try:
-            # create temporary copy of APRX to not have conflicts if 2+ runs done at same time.
-            aprx_temp_path = os.path.join(self.out_folder, "TEMP{}.aprx".format(int(time.perf_counter()) + 1)) 
-            aprx_template_obj = arcpy.mp.ArcGISProject(self.aprx_path)
-            aprx_template_obj.saveACopy(aprx_temp_path)
-            
-            #then manipulate the temporary copy of the APRX
-            aprx = arcpy.mp.ArcGISProject(aprx_temp_path)
-            
-            l_print_configs = self.build_configs() # each config list for each image is [map frame name, layout frame name, project line layer name, project feature where clause]
+            l_print_configs = self.build_configs() # each config list for each image is [map frame name, layout frame name, project line layer name, project feature where clause, data layer]
             
             o_print_configs = []
             
@@ -278,69 +328,21 @@ class Publish(object):
             arcpy.DeleteFeatures_management(self.proj_line_template_fc) # delete whatever features were in the display layer
             arcpy.Append_management([self.project_fc], self.proj_line_template_fc, "NO_TEST") # then replace those features with those from user-drawn line
 
-            for print_config in o_print_configs:
-                #only thing needed for this loop is to activate each layout and pan to the desired extent and make image of it.
-                layouts_aprx = [l.name for l in aprx.listLayouts()] # makes sure there's a corresponding layout in the APRX file to the layout in the CSV
-                if print_config.Layout in layouts_aprx:
-                    try:
-                        lyt = aprx.listLayouts(print_config.Layout)[0]
-                        map = aprx.listMaps(print_config.MapFrame)[0]
-                        
-                        if print_config.Layer != "":  # if there's a feat class for project line
-                            
-                            try:
-                                lyr = map.listLayers(print_config.Layer)[0] # return layer object--based on layer name, not FC path
-                                fl = "fl{}".format(int(time.perf_counter()))
-                                if arcpy.Exists(fl):
-                                    try:
-                                        arcpy.Delete_management(fl)
-                                    except:
-                                        pass 
-                                arcpy.MakeFeatureLayer_management(lyr, fl, where_clause=print_config.Where)  # make feature layer of project line
-                                ext = ""
-                                with arcpy.da.SearchCursor(fl, ["Shape@"]) as rows:
-                                    for row in rows:
-                                        geom = row[0]
-                                        ext = geom.extent
-                                        
-                                        ext_ratio = 1.33
-                                        ext_zoom = self.expandExtent2D(ext, ext_ratio)
-                                        break
-                                if ext_zoom != "":  # zoom to project line feature
-                                    mf = lyt.listElements('MAPFRAME_ELEMENT')[0]
-                                    mf.camera.setExtent(ext_zoom)
-                                    mf.panToExtent(ext_zoom)
-
-                            except:
-                                msg = "{}, {}".format(arcpy.GetMessages(2), trace())
-                                arcpy.AddMessage(msg)
-                                
-                        out_file = os.path.join(self.out_folder, print_config.OutputImageName)
-                        
-                        
-                        if(os.path.exists(out_file)):
-                            try:
-                                os.remove(out_file)
-                            except:
-                                pass 
-                        if self.img_format.lower() == 'png':
-                            lyt.exportToPNG(out_file)
-                        elif self.img_format.lower() == 'jpg':
-                            lyt.exportToJPEG(out_file) # after zooming in, export the layout to a JPG
-                        else:
-                            arcpy.AddWarning("Map image {} not created. Must be PNG or JPG.".format(out_file))
-                    except:
-                        msg = "{}, {}".format(arcpy.GetMessages(2), trace())
-                        arcpy.AddMessage(msg)
-                        print(msg)
-                else:
-                    continue # if specified layout isn't in APRX project file, skip to next map
+            map_configs = [(pc.MapFrame, pc.Layout, pc.Layer, pc.Where, pc.OutputImageName, pc.DataLayer)
+                           for pc in o_print_configs]
+            err_msgs = map_render.export_maps(map_configs, self.project_fc, self.out_folder, self.img_format)
+            for msg in err_msgs:
+                arcpy.AddMessage(msg)
+                print(msg)
+
             t_returns = (params.msg_ok,)
         except:
             msg = "{}, {}".format(arcpy.GetMessages(2), trace())
             print(msg)
             arcpy.AddWarning(msg)
             t_returns = (msg,)
+
+        return t_returns
     
     def insert_image_xlsx(self, wb, sheet_name, rownum, col_letter, img_file):
         '''inserts image into specified sheet and cell within Excel workbook'''
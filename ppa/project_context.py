@@ -0,0 +1,282 @@
+# --------------------------------
+# Name: project_context.py
+# Purpose: Per-run container for the project geometry. Holds the dissolved project line, its length, a
+#           single feature layer of the project, and a buffer for each buffer distance, made the first time
+#           a metric asks for it and reused by every metric after that.
+#           The project can also be given as a geometry object instead of a feature class, for running
+#           metrics with the shapely geometry backend on machines without arcpy.
+#           Also memoizes land use type areas from parcel polygon overlays (see polygon_overlay.py).
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import itertools
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+import ppa_input_params as params
+import geom_backend
+import polygon_overlay
+
+_ctx_ids = itertools.count(1) # numbers contexts made by this process, for unique scratch names (see sufx)
+
+
+class ProjectContext(object):
+    '''Build once per run (per project line, or per community type/region polygon), then pass to each
+    metric function through its proj_ctx argument so that the project layer and buffers are not remade
+    in every module.'''
+    def __init__(self, fc_project, project_type, scratch_ws=None):
+
+        # user inputs
+        self.fc_project_in = fc_project
+        self.project_type = project_type
+
+        # tag for naming scratch feature classes and layers, so 2+ contexts (in this or any worker process) don't
+        # overwrite each other
+        self.sufx = '{}_{}'.format(os.getpid(), next(_ctx_ids))
+
+        self.backend = geom_backend.get_backend()
+        self._shape = None
+        self._geometry = None
+        self._geometry_json = None # geometry sent to worker processes, as Esri JSON (see __getstate__)
+        self._fl_project = None
+        self._is_copy = False # True in worker processes, which must not delete the original's dissolved project
+
+        # buffers are only made when a metric needs them, then memoized by buffer distance
+        self._buff_fcs = {}
+        self._buff_fls = {}
+        self._buff_acres = {}
+        self._buff_geoms = {}
+        self._buff_shapes = {}
+
+        # land use type areas from parcel polygon overlays, memoized by parcel layer and buffer distance
+        self._lu_areas = {}
+
+        # project given as geometry object (arcpy, shapely, etc.) instead of feature class: no feature class or
+        # feature layer is made, so only metrics that support geom_backend can be run with this context.
+        self.geom_only = hasattr(fc_project, '__geo_interface__')
+        if self.geom_only:
+            self.scratch_ws = scratch_ws
+            self.fc_project = None
+            self._geometry = fc_project
+            self.len_ft = float(self.backend.lengths([self.shape])[0])
+            self.len_mi = self.len_ft / params.ft2mile
+            return
+
+        self.scratch_ws = scratch_ws if scratch_ws else arcpy.env.scratchGDB
+
+        # derived/calculated objects
+        self.fc_project = self.dissolve_project()
+        self.len_ft = self.get_length()
+        self.len_mi = self.len_ft / params.ft2mile
+
+    def __getstate__(self):
+        '''For sending the context to worker processes (see metric_dag). Feature layers and the geometry backend
+        only exist in the process that made them, so they are dropped here; the worker makes its own project layer
+        only if a metric uses it. arcpy geometries are sent as Esri JSON, so the worker doesn't re-read fc_project.
+        Buffer feature classes already made are kept and reused; new ones go to the worker's own scratch workspace.
+        shapely geometries can be pickled, so shapely backend buffers are also kept.'''
+        state = self.__dict__.copy()
+        state['backend'] = None
+        state['_is_copy'] = True
+        if self.backend.name != geom_backend.name_shapely:
+            state['_shape'] = None
+            state['_buff_shapes'] = {}
+        state['_buff_fls'] = {}
+        if not self.geom_only:
+            state['scratch_ws'] = None
+            state['_geometry_json'] = self.geometry.JSON
+            state['_geometry'] = None
+            state['_buff_geoms'] = {}
+            state['_fl_project'] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.backend = geom_backend.get_backend()
+
+    @property
+    def geometry(self):
+        '''single geometry object for the whole project'''
+        if self._geometry is None:
+            if self._geometry_json is not None:
+                self._geometry = arcpy.AsShape(self._geometry_json, True)
+            else:
+                self._geometry = self.get_geometry()
+
+        return self._geometry
+
+    @property
+    def fl_project(self):
+        '''feature layer of fc_project, made the first time a metric uses it in this process'''
+        if self._fl_project is None and not self.geom_only:
+            self._fl_project = self.make_project_layer()
+
+        return self._fl_project
+
+    def make_project_layer(self):
+        fl_project = 'fl_projctx{}'.format(self.sufx)
+        if arcpy.Exists(fl_project): arcpy.Delete_management(fl_project)
+        arcpy.MakeFeatureLayer_management(self.fc_project, fl_project)
+
+        return fl_project
+
+    def dissolve_project(self):
+        '''if project is multiple non-contiguous lines, combine them to be analyzed as one'''
+        proj_fcnt = int(arcpy.GetCount_management(self.fc_project_in)[0])
+        if proj_fcnt > 1:
+            proj_fc_out = os.path.join(self.scratch_ws, "project_dissolved{}".format(self.sufx))
+            if arcpy.Exists(proj_fc_out): arcpy.Delete_management(proj_fc_out)
+            arcpy.Dissolve_management(self.fc_project_in, proj_fc_out)
+        else:
+            proj_fc_out = self.fc_project_in
+
+        return proj_fc_out
+
+    def get_geometry(self):
+        '''union of all of fc_project's features'''
+        out_geom = None
+        with arcpy.da.SearchCursor(self.fc_project, "SHAPE@") as cur:
+            for row in cur:
+                out_geom = row[0] if out_geom is None else out_geom.union(row[0])
+
+        return out_geom
+
+    def get_length(self):
+        tot_len = 0
+        with arcpy.da.SearchCursor(self.fc_project, "SHAPE@LENGTH") as cur:
+            for row in cur:
+                tot_len += row[0]
+
+        return tot_len
+
+    @property
+    def use_gp_tools(self):
+        '''True if metrics should use arcpy geoprocessing tools, False if they should use the geometry backend'''
+        return self.backend.name == geom_backend.name_arcpy and not self.geom_only
+
+    @property
+    def shape(self):
+        '''project geometry as the geometry type of the geometry backend (e.g., shapely geometry)'''
+        if self._shape is None:
+            self._shape = self.backend.to_native(self.geometry)
+
+        return self._shape
+
+    def buffer_shape(self, buffdist, flat_end=False):
+        '''Backend geometry of the area within <buffdist> feet of the project'''
+        if self.project_type == params.ptype_area_agg or buffdist == 0:
+            return self.shape
+
+        buff_key = (buffdist, flat_end)
+        if self._buff_shapes.get(buff_key) is None:
+            self._buff_shapes[buff_key] = self.backend.buffer(self.shape, buffdist, flat_end)
+
+        return self._buff_shapes[buff_key]
+
+    def buffer_fc(self, buffdist):
+        '''Feature class of the area within <buffdist> feet of the project. If the "project" is a polygon
+        (e.g. community type, region, trip shed), then the analysis area is the polygon itself and no buffer is made.'''
+        if self.project_type == params.ptype_area_agg or buffdist == 0:
+            return self.fc_project
+
+        if self._buff_fcs.get(buffdist) is None:
+            # scratch_ws is None in worker processes, which each have their own scratchGDB
+            scratch_ws = self.scratch_ws if self.scratch_ws else arcpy.env.scratchGDB
+            fc_buff = os.path.join(scratch_ws, "ctx_buff{}_{}".format(int(buffdist), self.sufx))
+            if arcpy.Exists(fc_buff): arcpy.Delete_management(fc_buff)
+            arcpy.Buffer_analysis(self.fl_project, fc_buff, buffdist)
+            self._buff_fcs[buffdist] = fc_buff
+
+        return self._buff_fcs[buffdist]
+
+    def buffer_fl(self, buffdist):
+        '''Feature layer of buffer_fc(buffdist)'''
+        if self._buff_fls.get(buffdist) is None:
+            fl_buff = 'fl_ctxbuff{}_{}'.format(int(buffdist), self.sufx)
+            if arcpy.Exists(fl_buff): arcpy.Delete_management(fl_buff)
+            arcpy.MakeFeatureLayer_management(self.buffer_fc(buffdist), fl_buff)
+            self._buff_fls[buffdist] = fl_buff
+
+        return self._buff_fls[buffdist]
+
+    def buffer_acres(self, buffdist):
+        '''Total area, in acres, of buffer_fc(buffdist)'''
+        if self._buff_acres.get(buffdist) is None:
+            buff_area_ft2 = 0
+            if self.geom_only:
+                buff_area_ft2 = float(self.backend.areas([self.buffer_shape(buffdist)])[0])
+            else:
+                with arcpy.da.SearchCursor(self.buffer_fc(buffdist), ["SHAPE@AREA"]) as cur:
+                    for row in cur:
+                        buff_area_ft2 += row[0]
+            self._buff_acres[buffdist] = buff_area_ft2 / params.ft2acre
+
+        return self._buff_acres[buffdist]
+
+    def buffer_geom(self, buffdist):
+        '''Geometry object of the area within <buffdist> feet of the project'''
+        if self.project_type == params.ptype_area_agg or buffdist == 0:
+            return self.geometry
+
+        if self._buff_geoms.get(buffdist) is None:
+            self._buff_geoms[buffdist] = self.geometry.buffer(buffdist)
+
+        return self._buff_geoms[buffdist]
+
+    def build_buffers(self, buffdists):
+        '''Make the buffers (and their areas) for buffdists now, in this process. Call before sending the context
+        to metric_dag worker processes, so that each worker reuses them instead of making its own.'''
+        for buffdist in buffdists:
+            if self.use_gp_tools:
+                self.buffer_acres(buffdist)
+            else:
+                self.buffer_shape(buffdist)
+
+    def lutype_areas(self, fc_poly_parcels, buffdist):
+        '''{LUTYPE: on-parcel area (ft2)} within buffer_fc(buffdist), from one overlay of the buffer with
+        fc_poly_parcels (see polygon_overlay.py). Every metric using the same parcel year shares the overlay.'''
+        lu_key = (fc_poly_parcels, buffdist)
+        if self._lu_areas.get(lu_key) is None:
+            self._lu_areas[lu_key] = polygon_overlay.lutype_areas(self, fc_poly_parcels, buffdist)
+
+        return self._lu_areas[lu_key]
+
+    def cleanup(self):
+        '''delete scratch buffers and layers made by this context, including the dissolved project line'''
+        if self.geom_only:
+            return
+
+        items = list(self._buff_fls.values()) + list(self._buff_fcs.values())
+        if self._fl_project is not None:
+            items.append(self._fl_project)
+        if self.fc_project != self.fc_project_in and not self._is_copy:
+            items.append(self.fc_project) # made by dissolve_project()
+
+        for item in items:
+            try:
+                if arcpy.Exists(item): arcpy.Delete_management(item)
+            except:
+                arcpy.AddWarning("Unable to delete {}".format(item))
+                continue
+
+        self._buff_fcs = {}
+        self._buff_fls = {}
+        self._fl_project = None
+
+
+if __name__ == '__main__':
+    arcpy.env.workspace = params.fgdb
+
+    project_fc = r'I:\Projects\Darren\PPA_V2_GIS\PPA_V2.gdb\Polylines_1'
+    ctx = ProjectContext(project_fc, params.ptype_arterial)
+    print(ctx.len_mi, ctx.buffer_acres(params.ilut_sum_buffdist))
+    ctx.cleanup()
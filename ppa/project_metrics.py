@@ -0,0 +1,272 @@
+# --------------------------------
+# Name: project_metrics.py
+# Purpose: All metric values for one project: the metric_dag nodes for single-year and multi-year metrics, and
+#           combining their results into the metrics-as-rows table used by the PPA report. Kept out of the
+#           PPA2_master_project.py tool script so that worker processes can import the node functions.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import pandas as pd
+
+import ppa_input_params as params
+import accessibility_calcs as acc
+import collisions as coll
+import complete_street_score as cs
+import get_buff_netmiles as bnmi
+import get_line_overlap as linex
+import get_lutype_acres as lutype_ac
+import get_truck_data_fwy as truck_fwy
+import intersection_density as intsxn
+from landuse_buff_calcs import LUSumSpec, point_sum_batch
+import link_occup_data as link_occ
+from metric_dag import MetricNode, DepResult, run_dag
+import mix_index_for_project as mixidx
+import npmrds_data_conflation as npmrds
+from project_context import ProjectContext
+import result_cache
+import transit_svc_measure as trnsvc
+import urbanization_metrics as urbn
+import ppa_utils as utils
+
+
+# Pandas orient values need to be up here so that publishing process does not assign wrong variable.
+# must be global variable
+start_string = '999INDEX'
+df_orient_val = start_string.replace('999','').lower()
+
+ilut_val_fields = [params.col_pop_ilut, params.col_du, params.col_emptot, params.col_k12_enr, params.col_empind,
+                   params.col_persntrip_res] + params.ilut_ptrip_mode_fields
+
+# all parcel sums used by metrics, so that each year's parcel data only get loaded once (see get_lu_data())
+mixidx_sum_spec, mixidx_lutype_spec = mixidx.mix_idx_lu_specs()
+lu_specs = {'job_du_dens': LUSumSpec([params.col_emptot, params.col_du], params.ilut_sum_buffdist, density=True),
+            'ej_pop': LUSumSpec([params.col_pop_ilut], params.ilut_sum_buffdist, params.col_ej_ind),
+            'cs_lu': cs.cs_lu_spec(),
+            'ilut': LUSumSpec(ilut_val_fields, params.ilut_sum_buffdist),
+            'housing_mix': LUSumSpec([params.col_du], params.du_mix_buffdist, params.col_housing_type, ['Other']),
+            'mixidx_sums': mixidx_sum_spec,
+            'mixidx_lutype_ac': mixidx_lutype_spec}
+
+singleyr_lu_specs = ['job_du_dens', 'ej_pop', 'cs_lu']  # base year only
+multiyr_lu_specs = ['ilut', 'housing_mix', 'mixidx_sums', 'mixidx_lutype_ac']
+
+# buffer distances that single-year metric nodes get through proj_ctx.buffer_fc()/buffer_fl(). These buffers are
+# made before the nodes are run, so that worker processes reuse them instead of each making their own.
+singleyr_buffdists = [params.ilut_sum_buffdist, params.intersxn_dens_buff, params.trn_buff_dist, params.bikeway_buff]
+multiyr_buffdists = [params.ilut_sum_buffdist] # each year's natural resource acres overlay
+
+
+def get_lu_data(year, proj_ctx, spec_names):
+    '''Get parcel sums for all named lu_specs in one pass over the year's parcel points. Returns dict of
+    {spec name: output dict}'''
+    pcl_pt_fc = params.parcel_pt_fc_yr(year)
+    lu_dicts = point_sum_batch(pcl_pt_fc, proj_ctx, [lu_specs[name] for name in spec_names])
+
+    return dict(zip(spec_names, lu_dicts))
+
+
+def singleyr_metric_nodes(fc_project, projtyp, adt, posted_speedlim, proj_ctx, lu_data):
+    '''metric_dag nodes for the metrics that only have a base year value. None of these depend on each
+    other, so they can all run at the same time.'''
+    pcl_poly_fc = params.parcel_poly_fc_yr(params.base_year)
+    pcl_pt_fc = params.parcel_pt_fc_yr(params.base_year)
+    ctx_kw = {'proj_ctx': proj_ctx}
+
+    # land use types always in the output, even if not within the project buffer
+    lutypes_out = sorted(set([params.lutype_ag] + params.lutypes_nat_resources))
+
+    nodes = [
+        MetricNode('accdata', acc.get_acc_data_with_ej, (fc_project, params.accdata_fc, projtyp), ctx_kw),
+        MetricNode('collision_data', coll.get_collision_data, (fc_project, projtyp, params.collisions_fc, adt), ctx_kw),
+        MetricNode('complete_street_score', cs.complete_streets_idx,
+                   (pcl_pt_fc, fc_project, projtyp, posted_speedlim, params.trn_svc_fc),
+                   dict(ctx_kw, lu_vals_dict=lu_data['cs_lu'])),
+        MetricNode('lutype_areas', lutype_ac.get_lutype_areas, (fc_project, projtyp, pcl_poly_fc), ctx_kw),
+        MetricNode('lutype_acres', lutype_ac.get_lu_acres_by_type, (fc_project, projtyp, pcl_poly_fc, lutypes_out),
+                   dict(ctx_kw, lutype_areas=DepResult('lutype_areas'))), # land use composition, incl. ag acres
+        MetricNode('intersxn_data', intsxn.intersection_density, (fc_project, params.intersections_base_fc, projtyp),
+                   ctx_kw),
+        MetricNode('transit_data', trnsvc.transit_svc_density, (fc_project, params.trn_svc_fc, projtyp), ctx_kw),
+        MetricNode('bikeway_data', bnmi.get_bikeway_mileage_share, (fc_project, params.ptype_sgr), ctx_kw),
+        MetricNode('infill_status', urbn.projarea_infill_status, (fc_project, params.comm_types_fc), ctx_kw)
+        ]
+
+    # all freeways are STAA truck routes; truck share of AADT is only for freeways, and comes from the same
+    # TMC conflation as the speed and reliability data
+    if projtyp != params.ptype_fwy:
+        nodes.append(MetricNode('npmrds_data', npmrds.get_npmrds_data, (fc_project, projtyp), ctx_kw))
+        nodes.append(MetricNode('truck_route_pct', linex.get_line_overlap,
+                                (fc_project, params.freight_route_fc, params.freight_route_fc), ctx_kw))
+    else:
+        nodes.append(MetricNode('npmrds_truck_data', truck_fwy.get_tmc_speed_truck_data, (fc_project, projtyp),
+                                ctx_kw))
+
+    return nodes
+
+
+def singleyr_outputs(metric_results, projtyp, lu_data, out_dict={}):
+    '''Combines results of singleyr_metric_nodes() and base year parcel sums into single-year output df'''
+    accdata, accdata_ej = metric_results['accdata'] # all-population and EJ accessibility data
+    collision_data = metric_results['collision_data']
+    complete_street_score = metric_results['complete_street_score']
+    truck_route_pct = {'pct_proj_STAATruckRoutes': 1} if projtyp == params.ptype_fwy else \
+        metric_results['truck_route_pct']
+    lutype_acres = metric_results['lutype_acres']
+    if projtyp == params.ptype_fwy:
+        npmrds_data, pct_adt_truck = metric_results['npmrds_truck_data']
+    else:
+        npmrds_data, pct_adt_truck = metric_results['npmrds_data'], {"pct_truck_aadt": -1}
+    intersxn_data = metric_results['intersxn_data']
+    transit_data = metric_results['transit_data']
+    bikeway_data = metric_results['bikeway_data']
+    infill_status = metric_results['infill_status']
+    
+    # total job + du density (base year only, for state-of-good-repair proj eval only)
+    job_du_dens = dict(lu_data['job_du_dens'])
+    comb_du_dens = sum(list(job_du_dens.values()))
+    job_du_dens['job_du_perNetAcre'] = comb_du_dens
+
+    # get EJ data
+    ej_data = dict(lu_data['ej_pop'])
+    
+    ej_flag_dict = {0: "Pop_NonEJArea", 1: "Pop_EJArea"}  # rename keys from 0/1 to more human-readable names
+    ej_data = utils.rename_dict_keys(ej_data, ej_flag_dict)
+    total_pop = sum(list(ej_data.values()))
+    ej_data["Pct_PopEJArea"] = ej_data["Pop_EJArea"] / total_pop if total_pop > 0 else 0
+    
+    ej_data.update(accdata_ej)
+    
+
+    # for base dict, add items that only have a base year value (no future year values)
+    out_dict = dict(out_dict)
+    for d in [accdata, collision_data, complete_street_score, truck_route_pct, pct_adt_truck, lutype_acres,
+              intersxn_data, npmrds_data, transit_data, bikeway_data, infill_status, job_du_dens, ej_data]:
+        if d is None:
+            continue
+        else:
+            out_dict.update(d)
+            
+
+    outdf = pd.DataFrame.from_dict(out_dict, orient=df_orient_val)
+    
+    return outdf
+
+
+def get_singleyr_data(fc_project, projtyp, adt, posted_speedlim, out_dict={}, proj_ctx=None, lu_data=None):
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, projtyp)
+
+    if lu_data is None:
+        lu_data = get_lu_data(params.base_year, proj_ctx, singleyr_lu_specs)
+
+    proj_ctx.build_buffers(singleyr_buffdists)
+    metric_results = run_dag(singleyr_metric_nodes(fc_project, projtyp, adt, posted_speedlim, proj_ctx, lu_data))
+
+    return singleyr_outputs(metric_results, projtyp, lu_data, out_dict)
+
+
+def get_multiyear_data(project_fc, project_type, base_df, analysis_year, proj_ctx=None, lu_data=None,
+                       lutype_areas=None):
+
+    fc_pcl_poly = params.parcel_poly_fc_yr(analysis_year)
+    fc_modelhwylinks = params.model_links_fc(analysis_year)
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(project_fc, project_type)
+
+    if lu_data is None:
+        lu_data = get_lu_data(analysis_year, proj_ctx, multiyr_lu_specs)
+
+    year_dict = {}
+    # get data on pop, job, k12 totals
+    ilut_buff_vals = dict(lu_data['ilut'])
+
+    ilut_indjob_share = ilut_buff_vals[params.col_empind] / ilut_buff_vals[params.col_emptot] if ilut_buff_vals[params.col_emptot] > 0 else 0
+    ilut_indjob_dval = {"{}_jobshare".format( params.col_empind): ilut_indjob_share}
+    ilut_buff_vals.update(ilut_indjob_dval)
+
+    # get mode share if total person trips > 0 else return -1 as "no data" value
+    ilut_mode_split = {"{}_share".format(modetrp): ilut_buff_vals[modetrp] / ilut_buff_vals[params.col_persntrip_res]
+                       if ilut_buff_vals[params.col_persntrip_res] != 0 else -1
+                       for modetrp in params.ilut_ptrip_mode_fields}
+    ilut_buff_vals.update(ilut_mode_split)
+
+    # cleanup to remove non-percentage mode split values, if we want to keep output CSV from getting too long.
+    # for trip_numcol in params.ilut_ptrip_mode_fields: del ilut_buff_vals[trip_numcol]
+
+    # job + du total
+    job_du_tot = {"SUM_JOB_DU": ilut_buff_vals[ params.col_du] + ilut_buff_vals[ params.col_emptot]}
+
+    # model-based vehicle occupancy
+    veh_occ_data = link_occ.get_linkoccup_data(project_fc, project_type, fc_modelhwylinks, proj_ctx=proj_ctx)
+
+    # land use diversity index
+    mix_index_data = mixidx.mix_idx_from_sums(lu_data['mixidx_sums'], lu_data['mixidx_lutype_ac'])
+
+    # housing type mix
+    housing_mix_data = dict(lu_data['housing_mix'])
+
+    # acres of "natural resources" (land use type = forest or agriculture)
+    nat_resources_data = urbn.nat_resources(project_fc, project_type, fc_pcl_poly, analysis_year, proj_ctx=proj_ctx,
+                                            lutype_areas=lutype_areas)
+
+    # combine into dict
+    for d in [ilut_buff_vals, job_du_tot, veh_occ_data, mix_index_data, housing_mix_data, nat_resources_data]:
+        year_dict.update(d) 
+
+    # make dict into dataframe
+    df_year_out = pd.DataFrame.from_dict(year_dict, orient=df_orient_val)
+    
+    return df_year_out
+
+
+def get_project_data(fc_project, projtyp, adt, posted_speedlim, out_dict={}, analysis_years=None, proj_ctx=None,
+                     use_cache=None):
+    '''All metric values for a project, with metrics as rows and a projval_<year> column for each analysis year.
+    Single-year metrics and each analysis year's metrics are all nodes of one metric_dag graph, so that the
+    years run at the same time, each in its own process and scratch workspace.
+    If use_cache (default params.use_result_cache), metric results are saved and reused for later runs of the
+    same project geometry, type, ADT, and speed limit (see result_cache.py).'''
+    analysis_years = analysis_years if analysis_years else params.analysis_years
+    use_cache = params.use_result_cache if use_cache is None else use_cache
+
+    if proj_ctx is None:
+        proj_ctx = ProjectContext(fc_project, projtyp)
+
+    cached_results = None
+    if use_cache:
+        cache_key = result_cache.project_cache_key(proj_ctx.geometry, projtyp, adt, posted_speedlim, analysis_years)
+        cached_results = result_cache.get_cache().get(cache_key)
+
+    if cached_results is not None:
+        lu_data_base = cached_results['lu_data_base']
+        metric_results = cached_results['metric_results']
+    else:
+        # all base year parcel sums, single-year and multi-year, come from one pass over the base year parcels.
+        # Other years' parcel sums are done within their own node.
+        lu_data_base = get_lu_data(params.base_year, proj_ctx, singleyr_lu_specs + multiyr_lu_specs)
+
+        # buffers for all nodes, including each year's, are made here so the year nodes don't each make their own
+        proj_ctx.build_buffers(sorted(set(singleyr_buffdists + multiyr_buffdists)))
+        nodes = singleyr_metric_nodes(fc_project, projtyp, adt, posted_speedlim, proj_ctx, lu_data_base)
+        for year in analysis_years:
+            lu_data_yr = lu_data_base if year == params.base_year else None
+            # base year natural resource acres use the same parcel overlay as ag acres
+            lu_areas_yr = DepResult('lutype_areas') if year == params.base_year else None
+            nodes.append(MetricNode('multiyr_{}'.format(year), get_multiyear_data, (fc_project, projtyp, None, year),
+                                    {'proj_ctx': proj_ctx, 'lu_data': lu_data_yr, 'lutype_areas': lu_areas_yr}))
+
+        metric_results = run_dag(nodes)
+
+        if use_cache:
+            result_cache.get_cache().put(cache_key, {'lu_data_base': lu_data_base, 'metric_results': metric_results})
+
+    outdf_base = singleyr_outputs(metric_results, projtyp, lu_data_base, out_dict)
+    year_dfs = {year: metric_results['multiyr_{}'.format(year)] for year in analysis_years}
+
+    return utils.combine_year_dfs(outdf_base, year_dfs, 'projval')
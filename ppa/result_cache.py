@@ -0,0 +1,161 @@
+# --------------------------------
+# Name: result_cache.py
+# Purpose: Saves each project's metric results to disk so that re-running the same project (e.g. with different
+#           performance outcomes selected or a different project name) skips straight to making the report.
+#           Results are keyed by a hash of the project geometry, project type, ADT, speed limit, analysis years,
+#           the geometry backend and buffer/search distances, and the versions of the input layers (rows of
+#           params.data_version_table or the file geodatabase's mod time, plus the mod times of layer stores). Each
+#           entry is one pickle file; when the cache is bigger than params.result_cache_max_mb, the least recently
+#           used entries are deleted. Entries that can't be read are deleted and treated as not in the cache.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import ppa_input_params as params
+import layer_store
+import ppa_utils as utils
+
+cache_file_ext = '.pkl'
+
+# params that change metric values; changing any of them makes a new cache key
+output_params = ['geom_backend', 'bg_search_dist', 'tmc_select_srchdist', 'tmc_buff_dist_ft', 'line_overlap_srchdist',
+                 'line_overlap_buff_dist_ft', 'mix_index_buffdist', 'du_mix_buffdist', 'ilut_sum_buffdist',
+                 'modlink_searchdist', 'colln_searchdist', 'trn_buff_dist', 'cs_buffdist', 'intersxn_dens_buff',
+                 'bikeway_buff', 'buff_nat_resources']
+
+
+def geometry_hash(geom):
+    '''hash of project geometry (shapely or arcpy) that is the same for the same line drawn with vertices in a different
+    order or with tiny coordinate differences'''
+    if shapely is not None:
+        if not isinstance(geom, shapely.Geometry):
+            geom = shapely.from_wkb(bytes(geom.WKB))
+        geom = shapely.normalize(shapely.set_precision(geom, params.result_cache_xy_tol))
+        geom_wkb = shapely.to_wkb(geom, output_dimension=2, byte_order=1)
+    else:
+        geom_wkb = bytes(geom.WKB)
+
+    return hashlib.sha256(geom_wkb).hexdigest()
+
+
+def input_layer_versions(analysis_years):
+    '''{layer name: version} for all input layers. Layers with a layer_store also include the time the store was made.
+    Layer versions are read once from params.data_version_table or the file geodatabase's mod time (see
+    layer_store.source_version()), not from the layers themselves; params.input_data_version is used if neither
+    can be read.'''
+    layers = [params.accdata_fc, params.collisions_fc, params.trn_svc_fc, params.freight_route_fc,
+              params.intersections_base_fc, params.comm_types_fc, params.reg_centerline_fc,
+              params.reg_artcollcline_fc, params.reg_bikeway_fc, params.fc_speed_data]
+    for year in analysis_years:
+        layers += [params.parcel_pt_fc_yr(year), params.parcel_poly_fc_yr(year), params.model_links_fc(year)]
+
+    layer_versions = {}
+    for layer in layers:
+        layer_ver = {}
+        store_dir = params.layer_store_path(layer)
+        if layer_store.store_exists(store_dir):
+            layer_ver['store'] = os.path.getmtime(os.path.join(store_dir, layer_store.meta_file))
+
+        source_ver = layer_store.source_version(layer)
+        layer_ver['source'] = source_ver if source_ver is not None else params.input_data_version
+
+        layer_versions[layer] = layer_ver
+
+    return layer_versions
+
+
+def project_cache_key(geom, project_type, adt, posted_speedlim, analysis_years):
+    key_items = {'geometry': geometry_hash(geom), 'project_type': project_type, 'adt': adt,
+                 'speedlim': posted_speedlim, 'years': sorted(analysis_years),
+                 'data_version': params.input_data_version, 'layers': input_layer_versions(analysis_years),
+                 'params': {p: getattr(params, p) for p in output_params}}
+    key_str = json.dumps(key_items, sort_keys=True, default=str)
+
+    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    '''Folder of pickled results, one file per key. A file's modified time is its last use, for LRU eviction.'''
+    def __init__(self, cache_dir, max_mb):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 ** 2
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + cache_file_ext)
+
+    def get(self, key):
+        '''cached value for key, or None if not in cache. Entries that can't be unpickled (e.g. partly written, or
+        saved by an older version of the tool whose classes have since changed) are deleted.'''
+        cache_file = self._path(key)
+        try:
+            with open(cache_file, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(cache_file) # mark as most recently used
+        except OSError:
+            utils.add_message("Result cache miss ({})".format(key[:12]))
+            return None
+        except (EOFError, AttributeError, ImportError, pickle.UnpicklingError) as e:
+            utils.add_message("Result cache entry {} could not be read ({}); deleting it.".format(key[:12], e))
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+            return None
+
+        utils.add_message("Result cache hit ({}). Using saved metric results.".format(key[:12]))
+        return value
+
+    def put(self, key, value):
+        # write to temp file then rename, so other processes never read a partly written file
+        fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, self._path(key))
+
+        self.evict()
+
+    def evict(self):
+        '''delete least recently used entries until cache is no bigger than max_bytes'''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(cache_file_ext):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except OSError:
+                continue
+
+
+_caches = {}
+
+
+def get_cache(cache_dir=None, max_mb=None):
+    '''ResultCache for cache_dir (default params.result_cache_dir), made once per process'''
+    cache_dir = cache_dir if cache_dir else params.result_cache_dir
+    if _caches.get(cache_dir) is None:
+        _caches[cache_dir] = ResultCache(cache_dir, max_mb if max_mb else params.result_cache_max_mb)
+
+    return _caches[cache_dir]
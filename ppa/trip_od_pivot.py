@@ -0,0 +1,272 @@
+# --------------------------------
+# Name: trip_od_pivot.py
+# Purpose: Trip data by geometry (e.g. block group) for each trip end (origin, destination), with a column for each
+#           value of each case field (mode, purpose) plus a total, as used by the ReplicaDataSummary trip shed tools.
+#           Geometry IDs and case values are factorized once, and the counts (and sums, if needed) for every
+#           trip end, case field, and case value come from one np.bincount over combined group keys, instead of
+#           one pivot_table per trip end and case field followed by merges.
+#
+#           Counts are first made as "group sums" (group_sums()): a long table of trip count and value sum for each
+#           trip end, case field, geometry and case value, plus the same for all trips by case value. Group sums of
+#           different parts of the trip data can be added together (fold_group_sums()), so very large downloads can
+#           be read in chunks (stream_group_sums()), with memory use depending on the number of geometries and case
+#           values, not the number of trips. Because only trip counts and value sums are kept, the aggregations
+#           that can be made from them are count, sum, and mean (agg_fxns).
+#
+#           od_table() makes the same table as the pivot + merge version: for each trip end, the trip end's ID
+#           field, <case value>_<trip end> for each case value (values that are in more than one case field get
+#           the case field's position added, e.g. COMMERCIAL_1_orig), then <col_tot>_<trip end>. Geometries with no
+#           trips for a trip end have nulls for that trip end's columns.
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import ppa_utils as utils
+import metric_dag
+
+agg_count = 'count'
+agg_sum = 'sum'
+agg_mean = 'mean'
+agg_fxns = [agg_count, agg_sum, agg_mean]
+
+# group sums columns
+col_endpt = 'endpt'
+col_case_idx = 'case_idx' # position of case field in case_fields; len(case_fields) = totals for the trip end
+col_geom_id = 'geom_id'
+col_case_val = 'case_val'
+col_n = 'n' # trips with a non-null value field
+col_val_sum = 'val_sum'
+geom_group_cols = [col_endpt, col_case_idx, col_geom_id, col_case_val]
+case_group_cols = [col_case_idx, col_case_val]
+
+default_chunk_rows = 1000000
+
+
+def factorize_ids(df_trips, id_fields):
+    '''(list of integer codes for each of id_fields, unique IDs). All of id_fields are factorized together, so the
+    same geometry has the same code whether it's a trip origin or destination. Null IDs get code -1.'''
+    n_trips = df_trips.shape[0]
+    codes, geom_ids = pd.factorize(pd.concat([df_trips[f] for f in id_fields], ignore_index=True))
+    if pd.api.types.is_integer_dtype(geom_ids.dtype):
+        geom_ids = geom_ids.to_numpy(dtype='int64') # incl. nullable Int64 IDs (nulls got code -1, so none are left)
+    elif geom_ids.dtype.kind == 'f' and np.all(np.mod(geom_ids, 1) == 0):
+        geom_ids = geom_ids.to_numpy().astype('int64') # integer IDs read as floats because some trips had no ID
+    else:
+        geom_ids = geom_ids.to_numpy()
+
+    return [codes[i * n_trips:(i + 1) * n_trips] for i in range(len(id_fields))], geom_ids
+
+
+def case_codes(vals):
+    '''(integer codes, sorted case values) of case field vals. Null values get code -1.'''
+    if isinstance(vals.dtype, pd.CategoricalDtype):
+        # codes of categories in sorted order, without converting the whole column to text
+        cats = vals.cat.categories
+        sort_order = np.argsort(np.asarray(cats, dtype=object))
+        code_map = np.empty(len(cats) + 1, dtype='int64')
+        code_map[sort_order] = np.arange(len(cats))
+        code_map[-1] = -1
+        return code_map[vals.cat.codes.to_numpy()], list(cats[sort_order])
+
+    codes, labels = pd.factorize(vals, sort=True)
+    return codes, list(labels)
+
+
+def agg_values(n, val_sums, agg_fxn):
+    '''agg_fxn of groups with n trips and val_sums sums of the value field. Null for groups with no trips.'''
+    if agg_fxn == agg_count:
+        agg_vals = np.asarray(n, dtype='float64')
+    elif agg_fxn == agg_sum:
+        agg_vals = np.asarray(val_sums, dtype='float64')
+    else:
+        agg_vals = np.asarray(val_sums, dtype='float64') / np.where(n > 0, n, 1)
+
+    return np.where(n > 0, agg_vals, np.nan)
+
+
+def group_sums(df_trips, endpt_id_fields, case_fields, val_field, with_sums=False):
+    '''(geometry group sums, all-trip group sums) of df_trips. endpt_id_fields = {trip end name: ID field}, e.g.
+    {'orig': 'origin_bgrp', 'dest': 'destination_bgrp'}. Group sums have the number of trips with a non-null
+    val_field (col_n) and, if with_sums is True, the sum of val_field (col_val_sum), for:
+        geometry group sums - each trip end, case field (and totals), geometry, and case value
+        all-trip group sums - each case field and case value'''
+    n_trips = df_trips.shape[0]
+    endpt_codes, geom_ids = factorize_ids(df_trips, list(endpt_id_fields.values()))
+    n_geoms = len(geom_ids)
+
+    vals = df_trips[val_field]
+    is_valid = vals.notna().to_numpy()
+    weights = vals.to_numpy(dtype='float64', na_value=0) if with_sums else None
+
+    # each (trip end or all trips, case field) is a block of n geometries * n case values group keys. Totals are a
+    # case field with one value.
+    cases = [case_codes(df_trips[f]) for f in case_fields] + [(np.zeros(n_trips, dtype='int64'), [None])]
+    all_trip_codes = np.zeros(n_trips, dtype='int64')
+    blocks = [(endpt_name, geom_codes, n_geoms) for endpt_name, geom_codes in zip(endpt_id_fields.keys(), endpt_codes)] \
+        + [(None, all_trip_codes, 1)]
+
+    keys = []
+    key_rows = []
+    block_list = [] # (trip end name, case field position, case values, block start, n geometries in block)
+    block_start = 0
+    for endpt_name, geom_codes, n_block_geoms in blocks:
+        for idx, (codes, labels) in enumerate(cases):
+            if endpt_name is None and labels == [None]:
+                continue # total of all trips isn't needed
+            in_group = np.flatnonzero(is_valid & (geom_codes >= 0) & (codes >= 0))
+            keys.append(block_start + geom_codes[in_group] * len(labels) + codes[in_group])
+            if with_sums:
+                key_rows.append(in_group)
+            block_list.append((endpt_name, idx, labels, block_start, n_block_geoms))
+            block_start += n_block_geoms * len(labels)
+
+    keys = np.concatenate(keys)
+    counts = np.bincount(keys, minlength=block_start)
+    sums = np.bincount(keys, weights=weights[np.concatenate(key_rows)], minlength=block_start) if with_sums \
+        else np.zeros(block_start)
+
+    # every geometry that is a trip end gets a totals row, even if none of its trips have a value
+    endpt_geoms = {endpt_name: np.flatnonzero(np.bincount(geom_codes[geom_codes >= 0], minlength=n_geoms))
+                   for endpt_name, geom_codes, n_block_geoms in blocks if endpt_name is not None}
+
+    geom_groups = []
+    case_groups = []
+    for endpt_name, idx, labels, block_start, n_block_geoms in block_list:
+        block_end = block_start + n_block_geoms * len(labels)
+        if endpt_name is not None and labels == [None]:
+            geom_codes = endpt_geoms[endpt_name]
+            label_codes = np.zeros(geom_codes.shape[0], dtype='int64')
+        else:
+            geom_codes, label_codes = np.divmod(np.flatnonzero(counts[block_start:block_end]), len(labels))
+        key_idx = block_start + geom_codes * len(labels) + label_codes
+
+        df_block = pd.DataFrame({col_case_idx: idx,
+                                 col_case_val: pd.Series(np.array(labels, dtype=object)[label_codes], dtype=object),
+                                 col_n: counts[key_idx], col_val_sum: sums[key_idx]})
+        if endpt_name is None:
+            case_groups.append(df_block)
+        else:
+            df_block.insert(0, col_geom_id, geom_ids[geom_codes])
+            df_block.insert(0, col_endpt, endpt_name)
+            geom_groups.append(df_block)
+
+    return (pd.concat(geom_groups, ignore_index=True)[geom_group_cols + [col_n, col_val_sum]],
+            pd.concat(case_groups, ignore_index=True)[case_group_cols + [col_n, col_val_sum]])
+
+
+def fold_group_sums(group_sums_list):
+    '''add together list of (geometry group sums, all-trip group sums) from different parts of the same trip data'''
+    if len(group_sums_list) == 1:
+        return group_sums_list[0]
+
+    df_geom = pd.concat([g[0] for g in group_sums_list], ignore_index=True) \
+        .groupby(geom_group_cols, sort=False, dropna=False, as_index=False)[[col_n, col_val_sum]].sum()
+    df_case = pd.concat([g[1] for g in group_sums_list], ignore_index=True) \
+        .groupby(case_group_cols, sort=False, dropna=False, as_index=False)[[col_n, col_val_sum]].sum()
+
+    return df_geom, df_case
+
+
+def file_group_sums(csv_file, fields, endpt_id_fields, case_fields, val_field, with_sums=False,
+                    chunk_rows=default_chunk_rows):
+    '''group sums of trip data CSV csv_file, read chunk_rows rows at a time. Returns None if the file has no trips.'''
+    file_sums = None
+    cat_dtypes = {f: 'category' for f in case_fields}
+    for df_chunk in pd.read_csv(csv_file, usecols=fields, dtype=cat_dtypes, chunksize=chunk_rows):
+        chunk_sums = group_sums(df_chunk, endpt_id_fields, case_fields, val_field, with_sums)
+        file_sums = chunk_sums if file_sums is None else fold_group_sums([file_sums, chunk_sums])
+
+    return file_sums
+
+
+def stream_group_sums(csv_files, fields, endpt_id_fields, case_fields, val_field, with_sums=False,
+                      chunk_rows=default_chunk_rows, max_workers=None):
+    '''group sums of all trip data in csv_files, without loading any file whole. Files are read at the same time by
+    up to max_workers processes (default one per CPU).'''
+    file_fxn = partial(file_group_sums, fields=fields, endpt_id_fields=endpt_id_fields, case_fields=case_fields,
+                       val_field=val_field, with_sums=with_sums, chunk_rows=chunk_rows)
+
+    n_workers = min(max_workers if max_workers else os.cpu_count(), len(csv_files))
+    utils.add_message("aggregating trip data from {} files, {} rows at a time...".format(len(csv_files), chunk_rows))
+    if n_workers <= 1:
+        file_sums = [file_fxn(csv_file) for csv_file in csv_files]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=metric_dag.get_mp_context()) as pool:
+            file_sums = list(pool.map(file_fxn, csv_files))
+
+    return fold_group_sums([fs for fs in file_sums if fs is not None])
+
+
+def od_table(df_geom_groups, endpt_id_fields, n_case_fields, agg_fxn=agg_count, col_tot='tot_trips',
+             col_master_id='master_geom_id'):
+    '''One row per geometry ID that is a trip end in geometry group sums df_geom_groups (from group_sums()), with
+    agg_fxn (count, sum, or mean) of the value field for each trip end, by each value of each case field and in
+    total. n_case_fields = number of case fields the group sums were made with.'''
+    if agg_fxn not in agg_fxns:
+        raise ValueError("Trip data aggregation must be one of {}, not {}".format(agg_fxns, agg_fxn))
+
+    # master list of geometries, in order of first appearance as origin, then as destination
+    df_totals = df_geom_groups[df_geom_groups[col_case_idx] == n_case_fields]
+    geom_ids = pd.unique(np.concatenate([df_totals.loc[df_totals[col_endpt] == endpt_name, col_geom_id].to_numpy()
+                                         for endpt_name in endpt_id_fields.keys()]))
+    geom_index = pd.Index(geom_ids)
+    n_geoms = len(geom_ids)
+
+    out_cols = {col_master_id: geom_ids}
+    for endpt_name, id_field in endpt_id_fields.items():
+        df_endpt = df_geom_groups[df_geom_groups[col_endpt] == endpt_name]
+        endpt_cols = {}
+        has_trips = np.ones(n_geoms, dtype=bool) # geometries with trips in every case field for this trip end
+        for idx in range(n_case_fields + 1):
+            df_case = df_endpt[(df_endpt[col_case_idx] == idx) & (df_endpt[col_n] > 0)]
+            geom_rows = geom_index.get_indexer(df_case[col_geom_id])
+            has_trips &= np.bincount(geom_rows, minlength=n_geoms) > 0
+
+            if idx == n_case_fields: # totals
+                n = np.bincount(geom_rows, weights=df_case[col_n], minlength=n_geoms)
+                val_sums = np.bincount(geom_rows, weights=df_case[col_val_sum], minlength=n_geoms)
+                endpt_cols[col_tot] = agg_values(n, val_sums, agg_fxn)
+                continue
+
+            case_vals = df_case[col_case_val].to_numpy()
+            for label in sorted(pd.unique(case_vals)):
+                is_label = case_vals == label
+                n = np.bincount(geom_rows[is_label], weights=df_case[col_n][is_label], minlength=n_geoms)
+                val_sums = np.bincount(geom_rows[is_label], weights=df_case[col_val_sum][is_label], minlength=n_geoms)
+                col = label if label not in endpt_cols else '{}_{}'.format(label, idx)
+                endpt_cols[col] = agg_values(n, val_sums, agg_fxn)
+
+        out_cols[id_field] = pd.Series(geom_ids).where(has_trips).to_numpy()
+        for col, col_vals in endpt_cols.items():
+            out_cols['{}_{}'.format(col, endpt_name)] = np.where(has_trips, col_vals, np.nan)
+
+    return pd.DataFrame(out_cols)
+
+
+def case_table(df_case_groups, case_idx, agg_fxn=agg_count):
+    '''Series of agg_fxn of the value field for all trips, by value of case field case_idx (from all-trip group sums
+    made by group_sums()), same as df_trips.groupby(case field)[val_field].agg(agg_fxn)'''
+    df_case = df_case_groups[df_case_groups[col_case_idx] == case_idx].sort_values(col_case_val)
+    agg_vals = agg_values(df_case[col_n].to_numpy(), df_case[col_val_sum].to_numpy(), agg_fxn)
+    if agg_fxn == agg_count:
+        agg_vals = agg_vals.astype('int64')
+
+    return pd.Series(agg_vals, index=df_case[col_case_val].to_numpy())
+
+
+def od_pivot(df_trips, endpt_id_fields, case_fields, val_field, agg_fxn=agg_count, col_tot='tot_trips',
+             col_master_id='master_geom_id'):
+    '''od_table() of trip data df_trips (see group_sums() for arguments)'''
+    geom_sums = group_sums(df_trips, endpt_id_fields, case_fields, val_field, agg_fxn != agg_count)[0]
+
+    return od_table(geom_sums, endpt_id_fields, len(case_fields), agg_fxn, col_tot, col_master_id)
@@ -0,0 +1,170 @@
+# --------------------------------
+# Name: trip_table_store.py
+# Purpose: Load-once, columnar copy of Replica trip data downloads (one or more CSVs of trips), used by the
+#           ReplicaDataSummary trip shed tools. The first run on a download parses the CSVs once, only reading the
+#           needed fields, with compact dtypes (block group IDs as integers, mode/purpose and other text fields as
+#           categories), and saves the table as a memory-mapped store. Later runs on the same download, and later
+#           calls in the same run, open the store instead of re-reading the CSVs. The opened table's columns are
+#           views of the memory-mapped files, so only the parts of the table in use are read into memory.
+#
+#           Store layout (one folder per download + set of fields):
+#               meta.json - field names, dtypes, category labels, source CSVs (path, size, mod time)
+#               <field>.npy - one file per field. Category fields are saved as integer codes (-1 = null)
+#               <field>_isnull.npy - null flags for integer ID fields that have nulls (opened as nullable Int64)
+#
+# Author: Darren Conly
+# Last Updated: 10/2026
+# Updated by: <name>
+# Copyright:   (c) SACOG
+# Python Version: 3.x
+# --------------------------------
+import os
+import json
+import hashlib
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import ppa_input_params as params
+import ppa_utils as utils
+
+meta_file = 'meta.json'
+null_sufx = '_isnull'
+
+_trip_tables = {} # trip tables already loaded by this process, by store folder
+
+
+def source_signature(csv_files):
+    '''[path, size, mod time] of each CSV. A new store is made if any of these change.'''
+    return [[os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)] for f in csv_files]
+
+
+def trip_store_dir(csv_files, fields):
+    '''store folder for csv_files and fields, in params.replica_trip_store_dir or, if that is None, next to the
+    first CSV. The folder name is a hash of the files and fields, so that each download has its own store.'''
+    store_key = json.dumps([source_signature(csv_files), sorted(fields)])
+    store_name = 'tripstore_{}'.format(hashlib.md5(store_key.encode()).hexdigest()[:16])
+    store_root = params.replica_trip_store_dir or os.path.dirname(os.path.abspath(csv_files[0]))
+
+    return os.path.join(store_root, store_name)
+
+
+def compact_dtypes(df_trips, id_fields=[]):
+    '''text fields other than id_fields as categories, so that each distinct value is only stored once'''
+    for f in df_trips.columns:
+        dtype = df_trips[f].dtype
+        if f not in id_fields and not isinstance(dtype, pd.CategoricalDtype) \
+                and (dtype == object or pd.api.types.is_string_dtype(dtype)):
+            df_trips[f] = df_trips[f].astype('category')
+
+    return df_trips
+
+
+def nullable_int_ids(df_trips, id_fields=[]):
+    '''integer ID fields that were read as floats, because some trips have no ID, as nullable Int64'''
+    for f in id_fields:
+        vals = df_trips[f]
+        if vals.dtype.kind == 'f' and np.all(np.mod(vals.dropna().to_numpy(), 1) == 0):
+            df_trips[f] = vals.astype('Int64')
+
+    return df_trips
+
+
+def read_trip_csvs(csv_files, fields, id_fields=[], category_fields=[]):
+    '''one dataframe of fields from all csv_files. category_fields are parsed straight to categories; other text
+    fields are made categories after each file is read.'''
+    cat_dtypes = {f: 'category' for f in category_fields if f not in id_fields}
+    file_dfs = []
+    for csv_file in csv_files:
+        utils.add_message("reading trip data from {}...".format(csv_file))
+        df_file = pd.read_csv(csv_file, usecols=fields, dtype=cat_dtypes)
+        file_dfs.append(compact_dtypes(nullable_int_ids(df_file[fields], id_fields), id_fields))
+
+    if len(file_dfs) == 1:
+        return file_dfs[0]
+
+    # categories differ from file to file, so combine their labels instead of letting concat make them text
+    cat_cols = {f: union_categoricals([df_file[f] for df_file in file_dfs]) for f in fields
+                if all(isinstance(df_file[f].dtype, pd.CategoricalDtype) for df_file in file_dfs)}
+    df_trips = pd.concat([df_file.drop(columns=list(cat_cols.keys())) for df_file in file_dfs], ignore_index=True)
+    for f, vals in cat_cols.items():
+        df_trips[f] = vals
+
+    return df_trips[fields]
+
+
+def write_trip_store(store_dir, df_trips, id_fields=[], source=None):
+    '''save each field of df_trips to its own .npy file in store_dir. meta.json is written last, so a store is only
+    used if it was completely written.'''
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    fields_meta = {}
+    for f in df_trips.columns:
+        vals = df_trips[f]
+        f_path = os.path.join(store_dir, '{}.npy'.format(f))
+        if isinstance(vals.dtype, pd.CategoricalDtype):
+            np.save(f_path, vals.cat.codes.to_numpy())
+            fields_meta[f] = {'dtype': 'category', 'categories': [str(c) for c in vals.cat.categories]}
+            continue
+
+        if pd.api.types.is_extension_array_dtype(vals.dtype) and pd.api.types.is_integer_dtype(vals.dtype):
+            # nullable integer IDs; save as integers, with the nulls flagged in their own file
+            np.save(os.path.join(store_dir, '{}{}.npy'.format(f, null_sufx)), vals.isna().to_numpy())
+            np.save(f_path, vals.to_numpy(dtype='int64', na_value=-1))
+            fields_meta[f] = {'dtype': 'int64', 'has_nulls': True}
+            continue
+
+        vals = vals.to_numpy()
+        fields_meta[f] = {'dtype': str(vals.dtype)}
+        np.save(f_path, vals)
+
+    meta = {'source': source, 'created': str(dt.datetime.now()), 'row_count': int(df_trips.shape[0]),
+            'field_order': list(df_trips.columns), 'fields': fields_meta}
+
+    with open(os.path.join(store_dir, meta_file), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    return store_dir
+
+
+def open_trip_store(store_dir):
+    '''trip table in store_dir, as a dataframe whose columns are views of the memory-mapped .npy files (nothing is
+    copied into memory until used). Integer ID fields with nulls are nullable Int64.'''
+    with open(os.path.join(store_dir, meta_file), 'r') as f:
+        meta = json.load(f)
+
+    cols = {}
+    for f, fmeta in meta['fields'].items():
+        vals = np.load(os.path.join(store_dir, '{}.npy'.format(f)), mmap_mode='r')
+        if fmeta['dtype'] == 'category':
+            cols[f] = pd.Categorical.from_codes(vals, categories=fmeta['categories'])
+        elif fmeta.get('has_nulls'):
+            isnull = np.load(os.path.join(store_dir, '{}{}.npy'.format(f, null_sufx)), mmap_mode='r')
+            cols[f] = pd.arrays.IntegerArray(vals, isnull)
+        else:
+            cols[f] = vals
+
+    return pd.DataFrame(cols, columns=meta['field_order'], copy=False)
+
+
+def load_trip_table(csv_files, fields, id_fields=[], category_fields=[]):
+    '''fields of the trip data in csv_files, as one dataframe. The CSVs are only parsed if they don't yet have a store;
+    within a process the table is only loaded once, so callers must not change the returned dataframe.'''
+    store_dir = trip_store_dir(csv_files, fields)
+    if _trip_tables.get(store_dir) is None:
+        if os.path.exists(os.path.join(store_dir, meta_file)):
+            _trip_tables[store_dir] = open_trip_store(store_dir)
+        else:
+            df_trips = read_trip_csvs(csv_files, fields, id_fields, category_fields)
+            try:
+                write_trip_store(store_dir, df_trips, id_fields, source_signature(csv_files))
+                _trip_tables[store_dir] = open_trip_store(store_dir)
+            except OSError as e:
+                utils.add_message("Could not save trip data store to {} ({}). Using trip data from CSVs." \
+                                  .format(store_dir, e))
+                _trip_tables[store_dir] = df_trips
+
+    return _trip_tables[store_dir]
@@ -25,11 +25,12 @@ from get_lutype_acres import GetLandUseArea
 import ppa_input_params as params
 
 # get list of ctypes that a project passes through. "infill" if ctype = is established or corridor; greenfield if not
-def projarea_infill_status(fc_project, comm_types_fc):
+def projarea_infill_status(fc_project, comm_types_fc, proj_ctx=None):
     arcpy.AddMessage("Determining project greenfield/infill status...")
     temp_intersect_fc = g_ESRI_variable_1
 
-    arcpy.Intersect_analysis([fc_project, comm_types_fc], temp_intersect_fc)
+    fc_proj = proj_ctx.fc_project if proj_ctx is not None else fc_project
+    arcpy.Intersect_analysis([fc_proj, comm_types_fc], temp_intersect_fc)
 
     proj_len_infill = 0
     proj_len_greenfield = 0
@@ -52,16 +53,16 @@ def projarea_infill_status(fc_project, comm_types_fc):
     return {"Project's use of existing assets": category}
 
 
-def nat_resources(fc_project, projtyp, fc_pcl_poly, year=2016):  # NOTE - this is year dependent!
+def nat_resources(fc_project, projtyp, fc_pcl_poly, year=2016, proj_ctx=None, lutype_areas=None):  # NOTE - this is year dependent!
     nat_resource_ac = 0
     
     # pdb.set_trace()
-    pcl_buff_intersect = GetLandUseArea(fc_project, projtyp, fc_pcl_poly)
+    # same parcel overlay as ag acres for this year (lutype_areas if given, otherwise shared through proj_ctx)
+    pcl_buff_intersect = GetLandUseArea(fc_project, projtyp, fc_pcl_poly, proj_ctx, lutype_areas=lutype_areas)
     
+    lutype_ac_dict = pcl_buff_intersect.get_lu_acres_by_type(params.lutypes_nat_resources)
     for lutype in params.lutypes_nat_resources:
-        lutype_ac_dict = pcl_buff_intersect.get_lu_acres(lutype)
-        lutype_acres = lutype_ac_dict['net_{}_acres'.format(lutype)]
-        nat_resource_ac += lutype_acres
+        nat_resource_ac += lutype_ac_dict['net_{}_acres'.format(lutype)]
 
     return {"nat_resource_acres": nat_resource_ac}
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# PPA scripts import each other by module name from the ppa folder (e.g., "import ppa_input_params as params")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'ppa'))
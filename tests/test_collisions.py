@@ -0,0 +1,115 @@
+'''Collision metrics from the shared collision index against one selection per polygon/project'''
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+import ppa_input_params as params
+import layer_store
+import link_midpoints
+import collisions as coll
+from project_context import ProjectContext
+
+fc_collns = 'test_collisions'
+
+
+def make_points(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'x': rng.uniform(0, 20000, n), 'y': rng.uniform(0, 20000, n)}), rng
+
+
+def make_collns(n, seed=0):
+    df, rng = make_points(n, seed)
+    df[params.col_fwytag] = rng.choice([0, 1], n, p=[0.7, 0.3])
+    df[params.col_nkilled] = np.where(rng.uniform(size=n) < 0.05, 1, 0)
+    df[params.col_bike_ind] = np.where(rng.uniform(size=n) < 0.1, params.ind_val_true, 'N')
+    df[params.col_ped_ind] = np.where(rng.uniform(size=n) < 0.1, params.ind_val_true, 'N')
+
+    return df
+
+
+def make_link_midpts(n, seed):
+    df, rng = make_points(n, seed)
+    df[params.col_dayvmt] = rng.uniform(0, 20000, n)
+    df[params.col_distance] = rng.uniform(0.05, 1, n)
+    df[link_midpoints.col_len_ft] = df[params.col_distance] * params.ft2mile
+
+    return df
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    '''stores for a synthetic collision layer and the model link and centerline midpoints it is used with'''
+    monkeypatch.setattr(params, 'layer_store_dir', str(tmp_path))
+    monkeypatch.setattr(coll, '_colln_indexes', {})
+
+    df_collns = make_collns(4000)
+    layer_store.write_point_store(params.layer_store_path(fc_collns), df_collns['x'], df_collns['y'],
+                                  {f: df_collns[f].values for f in coll.colln_cols})
+
+    df_links = make_link_midpts(3000, seed=1)
+    df_clines = make_link_midpts(3000, seed=2)
+    for fc_lines, df_lines in [(params.model_links_fc(), df_links), (params.reg_artcollcline_fc, df_clines)]:
+        layer_store.write_point_store(params.line_midpt_store(fc_lines), df_lines['x'], df_lines['y'],
+                                      {f: df_lines[f].values for f in df_lines.columns if f not in ('x', 'y')})
+
+    return df_collns, df_links, df_clines
+
+
+def select_pts(df_pts, geom, dist=0):
+    '''points of df_pts within dist of geom, i.e. one SelectLayerByLocation per polygon/project'''
+    pts = shapely.points(df_pts['x'], df_pts['y'])
+    in_geom = shapely.intersects(geom, pts) if dist == 0 else shapely.dwithin(geom, pts, dist)
+    return df_pts.loc[in_geom]
+
+
+def per_poly_collision_data(df_collns, df_links, df_clines, poly):
+    '''get_collision_data() for one ptype_area_agg polygon, selecting links, centerlines, and collisions for it alone'''
+    ann_poly_vmt = select_pts(df_links, poly)[params.col_dayvmt].sum() * 320
+    cline_miles = select_pts(df_clines, poly)[link_midpoints.col_len_ft].sum() / params.ft2mile
+
+    return coll.collision_metrics(select_pts(df_collns, poly), cline_miles, ann_poly_vmt)
+
+
+def assert_metrics_equal(out_dict, expected):
+    assert out_dict.keys() == expected.keys()
+    for k in expected:
+        assert out_dict[k] == pytest.approx(expected[k], rel=1e-9)
+
+
+def test_colln_index_partitions(stores):
+    df_collns = stores[0]
+    df_idx, colln_trees = coll.get_colln_index(fc_collns)
+    assert coll.get_colln_index(fc_collns)[1] is colln_trees # made once per process
+
+    assert colln_trees[None][1].shape[0] == df_collns.shape[0]
+    for fwytag in (0, 1):
+        tag_rows = colln_trees[fwytag][1]
+        assert (df_idx[params.col_fwytag].values[tag_rows] == fwytag).all()
+        assert tag_rows.shape[0] == (df_collns[params.col_fwytag] == fwytag).sum()
+
+
+def test_collision_data_multi_matches_per_polygon(stores):
+    polys = [shapely.box(1000, 1000, 9000, 7000), shapely.box(6000, 4000, 15000, 12000), # overlapping
+             shapely.Point(14000, 15000).buffer(4000),
+             shapely.Polygon([(2000, 12000), (9000, 19000), (2000, 19000)])]
+
+    out_vals = coll.get_collision_data_multi(polys, fc_collns)
+    for poly, out_dict in zip(polys, out_vals):
+        assert_metrics_equal(out_dict, per_poly_collision_data(*stores, poly))
+
+
+@pytest.mark.parametrize('project_type', [params.ptype_arterial, params.ptype_fwy])
+def test_project_collision_data_matches_selection(stores, project_type):
+    df_collns = stores[0]
+    line = shapely.LineString([(1000, 1000), (9000, 4000), (12000, 15000)])
+    project_adt = 25000
+
+    proj_ctx = ProjectContext(line, project_type)
+    out_dict = coll.get_collision_data(None, project_type, fc_collns, project_adt, proj_ctx)
+
+    df_sel = select_pts(df_collns, line, params.colln_searchdist)
+    df_sel = df_sel.loc[df_sel[params.col_fwytag] == coll.colln_partition(project_type)]
+    expected = coll.collision_metrics(df_sel, proj_ctx.len_mi, project_adt * proj_ctx.len_mi * 320)
+    assert_metrics_equal(out_dict, expected)
@@ -0,0 +1,95 @@
+'''ShapelyBackend results on small layers whose answers can be worked out by hand'''
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+import ppa_input_params as params
+import layer_store
+import geom_backend
+
+
+@pytest.fixture
+def backend():
+    return geom_backend.ShapelyBackend()
+
+
+@pytest.fixture
+def lines():
+    # three horizontal 100ft lines at y = 0, 50, 200
+    geoms = [shapely.LineString([(0, y), (100, y)]) for y in (0, 50, 200)]
+    return geom_backend.FeatureSet(geoms, pd.DataFrame({'lid': [10, 20, 30]}))
+
+
+def test_select_by_location(backend, lines):
+    project = shapely.LineString([(50, -20), (50, 60)])
+    assert backend.select_by_location(lines, project, geom_backend.rel_intersect).tolist() == [0, 1]
+    assert backend.select_by_location(lines, project, geom_backend.rel_within_dist, 140).tolist() == [0, 1, 2]
+    assert backend.select_by_location(lines, project, geom_backend.rel_within_dist, 139).tolist() == [0, 1]
+
+
+def test_center_in(backend, lines):
+    # box covers the right half of every line, so no line has its center (x=50) strictly inside it
+    box = shapely.box(51, -10, 200, 300)
+    assert backend.select_by_location(lines, box, geom_backend.rel_center_in).tolist() == []
+    box = shapely.box(40, -10, 200, 60)
+    assert backend.select_by_location(lines, box, geom_backend.rel_center_in).tolist() == [0, 1]
+
+
+def test_select_by_location_many(backend, lines):
+    polys = [shapely.box(-10, -10, 10, 10), shapely.box(-10, 40, 10, 210)]
+    pairs = backend.select_by_location_many(lines, polys, geom_backend.rel_intersect)
+    assert pairs.tolist() == [[0, 1, 1], [0, 1, 2]]
+
+
+def test_intersect(backend, lines):
+    polys = geom_backend.FeatureSet([shapely.box(25, -10, 75, 60)], pd.DataFrame({'lid': [99], 'zone': ['A']}))
+    out = backend.intersect(lines, polys)
+    assert len(out) == 2
+    assert np.allclose(backend.lengths(out.geoms), [50, 50])
+    assert out.df.columns.tolist() == ['lid', 'lid_1', 'zone']
+    assert out.df['lid'].tolist() == [10, 20]
+
+
+def test_spatial_join(backend, lines):
+    zones = geom_backend.FeatureSet([shapely.box(-10, -10, 110, 60), shapely.box(-10, 150, 110, 250)])
+    assert backend.spatial_join(lines, zones, geom_backend.rel_intersect).tolist() == [0, 0, 1]
+    assert backend.spatial_join(lines, zones, geom_backend.rel_within_dist, 1).tolist() == [0, 0, 1]
+    lone = geom_backend.FeatureSet([shapely.LineString([(500, 500), (600, 500)])])
+    assert backend.spatial_join(lone, zones, geom_backend.rel_intersect).tolist() == [-1]
+
+
+def test_buffer_and_split(backend):
+    line = shapely.LineString([(0, 0), (100, 0)])
+    assert backend.areas([backend.buffer(line, 10, flat_end=True)])[0] == pytest.approx(2000)
+
+    pieces = backend.split_line_at_points(line, [shapely.Point(30, 1), shapely.Point(80, 50)], tolerance=2)
+    assert np.allclose(backend.lengths(pieces), [30, 70])
+
+
+def test_read_features_from_store(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(params, 'layer_store_dir', str(tmp_path))
+    geoms = [shapely.LineString([(0, 0), (10, 0)]), shapely.LineString([(0, 5), (0, 25)])]
+    layer_store.write_shape_store(params.layer_store_path('test_lines'), list(shapely.to_wkb(geoms)),
+                                  shapely.bounds(geoms), {'name': ['a', 'b'], 'lanes': [2, 4]})
+
+    fs = backend.read_features('test_lines', ['name', 'lanes'])
+    assert fs.df['name'].tolist() == ['a', 'b']
+    assert fs.df['lanes'].tolist() == [2, 4]
+    assert np.allclose(backend.lengths(fs.geoms), [10, 20])
+
+
+def test_read_features_no_store_no_arcpy(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(params, 'layer_store_dir', str(tmp_path))
+    monkeypatch.setattr(geom_backend, 'arcpy', None)
+    with pytest.raises(ValueError, match='no current layer store'):
+        backend.read_features('missing_layer')
+
+
+def test_dissolve(backend):
+    polys = [shapely.box(0, 0, 10, 10), shapely.box(20, 0, 30, 10), shapely.box(10, 0, 20, 10)]
+    fs = geom_backend.FeatureSet(polys, pd.DataFrame({'ctype': ['b', 'a', 'b']}))
+    out = backend.dissolve(fs, 'ctype')
+    assert out.df['ctype'].tolist() == ['b', 'a']
+    assert np.allclose(backend.areas(out.geoms), [200, 100])
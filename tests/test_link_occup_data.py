@@ -0,0 +1,81 @@
+'''Vectorized vehicle occupancy against the original row-by-row calculation'''
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+import ppa_input_params as params
+import layer_store
+import link_midpoints
+import link_occup_data as link_occ
+
+fc_links = 'test_model_links'
+vol_cols = [params.col_sovvol, params.col_hov2vol, params.col_hov3vol, params.col_daycommvehvol]
+
+
+def make_links(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: rng.uniform(0, 5000, n).round() for col in vol_cols})
+    df[params.col_dayvehvol] = df[vol_cols].sum(axis=1)
+    df.loc[::7, vol_cols + [params.col_dayvehvol]] = 0 # links with no volume
+    df[params.col_lanemi] = rng.uniform(0.05, 2, n)
+    df[params.col_tranvol] = np.where(rng.uniform(size=n) < 0.4, rng.uniform(0, 900, n), np.nan)
+    df[params.col_capclass] = rng.choice(params.capclasses_fwy + params.capclass_arterials, n)
+    df['x'], df['y'] = rng.uniform(0, 20000, n), rng.uniform(0, 20000, n)
+
+    return df
+
+
+def rowloop_wtdavg_vehocc(in_df):
+    '''original get_wtdavg_vehocc(): occupancy of each link with DataFrame.apply'''
+    in_df = in_df.loc[in_df[params.col_dayvehvol] > 0].copy()
+    link_vals = in_df.apply(lambda x: link_occ.link_vehocc(x), axis=1)
+
+    return in_df[params.col_lanemi].dot(link_vals) / in_df[params.col_lanemi].sum()
+
+
+def rowloop_linkoccup_data(df_links, geom, project_type):
+    '''original per-project calculation, with links selected by midpoint distance one project at a time'''
+    dists = shapely.distance(geom, shapely.points(df_links['x'], df_links['y']))
+    df_sel = df_links.loc[dists <= params.modlink_searchdist]
+    capclasses = params.capclasses_fwy if project_type == params.ptype_fwy else params.capclass_arterials
+    df_sel = df_sel.loc[df_sel[params.col_capclass].isin(capclasses)]
+
+    df_trn = df_sel.loc[pd.notnull(df_sel[params.col_tranvol])]
+    trantrips = link_occ.get_wtdavg_vehvol(df_trn, params.col_tranvol) if df_trn.shape[0] > 0 else 0
+    vehocc = rowloop_wtdavg_vehocc(df_sel) if df_sel.shape[0] > 0 else 0
+
+    return {"avg_2way_trantrips": trantrips, "avg_2way_vehocc": vehocc}
+
+
+def test_link_vehocc_array_matches_row_loop():
+    df = make_links(500)
+    df = df.loc[df[params.col_dayvehvol] > 0]
+    np.testing.assert_allclose(link_occ.link_vehocc_array(df), df.apply(link_occ.link_vehocc, axis=1).values,
+                               rtol=1e-12)
+
+
+def test_wtdavg_vehocc_matches_row_loop():
+    df = make_links(500, seed=1)
+    assert link_occ.get_wtdavg_vehocc(df) == pytest.approx(rowloop_wtdavg_vehocc(df), rel=1e-12)
+
+
+def test_linkoccup_data_multi_matches_row_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(params, 'layer_store_dir', str(tmp_path))
+    df_links = make_links(3000, seed=2)
+    layer_store.write_point_store(params.line_midpt_store(fc_links), df_links['x'], df_links['y'],
+                                  {f: df_links[f].values for f in link_occ.link_data_fields})
+    assert link_midpoints.has_midpoint_store(fc_links)
+
+    geoms = [shapely.LineString([(1000, 1000), (9000, 4000)]), shapely.box(12000, 12000, 16000, 19000),
+             shapely.LineString([(15000, 2000), (15000, 9000), (19000, 9000)]),
+             shapely.Point(-5000, -5000).buffer(10)] # no links nearby
+    ptypes = [params.ptype_arterial, params.ptype_area_agg, params.ptype_fwy, params.ptype_arterial]
+
+    out_vals = link_occ.get_linkoccup_data_multi(geoms, ptypes, fc_links)
+    for geom, ptype, out_dict in zip(geoms, ptypes, out_vals):
+        expected = rowloop_linkoccup_data(df_links, geom, ptype)
+        assert out_dict.keys() == expected.keys()
+        for k in expected:
+            assert out_dict[k] == pytest.approx(expected[k], rel=1e-9)
@@ -0,0 +1,29 @@
+'''Mix index against stored values from the original row-by-row calculation (tests/data/mix_index_expected.csv)'''
+import os
+
+import numpy as np
+import pandas as pd
+
+import ppa_input_params as params
+import mix_index_for_project as mixidx
+
+expected_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mix_index_expected.csv')
+col_expected = 'expected_mix_index'
+
+
+def test_calc_mix_index_matches_stored_values():
+    in_df = pd.read_csv(expected_csv)
+    out_df = mixidx.calc_mix_index(in_df.drop(columns=col_expected), params.params_df, params.col_hh,
+                                   mixidx.lu_fac_cols, params.mix_idx_col)
+
+    np.testing.assert_allclose(out_df[params.mix_idx_col].values, in_df[col_expected].values, rtol=1e-12,
+                               equal_nan=True)
+
+
+def test_mix_idx_from_sums_matches_stored_values():
+    in_df = pd.read_csv(expected_csv)
+    lu_sums = in_df[mixidx.lu_sum_cols].to_dict('records')
+    lutype_acres = [{params.lutype_parks: park_ac} for park_ac in in_df[params.col_parkac]]
+
+    out_vals = [d[params.mix_idx_col] for d in mixidx.mix_idx_from_sums_batch(lu_sums, lutype_acres)]
+    np.testing.assert_allclose(out_vals, in_df[col_expected].values, rtol=1e-12, equal_nan=True)
@@ -0,0 +1,73 @@
+'''Linear referencing TMC conflation against the split/join version'''
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+import ppa_input_params as params
+import geom_backend
+import npmrds_data_conflation as npmrds
+
+fld_speed = 'test_speed'
+fld_ttr = 'test_ttr'
+fields_calc = {fld_speed: params.calc_inv_avg, fld_ttr: params.calc_distwt_avg}
+dirs = ['EASTBOUND', 'WESTBOUND', 'NORTHBOUND', 'SOUTHBOUND']
+
+
+@pytest.fixture
+def backend():
+    return geom_backend.ShapelyBackend()
+
+
+@pytest.fixture
+def tmc_buffers(backend):
+    # east-west road along y=0 and north-south road along x=3000, each cut into TMCs with both directions
+    lines, df_rows = [], []
+    for i, (x0, x1) in enumerate([(0, 1200), (1200, 2500), (2500, 4000)]):
+        for direcn in ('EASTBOUND', 'WESTBOUND'):
+            lines.append(shapely.LineString([(x0, 0), (x1, 0)]))
+            df_rows.append([direcn, 30 + 5 * i + (direcn == 'WESTBOUND'), 1.1 + 0.1 * i])
+    for i, (y0, y1) in enumerate([(-2000, 500), (500, 3000)]):
+        for direcn in ('NORTHBOUND', 'SOUTHBOUND'):
+            lines.append(shapely.LineString([(3000, y0), (3000, y1)]))
+            df_rows.append([direcn, 40 + 3 * i, 1.3 + 0.2 * i])
+
+    buffs = backend.buffer(np.asarray(lines), 60, flat_end=True)
+    return geom_backend.FeatureSet(buffs, pd.DataFrame(df_rows, columns=[params.col_tmcdir, fld_speed, fld_ttr]))
+
+
+def split_join(backend, line, tmc_buffers):
+    return npmrds.conflate_tmc2projline_split(backend, line, line.length, dirs, params.col_tmcdir, tmc_buffers,
+                                              fields_calc)
+
+
+@pytest.mark.parametrize('line', [
+    shapely.LineString([(300, 5), (3000, 5), (3000, 2200)]), # along one road, then turns onto the other
+    shapely.LineString([(3600, -1), (700, 2)]), # drawn west to east... reversed
+    shapely.MultiLineString([[(100, 0), (900, 0)], [(2990, -1500), (2990, 1500)]]), # two parts that don't touch
+    ])
+def test_lr_matches_split_join(backend, tmc_buffers, line):
+    assert npmrds.lr_supported(line)
+    lr_df = npmrds.conflate_tmc2projline_lr(line, line.length, dirs, params.col_tmcdir, tmc_buffers, fields_calc)
+    sj_df = split_join(backend, line, tmc_buffers)
+
+    assert sorted(lr_df.columns) == sorted(sj_df.columns)
+    for col in sj_df.columns:
+        assert lr_df[col][0] == pytest.approx(sj_df[col][0], rel=1e-6, nan_ok=True), col
+
+
+@pytest.mark.parametrize('line', [
+    shapely.LineString([(500, -30), (2800, 30), (2800, -30), (500, 30)]), # crosses itself
+    shapely.LineString([(500, 0), (2000, 0), (2000, 80), (500, 0)]), # closed loop
+    ])
+def test_non_simple_line_uses_split_join(backend, tmc_buffers, line):
+    assert not npmrds.lr_supported(line)
+
+    class Ctx(object):
+        pass
+    proj_ctx = Ctx()
+    proj_ctx.backend, proj_ctx.shape, proj_ctx.len_ft = backend, line, line.length
+
+    out_df = npmrds.conflate_tmc2projline_backend(proj_ctx, dirs, params.col_tmcdir, tmc_buffers, fields_calc)
+    pd.testing.assert_frame_equal(out_df, split_join(backend, line, tmc_buffers))